@@ -0,0 +1,229 @@
+from collections import OrderedDict, Counter, defaultdict
+import pandas as pd
+import numpy as np
+import shutil
+import json
+import csv
+import os
+
+# columns of a network connections file and their types
+CONNECTION_COLUMNS = {"conn_id": str, "orig_node_id": str, "dest_node_id": str, "orig_lat": np.float64, "orig_lon": np.float64, "dest_lat": np.float64,
+                      "dest_lon": np.float64, "orig_index": np.int64, "dest_index": np.int64, "time_min": np.float64, "distance_km": np.float64}
+
+# version of the binary cache layout; caches written with another version are rebuilt
+CACHE_VERSION = 2
+# default number of connections whose sub trip rows are held in memory at once by a store
+MAX_LOADED_CONNECTIONS = 16
+
+class ConnectionStore:
+    """
+    Represents the sub trip data of a network connections file partitioned by connection identifier. The file is parsed in one pass
+    and rows are grouped by connection in file order, so every `MobilityProfile` gets its rows without re-reading the file.
+    Parsed data is kept in a binary columnar cache next to the file (one `.npy` file per column) that is memory-mapped on later
+    reads; the cache is keyed by the path, modification time, and size of the file (and of the nodes file, if given), and is rebuilt 
+    when either changes.
+    Profiles read lazily fetch their rows through `rows()`, which holds the rows of the most recently used connections in memory.
+    """
+    def __init__(self, file: str, cache: bool=True, max_loaded: int=MAX_LOADED_CONNECTIONS, node_file: str=None):
+        """
+        Creates a `ConnectionStore` instance by reading a connections file.
+        param: file [str] The specified connections file
+        param: cache [bool] Whether to read and write the binary cache of the file
+        param: max_loaded [int] The number of connections whose rows `rows()` holds in memory at once
+        param: node_file [str] Optional nodes file of the network; with it, rows repeated by re-run queries are told apart by location
+        """
+        self.file = file
+        self.node_file = node_file if node_file is not None and os.path.exists(node_file) else None
+        self.max_loaded = max_loaded
+        self.loaded = OrderedDict() # mapping of connection identifiers to lists of row tuples; least recently used first
+        self.cache_dir = os.path.join(os.path.dirname(os.path.abspath(file)), ".cache", os.path.basename(file))
+        self.columns = {} # mapping of column names to arrays of all rows grouped by connection; text columns hold category codes
+        self.categories = {} # mapping of text column names to the arrays of text values their codes refer to
+        self.offsets = {} # mapping of connection identifiers to 2D tuples of (first row, number of rows)
+        if not cache or not self.read_cache():
+            self.read()
+            if cache:
+                self.write_cache()
+
+    def source_key(self) -> dict:
+        """
+        return: The identity of the connections file that a cache must match; its path, modification time, and size
+        """
+        status = os.stat(self.file)
+        key = {"version": CACHE_VERSION, "source": os.path.abspath(self.file), "mtime_ns": status.st_mtime_ns, "size": status.st_size}
+        if self.node_file is not None:
+            node_status = os.stat(self.node_file)
+            key["nodes"] = {"source": os.path.abspath(self.node_file), "mtime_ns": node_status.st_mtime_ns, "size": node_status.st_size}
+        return key
+
+    def read(self):
+        """
+        Reads the connections file, drops duplicate rows left by re-run queries, and groups rows by connection identifier.
+        """
+        try:
+            # round trip parsing gives the same floats as parsing each field on its own
+            frame = pd.read_csv(self.file, dtype=CONNECTION_COLUMNS, usecols=list(CONNECTION_COLUMNS.keys()), skipinitialspace=True, float_precision="round_trip")
+        except pd.errors.EmptyDataError:
+            frame = pd.DataFrame({name: pd.Series(dtype=dtype) for name, dtype in CONNECTION_COLUMNS.items()})
+        frame["conn_id"] = frame["conn_id"].str.strip()
+        frame = frame[self.unique_rows(frame)]
+        # group rows by connection in order of first appearance, keeping file order within each connection
+        codes, conn_ids = pd.factorize(frame["conn_id"])
+        order = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes, minlength=len(conn_ids))
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+        self.offsets = {conn_id: (int(start), int(count)) for conn_id, start, count in zip(conn_ids.tolist(), starts.tolist(), counts.tolist())}
+        self.columns, self.categories = {}, {}
+        for name, dtype in CONNECTION_COLUMNS.items():
+            if dtype is str:
+                codes, self.categories[name] = pd.factorize(frame[name])
+                self.columns[name] = codes.astype(np.int32)[order]
+                self.categories[name] = np.asarray(self.categories[name], dtype=object)
+            else:
+                self.columns[name] = frame[name].to_numpy(dtype=dtype)[order]
+
+    def unique_rows(self, frame: pd.DataFrame) -> np.ndarray:
+        """
+        Finds the rows to keep, dropping rows repeated by re-run queries. A query writes one row per cell, so a route is stored as many times 
+        as it has cells (e.g. transit stops shared by several catchment locations); rows of a route past that number are re-run appends. 
+        The cells of a route follow from the locations of the rows' nodes in the nodes file, so rows are told apart by location: catchment 
+        rows pair the i-th origin and destination locations, and other rows pair every origin location with every destination location. 
+        The stored (orig_index, dest_index) are not used, as they do not identify a cell in data written before journaling. Without the 
+        nodes of a row, only exact repeats of indexed rows are dropped. 
+        param: frame [pd.DataFrame] The rows of the connections file
+        return: The boolean array of the rows to keep; the first rows of a route are kept
+        """
+        # rows of a query are told apart by their (orig_index, dest_index), so a repeated row is a re-run append; catchment connections queried
+        # before catchment pairs were indexed have index (0, 0) on every row, so their repeated rows may be distinct samples and are kept
+        indexed = frame.groupby("conn_id")[["orig_index", "dest_index"]].transform("max").max(axis=1) > 0
+        keep = ~(frame.duplicated() & indexed).to_numpy()
+        if self.node_file is None or len(frame) == 0:
+            return keep
+        locations = defaultdict(list) # mapping of node identifiers to their (lat, lon) locations in file order
+        with open(self.node_file, newline='') as node_file:
+            for record in csv.reader(node_file):
+                try:
+                    locations[str(record[0])].append((float(record[1]), float(record[2])))
+                except (IndexError, ValueError):
+                    continue # header or malformed record
+        group_columns, route_columns = ["conn_id", "orig_node_id", "dest_node_id"], ["orig_lat", "orig_lon", "dest_lat", "dest_lon"]
+        routes = list(zip(*(frame[name].tolist() for name in route_columns)))
+        # occurrence of each row among the rows of its route, in file order
+        ranks = frame.groupby(group_columns + route_columns, sort=False, dropna=False).cumcount().to_numpy()
+        for (_, origin_id, dest_id), rows in frame.groupby(group_columns, sort=False, dropna=False).indices.items():
+            origins, destinations = locations.get(origin_id, []), locations.get(dest_id, [])
+            if len(origins) == 0 or len(destinations) == 0:
+                continue # nodes not stored
+            pairs = Counter(origin + destination for origin, destination in zip(origins, destinations)) if len(origins) == len(destinations) else Counter()
+            catchment = len(pairs) > 0 and all(routes[row] in pairs for row in rows)
+            origin_counts, destination_counts = Counter(origins), Counter(destinations)
+            for row in rows:
+                cells = pairs[routes[row]] if catchment else origin_counts[routes[row][:2]] * destination_counts[routes[row][2:]]
+                # rows of locations the nodes no longer have are left to `NetworkUpdate`
+                keep[row] = ranks[row] < cells if cells > 0 else keep[row]
+        return keep
+
+    def read_cache(self) -> bool:
+        """
+        Memory-maps the binary cache of the connections file if it is up to date.
+        return: Whether the cache was read
+        """
+        try:
+            with open(os.path.join(self.cache_dir, "meta.json")) as meta_file:
+                meta = json.load(meta_file)
+            if meta["key"] != self.source_key():
+                return False # the file changed since the cache was written
+            # empty arrays can not be memory-mapped
+            mmap_mode = "r" if meta["rows"] > 0 else None
+            self.columns = {name: np.load(os.path.join(self.cache_dir, f"{name}.npy"), mmap_mode=mmap_mode) for name in CONNECTION_COLUMNS.keys()}
+            self.categories = {name: np.asarray(values, dtype=object) for name, values in meta["categories"].items()}
+            self.offsets = {conn_id: tuple(offset) for conn_id, offset in meta["offsets"].items()}
+            return True
+        except (OSError, ValueError, KeyError):
+            return False # missing or unreadable cache
+
+    def write_cache(self):
+        """
+        Writes the binary cache of the connections file. The cache is written to a temporary directory first and then moved into place,
+        so an interrupted write never leaves a partial cache behind.
+        """
+        key = self.source_key()
+        temp_dir = f"{self.cache_dir}.{os.getpid()}.tmp"
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir)
+        for name, column in self.columns.items():
+            np.save(os.path.join(temp_dir, f"{name}.npy"), column)
+        with open(os.path.join(temp_dir, "meta.json"), "w") as meta_file:
+            json.dump({"key": key, "rows": len(self.columns["conn_id"]), "offsets": self.offsets, 
+                       "categories": {name: values.tolist() for name, values in self.categories.items()}}, meta_file)
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        try:
+            os.rename(temp_dir, self.cache_dir)
+        except OSError:
+            shutil.rmtree(temp_dir, ignore_errors=True) # another process wrote the cache first
+
+    def get(self, conn_id: str) -> dict:
+        """
+        Gets the rows of a connection. Number columns are views of the store's (memory-mapped) arrays.
+        param: conn_id [str] The specified connection identifier
+        return: The dictionary of column arrays of the connection's rows; columns are empty if the connection has no rows
+        """
+        start, count = self.offsets.get(conn_id, (0, 0))
+        rows = slice(start, start + count)
+        return {name: self.categories[name][self.columns[name][rows]] if name in self.categories else self.columns[name][rows] for name in CONNECTION_COLUMNS.keys()}
+
+    def rows(self, conn_id: str) -> list:
+        """
+        Gets the rows of a connection as the sub trip tuples `MobilityProfile.get()` gives. Rows are built on first use and held in
+        a least recently used cache of at most `max_loaded` connections; profiles sharing a connection identifier share the rows.
+        param: conn_id [str] The specified connection identifier
+        return: The list of 6D tuples of (time [min], distance [km], origin_lat, origin_lon, dest_lat, dest_lon)
+        """
+        if conn_id in self.loaded:
+            self.loaded.move_to_end(conn_id)
+            return self.loaded[conn_id]
+        columns = self.get(conn_id)
+        rows = list(zip(columns["time_min"].tolist(), columns["distance_km"].tolist(), columns["orig_lat"].tolist(), 
+                        columns["orig_lon"].tolist(), columns["dest_lat"].tolist(), columns["dest_lon"].tolist()))
+        self.loaded[conn_id] = rows
+        # evict the least recently used connections
+        while len(self.loaded) > max(1, self.max_loaded):
+            self.loaded.popitem(last=False)
+        return rows
+
+    def count(self, conn_id: str) -> int:
+        """
+        param: conn_id [str] The specified connection identifier
+        return: The number of rows of the connection, without building them
+        """
+        return self.offsets.get(conn_id, (0, 0))[1]
+
+    def __contains__(self, conn_id: str) -> bool:
+        return conn_id in self.offsets
+
+class NodeStore:
+    """
+    Represents the location records of a network nodes file partitioned by node identifier, read in one pass.
+    """
+    def __init__(self, file: str, aliases: dict=None):
+        """
+        Creates a `NodeStore` instance by reading a nodes file.
+        param: file [str] The specified nodes file
+        param: aliases [dict] Optional mapping of stored node identifiers to the identifiers to partition their records by (e.g. legacy 
+                              identifiers to current ones); the file is left as it is
+        """
+        self.file = file
+        aliases = aliases if aliases is not None else {}
+        self.partitions = {} # mapping of node identifiers to lists of records in file order
+        with open(file, newline='') as node_file:
+            for record in csv.reader(node_file):
+                if len(record) > 0:
+                    self.partitions.setdefault(aliases.get(str(record[0]), str(record[0])), []).append(record)
+
+    def get(self, node_id: str) -> list:
+        """
+        Gets the records of a node.
+        param: node_id [str] The specified node identifier
+        return: The list of records of (node_id, lat, lon, municipality, region, type) of the node
+        """
+        return self.partitions.get(node_id, [])
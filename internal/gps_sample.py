@@ -3,6 +3,13 @@ import random
 import matplotlib.pyplot as plt
 from internal.mobility_profile import *
 
+# earth radius [km] of radial offsets from a root position
+EARTH_RADIUS_GPS = 6378
+# least number of candidate positions drawn per batch when sampling; rejected candidates are topped up by further batches
+CANDIDATE_BATCH = 256
+# number of batches in a row without an accepted candidate after which sampling gives up
+MAX_EMPTY_BATCHES = 100
+
 class GPSSample: 
     """
     Represents a sample of meaning GPS coordinates. Meaningful coordinates are those that are known locations such as shops, houses, parks, benches, hospitals, etc. 
@@ -11,7 +18,7 @@ class GPSSample:
         """
         Represents the location of a nearby GPS coordinate with qualitative data. 
         """
-        def __init__(self, lat: float, lon: float, type: float=None, municipality: str=None, region: str=None): 
+        def __init__(self, lat: float, lon: float, type: float=None, municipality: str=None, region: str=None, telemetry: Telemetry=None): 
             """
             Gets data on the nearest location to the specified GPS coordinates from either query via the openstreetmap API or 
             by loading in data locally. If the optional parameters are not given, the data is queried from the API and not otherwise. 
@@ -20,6 +27,7 @@ class GPSSample:
             param: type [str] Optional arg for giving a category of city, town, house, etc
             param: municipality [str] Optional arg for giving a municipal area 
             param: region [str] Optional arg gor giving a region 
+            param: telemetry [Telemetry] Optional telemetry to record the geocoding call in
             """
             # type : city, town, village, primary/res highway, house/commercial building, school/house amenity
             self.type, self.municipality, self.region = "n/a", "n/a", "n/a" 
@@ -27,7 +35,7 @@ class GPSSample:
             self.gps_coordinate = None 
             # query data from the api if no optional args were given
             if type is None and municipality is None and region is None:
-                data = self.geocoding(lat, lon) # retrieved location data
+                data = self.geocoding(lat, lon, telemetry) # retrieved location data
                 self.gps_coordinate = (float(data["lat"]), float(data["lon"])) # gps
                 try: # handle finding qualitative info
                     self.type = str(data.get("place", "UNKNOWN")) + "_" + str(data.get("type", "UNKNOWN")) 
@@ -42,16 +50,28 @@ class GPSSample:
                 self.municipality = municipality
                 self.region = region
 
-        def geocoding(self, lat: float, lon: float): 
+        def geocoding(self, lat: float, lon: float, telemetry: Telemetry=None): 
             """
             Estimates the address and qualitative information of a nearby location to a specified GPS coordinate. 
             param: lat [float] The specified latitude to approximate from
             param: lon [float] The specified longitude to approximate from 
+            param: telemetry [Telemetry] Optional telemetry to record the call in
             return: data
             """
             # format url for reverse geocoding: get info of nearby location from GPS position via us of openstreet api
             url = f"https://nominatim.openstreetmap.org/reverse?lat={lat}&lon={lon}&format=json"
-            return requests.get(url, headers={"User-Agent": "mobility_research_project_WPI_2025"}).json() # retrieve response data in json format
+            if telemetry is None:
+                return requests.get(url, headers={"User-Agent": "mobility_research_project_WPI_2025"}).json() # retrieve response data in json format
+            start = time.monotonic()
+            try:
+                response = requests.get(url, headers={"User-Agent": "mobility_research_project_WPI_2025"})
+                telemetry.record_call(GEOCODE_PROVIDER, time.monotonic() - start, len(response.content), response.ok)
+                data = response.json()
+            except (requests.RequestException, ValueError):
+                telemetry.record_request(GEOCODE_PROVIDER, 1, False)
+                raise
+            telemetry.record_request(GEOCODE_PROVIDER, 1, "lat" in data)
+            return data
 
     def calc_local_gps(self, lat_0: float, lon_0: float, radius: float, bearing: float):
         """
@@ -62,14 +82,107 @@ class GPSSample:
         :param bearing [float] Angle of radial offset 
         :return Offset local GPS position 
         """
-        R_e = 6378  # earth radius in km
+        R_e = EARTH_RADIUS_GPS  # earth radius in km
         # Compute new latitude
         lat_1 = math.asin(math.sin(lat_0) * math.cos(radius / R_e) + math.cos(lat_0) * math.sin(radius / R_e) * math.cos(bearing))
         # Compute new longitude
         lon_1 = lon_0 + math.atan2(math.sin(bearing) * math.sin(radius / R_e) * math.cos(lat_0), math.cos(radius / R_e) - math.sin(lat_0) * math.sin(lat_1))
         return (math.degrees(lat_1), math.degrees(lon_1))
 
-    def fetch_radial_location_sample(self, lat_0: float, lon_0: float, radius: float, n: int, filter_zones: list) -> list:
+    def calc_local_gps_batch(self, lat_0: float, lon_0: float, radius: np.ndarray, bearing: np.ndarray) -> tuple:
+        """
+        Calculates the GPS coordinates of a batch of radial offsets from a central root position, as `calc_local_gps()` does for one.
+        :param lat_0 [float] Central root latitude in radians
+        :param lon_0 [float] Central root longitude in radians
+        :param radius [np.ndarray] Offset radii in [km] from central root position
+        :param bearing [np.ndarray] Angles of radial offset
+        :return 2D tuple of arrays of the offset latitudes and longitudes
+        """
+        angle = np.asarray(radius, dtype=np.float64) / EARTH_RADIUS_GPS # angular distance of each offset
+        bearing = np.asarray(bearing, dtype=np.float64)
+        lat_1 = np.arcsin(math.sin(lat_0) * np.cos(angle) + math.cos(lat_0) * np.sin(angle) * np.cos(bearing))
+        lon_1 = lon_0 + np.arctan2(np.sin(bearing) * np.sin(angle) * math.cos(lat_0), np.cos(angle) - math.sin(lat_0) * np.sin(lat_1))
+        return (np.degrees(lat_1), np.degrees(lon_1))
+
+    @staticmethod
+    def compile_filter_zones(filter_zones: list) -> np.ndarray:
+        """
+        Precomputes the bounds of filter zones, so positions can be tested against every zone at once.
+        :param filter_zones [list] List of 8D tuples. Each element (x0,y0,x1,y1,x2,y2,x3,y3) is a bounded region to not sample from
+        :return The (z x 14) array of each zone's bound terms; columns are (x2, y2, x3-x2, y3-y2) of the left bound, (x0, y0, x1-x0, y1-y0)
+                of the right bound, (x1, y1, slope) of the upper bound, and (x3, y3, slope) of the lower bound
+        """
+        zones = np.asarray(filter_zones, dtype=np.float64).reshape(-1, 8)
+        a0, b0, a1, b1, a2, b2, a3, b3 = zones.T
+        with np.errstate(divide="ignore", invalid="ignore"): # vertical bounds have no slope; no position is inside such a zone
+            return np.stack((a2, b2, a3 - a2, b3 - b2, a0, b0, a1 - a0, b1 - b0, a1, b1, (b2 - b1) / (a2 - a1), a3, b3, (b0 - b3) / (a0 - a3)), axis=1)
+
+    @staticmethod
+    def in_filter_zones(zones: np.ndarray, pos_x: np.ndarray, pos_y: np.ndarray) -> np.ndarray:
+        """
+        Tests a batch of positions against every filter zone. A position is inside a zone if it lies between the zone's left and right
+        bounds along its row and between the upper and lower bounds along its column.
+        :param zones [np.ndarray] The zones compiled by `compile_filter_zones()`
+        :param pos_x [np.ndarray] The cartesian x [km] of the positions
+        :param pos_y [np.ndarray] The cartesian y [km] of the positions
+        :return The array of whether each position is inside any zone
+        """
+        if len(zones) == 0:
+            return np.zeros(len(pos_x), dtype=bool)
+        x, y = pos_x[:, None], pos_y[:, None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # points where a cross "+" projected from each position intersects the bounds of each zone
+            left = ((y - zones[:, 1]) * zones[:, 2]) / zones[:, 3] + zones[:, 0]
+            right = ((y - zones[:, 5]) * zones[:, 6]) / zones[:, 7] + zones[:, 4]
+            up = zones[:, 10] * (x - zones[:, 8]) + zones[:, 9]
+            down = zones[:, 13] * (x - zones[:, 11]) + zones[:, 12]
+            inside = (x >= np.minimum(left, right)) & (x <= np.maximum(left, right)) & (y >= np.minimum(up, down)) & (y <= np.maximum(up, down))
+        return inside.any(axis=1)
+
+    def sample_radial_positions(self, radius: float, n: int, filter_zones: list, rng: np.random.Generator=None) -> tuple:
+        """
+        Samples positions uniformly over a disc, leaving out filter zones. Candidates are drawn and tested in batches, and rejected
+        candidates are topped up by further batches until `n` positions are accepted.
+        :param radius [float] Radius [km] to sample within
+        :param n [int] Sample size
+        :param filter_zones [list] List of 8D tuples. Each element (x0,y0,x1,y1,x2,y2,x3,y3) is a bounded region to not sample from
+        :param rng [np.random.Generator] Optional random number generator to draw with
+        :return 2D tuple of arrays of the radii [km] and angles of the positions, in the order they were drawn
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        zones = self.compile_filter_zones(filter_zones)
+        Rs, Ts, accepted, empty_batches = [], [], 0, 0
+        while accepted < n:
+            m = max(CANDIDATE_BATCH, 2 * (n - accepted)) # candidates of this batch
+            theta = rng.random(m) * 2.0 * math.pi
+            R = np.sqrt(rng.random(m)) * radius
+            keep = ~self.in_filter_zones(zones, R * np.cos(theta), R * np.sin(theta))
+            R, theta = R[keep][:n - accepted], theta[keep][:n - accepted]
+            empty_batches = empty_batches + 1 if len(R) == 0 else 0
+            if empty_batches >= MAX_EMPTY_BATCHES:
+                raise ValueError(f"filter zones cover the whole sample radius {radius}; no position could be sampled")
+            Rs.append(R)
+            Ts.append(theta)
+            accepted += len(R)
+        return (np.concatenate(Rs) if len(Rs) > 0 else np.zeros(0), np.concatenate(Ts) if len(Ts) > 0 else np.zeros(0))
+
+    def sample_radial_gps(self, lat_0: float, lon_0: float, radius: float, n: int, filter_zones: list, rng: np.random.Generator=None) -> tuple:
+        """
+        Samples GPS coordinates within a radius of a central root position, leaving out filter zones, without geocoding them.
+        :param lat_0 [float] Central root latitude 
+        :param lon_0 [float] Central root longitude 
+        :param radius [float] Radius [km] to sample within
+        :param n [int] Sample size
+        :param filter_zones [list] List of 8D tuples. Each element (x0,y0,x1,y1,x2,y2,x3,y3) is a bounded region to not sample from
+        :param rng [np.random.Generator] Optional random number generator to draw with
+        :return 4D tuple of arrays of the latitudes, longitudes, radii [km], and angles of the sampled positions
+        """
+        R, theta = self.sample_radial_positions(radius, n, filter_zones, rng)
+        lats, lons = self.calc_local_gps_batch(math.radians(lat_0), math.radians(lon_0), R, theta)
+        return (lats, lons, R, theta)
+
+    def fetch_radial_location_sample(self, lat_0: float, lon_0: float, radius: float, n: int, filter_zones: list, telemetry: Telemetry=None,
+                                     rng: np.random.Generator=None) -> list:
         """
         Samples locations within a radius given a central root position `(lat_0, lon_0)`. Returned data takes the form of a vector 
         (municipality_sampling_dict, region_sampling_dict, location_type_sampling_dict, locations)
@@ -78,10 +191,12 @@ class GPSSample:
         :param radius [float] Radius to sample within
         :param n [int] Sample size
         :param filter_zones [list] List of 8D tuples. Each element (x0,y0,x1,y1,x2,y2,x3,y3) is a bounded region to not sample from
+        :param telemetry [Telemetry] Optional telemetry to record geocoding calls and progress in; progress is printed per location if not given
+        :param rng [np.random.Generator] Optional random number generator to draw positions with
         :return list of location(s) with qualitative data. 
         """
-        lat_0 = math.radians(lat_0)
-        lon_0 = math.radians(lon_0)
+        if telemetry is not None:
+            telemetry.expect(GEOCODE_PROVIDER, n)
         locations = [] # list of locations 
         # categorical statistics on sampled locations
         municipality_statistics = {} 
@@ -100,62 +215,19 @@ class GPSSample:
             else:
                 dictionary[key] = 1
 
-        Ts, Rs, = [], [] 
-        # step through random sample of coordinates 
-        for i in range(0, n):
-            # find radial position (R, theta) within sample zone
-            theta, R = None, None
-            run_filter = True 
-            while run_filter:
-                run_filter = False # get position (theta,R) and assume its outside of filtered regions 
-                theta = random.random() * 2.0 * math.pi # Assuming outside filtered regions, turn filter off 
-                R = math.pow(random.random(), 0.5) * radius
-                # check all filter regions 
-                for filter in filter_zones:
-                    # coords bounding a convex shape
-                    a0, b0, a1, b1 = filter[0], filter[1], filter[2], filter[3]
-                    a2, b2, a3, b3 = filter[4], filter[5], filter[6], filter[7]
-                    # get position in cartesian coords 
-                    pos_x, pos_y = R * math.cos(theta), R * math.sin(theta)
-
-                    # linear functions, and inverses, of bounded convex shape
-                    def inv_left_bound(y: float):
-                        return (((y-b2) * (a3-a2)) / (b3-b2)) + a2
-                    def inv_right_bound(y: float):
-                        return (((y-b0) * (a1-a0)) / (b1-b0)) + a0
-                    def up_bound(x: float):
-                        return (((b2-b1) / (a2-a1)) * (x-a1)) + b1
-                    def down_bound(x: float):
-                        return (((b0-b3) / (a0-a3)) * (x-a3)) + b3
-
-                    # get points where, a cross "+" projects from the position, intersects the bounds 
-                    horizontal_bound_intersections = (up_bound(x=pos_x), down_bound(x=pos_x))
-                    vertical_bound_intersections = (inv_left_bound(y=pos_y), inv_right_bound(y=pos_y))
-                    # get bounding min/max x/y from where there are intersections 
-                    up_y = max(horizontal_bound_intersections[0], horizontal_bound_intersections[1])
-                    down_y = min(horizontal_bound_intersections[0], horizontal_bound_intersections[1])
-                    right_x = max(vertical_bound_intersections[0], vertical_bound_intersections[1])
-                    left_x = min(vertical_bound_intersections[0], vertical_bound_intersections[1])
-
-                    # check if position is inside regions 
-                    if pos_x >= left_x and pos_x <= right_x and pos_y >= down_y and pos_y <= up_y:
-                        run_filter = True # inside region, flag to continue the filter
-                        break # we know this is an out-of-bounds position; end check with filter still running
-                # if check loop completes and filter is False, the position is within bounds 
-
-            # find corresponding GPS coordinate
-            lat_1, lon_1 = self.calc_local_gps(lat_0, lon_0, R, theta)
+        # sample every radial position (R, theta) outside the filtered regions, with its GPS coordinate, up front
+        lats, lons, Rs, Ts = self.sample_radial_gps(lat_0, lon_0, radius, n, filter_zones, rng)
+        # step through the sampled coordinates 
+        for i, (lat_1, lon_1) in enumerate(zip(lats.tolist(), lons.tolist())):
             # only give gps coordinates; geocode to get location
-            location = self.Location(lat_1, lon_1)
+            location = self.Location(lat_1, lon_1, telemetry=telemetry)
             locations.append(location) # record location
             # sum attribute data for the whole sample 
             count_location(municipality_statistics, location.municipality) 
             count_location(region_statistics, location.region)
             count_location(type_statistics, location.type)
-            print(f"{i}/{n}")
-
-            Ts.append(theta)
-            Rs.append(R)
+            if telemetry is None:
+                print(f"{i}/{n}")
 
         # Set up polar plot
         fig, ax = plt.subplots(subplot_kw={'projection': 'polar'})
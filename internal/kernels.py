@@ -0,0 +1,116 @@
+import numpy as np
+try:
+    import numba
+except ImportError:
+    numba = None # optional; kernels fall back to NumPy when Numba is not installed
+
+# backends the kernels can run on; `numba` compiles the scalar loops below, `python` runs the same loops uncompiled
+BACKENDS = ["numba", "numpy", "python"]
+backend = "numba" if numba is not None else "numpy"
+
+def set_backend(name: str):
+    """
+    Selects the backend that the hot loop kernels run on.
+    param: name [str] One of `numba`, `numpy`, or `python`
+    """
+    global backend
+    if name not in BACKENDS:
+        raise ValueError(f"unknown kernel backend '{name}'; expected one of {BACKENDS}")
+    if name == "numba" and numba is None:
+        raise ValueError("the numba kernel backend needs Numba to be installed")
+    backend = name
+
+def get_backend() -> str:
+    """
+    return: The name of the backend the kernels currently run on
+    """
+    return backend
+
+def available_backends() -> list:
+    """
+    return: The list of backends that can be selected in this environment
+    """
+    return [name for name in BACKENDS if name != "numba" or numba is not None]
+
+# ~~~ scalar loop kernels; run as is by the `python` backend and compiled by the `numba` backend ~~~
+
+def draw_rows_loop(origin_index, origin_starts, origin_counts, prev_location_ids, u, rows, alive):
+    for i in range(0, len(u)):
+        # binary search for the block of sub trips leaving the previous location
+        low, high = 0, len(origin_index)
+        while low < high:
+            middle = (low + high) // 2
+            if origin_index[middle] < prev_location_ids[i]:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(origin_index) and origin_index[low] == prev_location_ids[i]:
+            count = origin_counts[low]
+            rows[i] = origin_starts[low] + max(min(int(u[i] * count), count - 1), 0)
+            alive[i] = True
+        else:
+            rows[i] = 0
+            alive[i] = False
+
+def assign_tiles_loop(lats, lons, lat_0, lon_0, lat_res, lon_res, w, h, tile_x, tile_y):
+    for i in range(0, len(lats)):
+        # round to the nearest grid line; exact ties go to the lower tile
+        x = int(np.ceil((lats[i] - lat_0) / lat_res - 0.5)) if lat_res > 0 else 0
+        y = int(np.ceil((lons[i] - lon_0) / lon_res - 0.5)) if lon_res > 0 else 0
+        tile_x[i] = min(max(x, 0), w - 1)
+        tile_y[i] = min(max(y, 0), h - 1)
+
+if numba is not None:
+    # compiled once and cached on disk, so worker processes do not re-compile
+    draw_rows_jit = numba.njit(cache=True)(draw_rows_loop)
+    assign_tiles_jit = numba.njit(cache=True)(assign_tiles_loop)
+
+# ~~~ kernels; dispatched to the selected backend ~~~
+
+def draw_rows(origin_index: np.ndarray, origin_starts: np.ndarray, origin_counts: np.ndarray, prev_location_ids: np.ndarray, u: np.ndarray):
+    """
+    Draws one row per trip, uniformly from the block of rows of a sorted origin index that starts at each trip's previous location.
+    param: origin_index [np.ndarray] The sorted unique origin location identifiers
+    param: origin_starts [np.ndarray] The first row of each origin's block
+    param: origin_counts [np.ndarray] The number of rows of each origin's block
+    param: prev_location_ids [np.ndarray] The location each trip left off at
+    param: u [np.ndarray] Uniform random numbers in [0, 1), one per trip
+    return: 2D tuple of the array of drawn row indices and the boolean array of trips whose location has rows leaving it
+    """
+    prev_location_ids, u = np.asarray(prev_location_ids, dtype=np.int64), np.asarray(u, dtype=np.float64)
+    if backend == "numpy":
+        if len(origin_index) == 0:
+            return np.zeros(len(u), dtype=np.int64), np.zeros(len(u), dtype=bool)
+        positions = np.minimum(np.searchsorted(origin_index, prev_location_ids), len(origin_index) - 1)
+        found = origin_index[positions] == prev_location_ids
+        starts, counts = np.where(found, origin_starts[positions], 0), np.where(found, origin_counts[positions], 0)
+        # clamp guards against u rounding up to the block size
+        return starts + np.maximum(np.minimum((u * counts).astype(np.int64), counts - 1), 0), counts > 0
+    rows, alive = np.zeros(len(u), dtype=np.int64), np.zeros(len(u), dtype=bool)
+    kernel = draw_rows_jit if backend == "numba" else draw_rows_loop
+    kernel(origin_index, origin_starts, origin_counts, prev_location_ids, u, rows, alive)
+    return rows, alive
+
+def assign_tiles(lats: np.ndarray, lons: np.ndarray, gps_0: tuple, lat_res: float, lon_res: float, w: int, h: int):
+    """
+    Finds the closest tile of a regular heatmap grid to each GPS point. Tile (x, y) lies at (x * lat_res + lat_0, y * lon_res + lon_0), so the
+    closest tile is found by rounding each coordinate to the grid rather than comparing against every tile.
+    param: lats [np.ndarray] The latitudes of the points
+    param: lons [np.ndarray] The longitudes of the points
+    param: gps_0 [tuple] The (lat, lon) of tile (0, 0)
+    param: lat_res [float] The latitude spacing of tiles
+    param: lon_res [float] The longitude spacing of tiles
+    param: w [int] The number of tiles along latitude
+    param: h [int] The number of tiles along longitude
+    return: 2D tuple of arrays of the x and y tile index of each point
+    """
+    lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    lat_0, lon_0, lat_res, lon_res = float(gps_0[0]), float(gps_0[1]), float(lat_res), float(lon_res)
+    if backend == "numpy":
+        tile_x = np.ceil((lats - lat_0) / lat_res - 0.5).astype(np.int64) if lat_res > 0 else np.zeros(len(lats), dtype=np.int64)
+        tile_y = np.ceil((lons - lon_0) / lon_res - 0.5).astype(np.int64) if lon_res > 0 else np.zeros(len(lons), dtype=np.int64)
+        return np.clip(tile_x, 0, w - 1), np.clip(tile_y, 0, h - 1)
+    tile_x, tile_y = np.zeros(len(lats), dtype=np.int64), np.zeros(len(lats), dtype=np.int64)
+    kernel = assign_tiles_jit if backend == "numba" else assign_tiles_loop
+    kernel(lats, lons, lat_0, lon_0, lat_res, lon_res, w, h, tile_x, tile_y)
+    return tile_x, tile_y
@@ -1,5 +1,8 @@
 from internal.mobility_node import *
 from internal.mobility_sample import *
+from internal.scenario import *
+from internal.query_budget import *
+from internal.network_update import *
 from enum import Enum as enum
 from decimal import Decimal as decimal
 import internal.mobility_profile as mp
@@ -80,6 +83,8 @@ class MobilityNetworkBase(MobilityTripSampler):
         # node and connection data files 
         self.node_data_file = f"./network_mobility_data/{name}_nodes.csv"
         self.connection_data_file = f"./network_mobility_data/{name}_connections.csv"
+        self.query_journal_file = f"./network_mobility_data/{name}_query_journal.jsonl"
+        self.query_telemetry_file = f"./network_mobility_data/{name}_query_telemetry.json"
         
         # create data files if needed
         if not os.path.exists(self.node_data_file):
@@ -97,26 +102,271 @@ class MobilityNetworkBase(MobilityTripSampler):
         # network nodes and connections / edges 
         self.connections = []
         self.nodes = []
+        # caches shared by scenarios; edited compiled connections and trip distributions, mapped by data and edit signature and least recently used 
+        # first (at most `max_compiled` of each are held), and catchment stop mappings 
+        self.scenario_connections = OrderedDict()
+        self.scenario_distributions = OrderedDict()
+        self.scenario_catchments = {}
 
-    def QUERY(self):
+    def migrate_stored_ids(self) -> dict:
+        """
+        Renames transit stop nodes stored under legacy identifiers (with a random `_NN` suffix) in the data files to their current identifiers. 
+        The query journal no longer lines up with renamed files and is removed; the next query adopts the stored rows instead. Only `QUERY()` 
+        and `UPDATE()` migrate, as they write the data files anyway; `READ()` and `BUDGET()` read legacy identifiers as current ones. 
+        return: The mapping of renamed legacy identifiers to current identifiers
+        """
+        renames = migrate_node_ids(self.node_data_file, self.connection_data_file, [node.node_id for node in self.nodes])
+        if len(renames) > 0:
+            print(f"MIGRATED STORED NODE IDS {renames}")
+            if os.path.exists(self.query_journal_file):
+                os.remove(self.query_journal_file)
+        return renames
+
+    def QUERY(self, workers: int=8, rate: float=5.0, burst: int=5, cache: bool=True, max_cached: int=1000000, resume: bool=True, planner: RequestPlanner=None, 
+              retries: int=3, dry_run: bool=False, telemetry: Telemetry=None):
         """
         QUERIES DATA FROM ONLINE API SOURCES! Only import data by query if needed. Otherwise, data should already be queried and stored locally. 
-        QUERYING EXITS THE PROGRAM UPON COMPLETION
+        The queries of all profiles are planned together by one `RequestPlanner`, which packs their cells into as few requests as the per-request
+        limits allow, sharing requests between profiles that query the same way. Requests run through one `QueryExecutor`: they are fetched 
+        concurrently over a shared keep-alive session under a token bucket rate limit, and a single writer appends their rows to the connections 
+        file. Routes already fetched by any network are served from the persistent response cache instead of being paid for again. 
+        Progress is journaled node by node and kernel by kernel, so an interrupted query picks up where it stopped when run again: data files
+        are truncated back to the last completed step and completed nodes and cells are skipped, leaving no duplicate rows. Rows stored by a 
+        query run without a journal are adopted as completed cells by their route (origin and destination location), and starting over truncates the data files back to their header. 
+        Cells of failed requests are re-requested in bulk with backoff and querying pauses during provider outages; cells still missing are 
+        reported per connection and are requested again by the next resumed query. Calls, latency, errors, and elements of every provider and 
+        connection are recorded while a progress line shows the expected time left, and are exported as JSON to the network's telemetry file. 
+        param: workers [int] The number of requests in flight at once
+        param: rate [float] The largest average number of requests per second
+        param: burst [int] The number of requests that may be sent at once before the rate limit applies
+        param: cache [bool] Whether to serve and store routes through the response cache shared by all networks
+        param: max_cached [int] The largest number of routes the response cache keeps; least recently used routes are evicted past it
+        param: resume [bool] Whether to continue from the journal and stored data of an earlier query of this network; if not, the stored data 
+                             is cleared and the query starts over
+        param: planner [RequestPlanner] Optional planner with custom per-request limits; the distancematrix.ai limits are used if not given
+        param: retries [int] The number of rounds failed cells are re-requested in, with exponential backoff; cells still failing are reported
+        param: dry_run [bool] Whether to only report the expected cost of the query, as given by `BUDGET()`, without calling any provider
+        param: telemetry [Telemetry] Optional telemetry to record the query in (e.g. with quotas); a new one is made if not given
+        return: The budget report if `dry_run`; otherwise the telemetry report as given by `Telemetry.report()`
+        """
+        if dry_run:
+            return self.BUDGET(rate=rate, burst=burst, cache=cache, resume=resume, planner=planner)
+        planner = planner if planner is not None else RequestPlanner()
+        self.migrate_stored_ids()
+        journal = QueryJournal(self.query_journal_file, resume=resume)
+        response_cache = ResponseCache(max_entries=max_cached) if cache else None
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        try:
+            stored_routes = {}
+            if len(journal.begin([self.node_data_file, self.connection_data_file])) > 0: # rows written without a journal are kept, not queried again
+                stored_nodes, stored_routes = QueryJournal.stored_progress(self.node_data_file, self.connection_data_file)
+                journal.adopt_nodes(self.node_data_file, [node.node_id for node in self.nodes if node.node_id in stored_nodes])
+            for node in self.nodes: # query node positions with geocoded gps samples 
+                node.query_node(file=self.node_data_file, journal=journal, telemetry=self.telemetry)
+            for node in self.nodes: # stored rows are adopted by route, once the locations of every node are known
+                for dest_node, profile in node.mobilities.values():
+                    cells = QueryJournal.stored_cells(stored_routes.get(profile.connection_id, set()), node.mobility_cells(dest_node))
+                    journal.adopt_cells(profile.journal_key(), cells, self.connection_data_file)
+            with QueryExecutor(workers=workers, rate=rate, burst=burst, cache=response_cache, journal=journal, retries=retries, telemetry=self.telemetry) as executor:
+                for node in self.nodes: # query mobility profiles with gps samples
+                    node.query_profiles(file=self.connection_data_file, executor=executor, planner=planner)
+                planner.submit(executor)
+            self.telemetry.end_progress()
+            print(f"QUERYING: REQUEST PLAN {planner.report()}")
+            for conn_id, cells in executor.missing_report().items(): # cells left for a later resumed query
+                print(f"QUERYING: CONNECTION {conn_id} IS MISSING {len(cells)} CELLS (orig_index, dest_index): {cells}")
+        finally:
+            journal.close()
+            self.telemetry.end_progress()
+            self.telemetry.export(self.query_telemetry_file)
+            print(f"QUERYING: TELEMETRY WRITTEN TO {self.query_telemetry_file}")
+            if response_cache is not None:
+                print(f"QUERYING: RESPONSE CACHE {response_cache.stats()}")
+                response_cache.close()
+        return self.telemetry.report()
+
+    def BUDGET(self, rate: float=5.0, burst: int=5, cache: bool=True, resume: bool=True, planner: RequestPlanner=None, geocode_rate: float=1.0) -> dict:
+        """
+        DRY RUN OF `QUERY()`; CALLS NO PROVIDER AND WRITES NO FILES. Walks the nodes and connections of the network and reports the expected 
+        geocode calls, DistanceMatrix requests and elements, and wall time at the given rate limits. Nodes with locations (given, read, or 
+        stored by an earlier query) are planned exactly, including the nearest stops of their transit nodes; nodes still to be sampled 
+        cost one geocode call per location and are planned with placeholder locations, which makes the figures an upper bound.
+        param: rate [float] The largest average number of requests per second
+        param: burst [int] The number of requests that may be sent at once before the rate limit applies
+        param: cache [bool] Whether the query would use the response cache; cached routes are not counted
+        param: resume [bool] Whether the query would continue from the journal and stored data of an earlier query; stored cells are not counted
+        param: planner [RequestPlanner] Optional planner with custom per-request limits; the distancematrix.ai limits are used if not given
+        param: geocode_rate [float] The number of geocode calls per second
+        return: The budget report as given by `QueryBudget.report()`
+        """
+        budget = QueryBudget(planner, rate=rate, burst=burst, geocode_rate=geocode_rate)
+        # nodes stored under legacy identifiers are read under their current identifiers; the query renames them and starts a new journal
+        aliases = legacy_node_ids(self.node_data_file, self.connection_data_file, [node.node_id for node in self.nodes])
+        # read the journal and cache only if they exist, so a dry run leaves no files behind
+        journal = QueryJournal(self.query_journal_file, read_only=True) if resume and len(aliases) == 0 and os.path.exists(self.query_journal_file) else None
+        response_cache = ResponseCache() if cache and os.path.exists(RESPONSE_CACHE_FILE) else None
+        # rows stored without a journal are adopted by the query as completed
+        adopted = resume and (journal is None or os.path.abspath(self.connection_data_file) not in journal.offsets)
+        stored_nodes, stored_routes = QueryJournal.stored_progress(self.node_data_file, self.connection_data_file) if adopted else (set(), {})
+        stored_nodes = set(aliases.get(node_id, node_id) for node_id in stored_nodes)
+        node_store = NodeStore(self.node_data_file, aliases) if journal is not None or adopted else None
+        locations = {} # mapping of node identifiers to 2D tuples of (list of locations as `GPS()` strings, whether they are real locations)
+
+        def plan_locations(node: MNode) -> tuple:
+            """
+            Finds the locations a node would have once queried. 
+            param: node [MNode] The specified node
+            return: 2D tuple of the list of locations as `GPS()` strings and whether they are real locations rather than placeholders
+            """
+            if node.node_id in locations:
+                return locations[node.node_id]
+            if len(node.locations) > 0: # given or read; the query keeps them
+                planned = ([mp.GPS(latitude=location.gps_coordinate[0], longitude=location.gps_coordinate[1]) for location in node.locations], True)
+            elif (journal is not None and journal.node_done(node.node_id)) or node.node_id in stored_nodes: # sampled by an earlier query; read back
+                planned = ([mp.GPS(latitude=float(record[1]), longitude=float(record[2])) for record in node_store.get(node.node_id)], True)
+            elif node.catchment_node is not None: # transit node; the nearest stops of its catchment node's locations
+                catchment, real = plan_locations(node.catchment_node)
+                if real:
+                    gps_list = [tuple(float(value) for value in location.split(",")) for location in catchment]
+                    stops = node.get_closest_transit_stops(gps_list=gps_list, transit_stops=node.transit_stop_mapping.get(node.transit_type), type=node.transit_line)
+                    planned = ([mp.GPS(latitude=stop[0], longitude=stop[1]) for stop in stops], True)
+                else:
+                    planned = ([f"{node.node_id}#{k}" for k in range(0, len(catchment))], False)
+            else: # sampled by the query, geocoding each location
+                n = int(node.n) if node.n is not None else 0
+                budget.add_geocodes(n)
+                planned = ([f"{node.node_id}#{k}" for k in range(0, n)], False)
+            locations[node.node_id] = planned
+            return planned
+
+        try:
+            for node in self.nodes:
+                origins, origins_real = plan_locations(node)
+                for dest_node, profile in node.mobilities.values():
+                    destinations, destinations_real = plan_locations(dest_node)
+                    cells = node.mobility_cells(dest_node, origins=origins, destinations=destinations)
+                    done = journal.done_cells(profile.journal_key()) if journal is not None else set()
+                    done = done | QueryJournal.stored_cells(stored_routes.get(profile.connection_id, set()), cells)
+                    cached = set()
+                    if response_cache is not None:
+                        cached = response_cache.contains_many([profile.cache_key(cell[0], cell[1]) for cell in cells if (cell[2], cell[3]) not in done])
+                    budget.add_cells(profile, cells, done=done, cached=cached, estimated=not (origins_real and destinations_real))
+        finally:
+            if journal is not None:
+                journal.close()
+            if response_cache is not None:
+                response_cache.close()
+        report = budget.report()
+        print(f"QUERYING: DRY RUN BUDGET {report}")
+        return report
+
+    def UPDATE(self, workers: int=8, rate: float=5.0, burst: int=5, cache: bool=True, max_cached: int=1000000, planner: RequestPlanner=None, 
+               retries: int=3) -> dict:
         """
-        for node in self.nodes: # query node positions with geocoded gps samples 
-            node.query_node(file=self.node_data_file)
-        for node in self.nodes: # query mobility profiles with gps samples
-            node.query_profiles(file=self.connection_data_file)
-        exit(0)
+        QUERIES DATA FROM ONLINE API SOURCES FOR CHANGED NODE LOCATIONS ONLY! Call on a newly built network, before `READ()`. The current 
+        locations of every node (given, or the stops of a transit node's catchment locations) are compared with the stored locations, 
+        and the stored data files are updated in place: rows of routes still needed are kept and re-indexed, rows of routes no longer needed 
+        are dropped, nodes whose locations changed are rewritten, and locations of nodes no longer in the network are dropped. A transit node 
+        keeps the stored stop of each stored catchment location; only new catchment locations get their nearest stop looked up, and the 
+        report counts them. A `QUERY()` then fetches only the cells of new routes; adding 5 locations 
+        to a 30 location node connected to another 30 location node queries 150 cells rather than 1050. Nodes that have no given or stored 
+        locations are sampled by the query as usual. 
+        param: workers [int] The number of requests in flight at once
+        param: rate [float] The largest average number of requests per second
+        param: burst [int] The number of requests that may be sent at once before the rate limit applies
+        param: cache [bool] Whether to serve and store routes through the response cache shared by all networks
+        param: max_cached [int] The largest number of routes the response cache keeps
+        param: planner [RequestPlanner] Optional planner with custom per-request limits; the distancematrix.ai limits are used if not given
+        param: retries [int] The number of rounds failed cells are re-requested in
+        return: The update report as given by `NetworkUpdate.report()`
+        """
+        self.migrate_stored_ids()
+        # drop rows of an interrupted query before comparing with the stored data
+        if os.path.exists(self.query_journal_file):
+            journal = QueryJournal(self.query_journal_file)
+            journal.begin([self.node_data_file, self.connection_data_file])
+            journal.close()
+        update = NetworkUpdate(self.node_data_file, self.connection_data_file)
+        records = {} # mapping of node identifiers to their current (lat, lon, municipality, region, type) records; `None` if still to be sampled
+
+        def current_records(node: MNode) -> list:
+            """
+            Finds the current locations of a node. 
+            param: node [MNode] The specified node
+            return: The list of (lat, lon, municipality, region, type) of each location, or `None` if the node is still to be sampled
+            """
+            if node.node_id in records:
+                return records[node.node_id]
+            current = None
+            if len(node.locations) > 0: # given or read
+                current = [(location.gps_coordinate[0], location.gps_coordinate[1], location.municipality, location.region, location.type) for location in node.locations]
+            elif node.catchment_node is not None: # transit node; the nearest stops of its catchment node's locations
+                catchment = current_records(node.catchment_node)
+                if catchment is not None:
+                    location_type = f"{node.transit_name_mapping.get(node.transit_type)}_stop"
+                    municipality, region = (catchment[0][2], catchment[0][3]) if len(catchment) > 0 else ("n/a", "n/a")
+                    def stop_records(gps_list: list) -> list:
+                        """
+                        param: gps_list [list] The specified catchment locations as (lat, lon)
+                        return: The list of (lat, lon, municipality, region, type) of the nearest stop of each location
+                        """
+                        stops = node.get_closest_transit_stops(gps_list=gps_list, transit_stops=node.transit_stop_mapping.get(node.transit_type), type=node.transit_line)
+                        return [(stop[0], stop[1], municipality, region, location_type) for stop in stops]
+                    # stored stops of stored catchment locations are kept; only new catchment locations get their nearest stop
+                    current = update.transit_node(node.node_id, node.catchment_node.node_id, catchment, stop_records)
+            elif len(update.stored_nodes.get(node.node_id, [])) > 0: # sampled by an earlier query
+                current = [tuple(record[1:6]) for record in update.node_records if record[0] == node.node_id]
+            records[node.node_id] = current
+            return current
+
+        for node in self.nodes:
+            update.diff_node(node.node_id, current_records(node))
+        for node in self.nodes:
+            origins = current_records(node)
+            for dest_node, profile in node.mobilities.values():
+                destinations = current_records(dest_node)
+                if origins is None or destinations is None:
+                    continue # the query samples the missing locations and queries every cell
+                cells = node.mobility_cells(dest_node, origins=[(float(record[0]), float(record[1])) for record in origins], 
+                                            destinations=[(float(record[0]), float(record[1])) for record in destinations])
+                update.keep_cells(profile, cells)
+        update.apply(self.query_journal_file)
+        report = update.report()
+        print(f"QUERYING: NETWORK UPDATE {report}")
+        self.QUERY(workers=workers, rate=rate, burst=burst, cache=cache, max_cached=max_cached, resume=True, planner=planner, retries=retries)
+        return report
 
-    def READ(self):
+    def READ(self, lazy: bool=True, max_loaded: int=MAX_LOADED_CONNECTIONS):
         """
-        READS DATA FROM LOCAL PROJECT. Data that has already been queried is read. 
+        READS DATA FROM LOCAL PROJECT. Data that has already been queried is read; transit stop nodes stored under legacy identifiers are read 
+        under their current identifiers, leaving the data files as they are. Each data file is read once and its rows are handed to the nodes and 
+        profiles they belong to. 
+        param: lazy [bool] Whether to defer loading each connection's data until it is first used, as opposed to loading all of it now
+        param: max_loaded [int] The number of connections whose lazily loaded data is held in memory at once
         """
+        node_store = NodeStore(self.node_data_file, legacy_node_ids(self.node_data_file, self.connection_data_file, [node.node_id for node in self.nodes]))
         for node in self.nodes: # read in node positions 
-            node.read_node(file=self.node_data_file)
+            node.read_node(file=self.node_data_file, store=node_store)
+        connection_store = ConnectionStore(self.connection_data_file, max_loaded=max_loaded, node_file=self.node_data_file)
         for node in self.nodes: # read in mobility profiles
-            node.read_profiles(file=self.connection_data_file)
+            node.read_profiles(file=self.connection_data_file, store=connection_store, lazy=lazy)
+
+    def transit_stops_gps(self, transit_type: mp.transit_mode) -> dict:
+        """
+        Gets the gps transit stop data of a transit type. 
+        param: transit_type [mp.transit_mode] The specified type of transit
+        return: The dictionary of lists of stop gps coordinates mapped by transit line, including "all"
+        """
+        return {mp.transit_mode.BUS: self.bus_stops_gps, mp.transit_mode.SUBWAY: self.metro_stops_gps, mp.transit_mode.TRAIN: self.train_stops_gps}.get(transit_type, {})
+
+    def scenario(self, name: str) -> NetworkScenario:
+        """
+        Creates a "what if" scenario of this network to apply edits to, such as closing stops, removing a transit line, dropping sub trips, 
+        or scaling the travel time of a mode. Data must already be read; scenarios are evaluated without querying. 
+        param: name [str] The unique identifier of the scenario
+        return: The `NetworkScenario`
+        """
+        return NetworkScenario(self, name)
 
     def connection_bike(self, conn_id: str=None, origin_node: MNode=None, dest_node: MNode=None):
         """
@@ -175,7 +425,8 @@ class MobilityNetworkBase(MobilityTripSampler):
         self.connections.append(profile)
         return profile
     
-    def connection_transit(self, conn_id: str, origin_node: MNode, origin_mobility: MProfile, dest_node: MNode, dest_mobility: MProfile, transit_type: mp.transit_mode, transit_line, depart_time: str=None, arrival_time: str=None):
+    def connection_transit(self, conn_id: str, origin_node: MNode, origin_mobility: MProfile, dest_node: MNode, dest_mobility: MProfile, transit_type: mp.transit_mode, transit_line, depart_time: str=None, arrival_time: str=None,
+                           depart_times: list=None, depart_weights: list=None):
         """
         Creates a three-layer connection across an origin node, transit departure stop node, transit arrival stop node, and destination node. Mobilities  
         as connections are specified for traveling to and from transit stops and for the specific type of transit used between the transit stops.
@@ -188,13 +439,16 @@ class MobilityNetworkBase(MobilityTripSampler):
         param: transit_line [enum] Specifies the line, or "all" lines. Expects an enum from `buses`, `metros`, or `trains`
         param: depart_time [str] Optional arg, exclusive to arrival time, that specifies when to arrive at the departure stop 
         param: arrival_time [str] Option arg, exclusive to departure time, that specifies when to arrive at the arrival stop 
+        param: depart_times [list] Optional grid of departure times (see `mp.TIMING_GRID()`) to sweep in one query; replaces `depart_time`. Every 
+                                  `sample_trip*()` method and `exact_distribution()` take the sweep, while a `NetworkScenario` takes one of its slot profiles
+        param: depart_weights [list] Optional chance of departing at each of `depart_times` when sampling trips; equally likely if not given
+        return: 3D tuple of the origin mobility, the transit profile (a `DepartureSweep` of one profile per departure time when sweeping), and the destination mobility
         """
-        # create a shared transit id extension for both transit stop nodes 
-        transit_node_id = int(random.random() * 100) 
+        # transit stop nodes are named after the connection and type of transit, so they are the same on every run and queried transit node
+        # data can be read and resumed; data stored under the older random `_NN` suffixes is renamed by `migrate_stored_ids()`
         transit_node_name = {mp.transit_mode.BUS: "bus", mp.transit_mode.SUBWAY: "metro", mp.transit_mode.TRAIN: "train"}.get(transit_type)
-        # transit nodes share id of the origin / dest node they directly connect to; then they share a common transit id combined
-        depart_node_id = f"{conn_id}_{transit_node_name}_depart_{transit_node_id}"
-        arrival_node_id = f"{conn_id}_{transit_node_name}_arrival_{transit_node_id}"
+        depart_node_id = f"{conn_id}_{transit_node_name}_depart"
+        arrival_node_id = f"{conn_id}_{transit_node_name}_arrival"
         
         # create nodes at transit stops 
         depart_stop_node = MNode(bus_stops_gps=self.bus_stops_gps, metro_stops_gps=self.metro_stops_gps, train_stops_gps=self.train_stops_gps, id=depart_node_id, 
@@ -202,16 +456,21 @@ class MobilityNetworkBase(MobilityTripSampler):
         arrival_stop_node = MNode(bus_stops_gps=self.bus_stops_gps, metro_stops_gps=self.metro_stops_gps, train_stops_gps=self.train_stops_gps, id=arrival_node_id,
                                         catchment_node=dest_node, transit_type=transit_type, transit_line=transit_line, filter_gps_zones=None)
 
-        # create the transit connection profile 
-        transit_profile = MProfile(connection_id=conn_id, origin_node_id=depart_node_id, destination_node_id=arrival_node_id)
-        transit_profile.set(mp.mode.TRANSIT) 
-        transit_profile.set(transit_type) # give specified type
-
-        # set transit profile with timing criteria 
-        if depart_time is not None and arrival_time is None:
-            transit_profile.set(mp.timing.SET_DEPARTURE, depart_time)
-        elif depart_time is None and arrival_time is not None:
-            transit_profile.set(mp.timing.SET_ARRIVAL, arrival_time)
+        # create the transit connection profile; one per departure time slot when sweeping, each between the same transit stop nodes
+        timings = [depart_time] if depart_times is None else list(depart_times)
+        slot_profiles = []
+        for k, slot_time in enumerate(timings):
+            slot_id = conn_id if depart_times is None else f"{conn_id}_slot_{k}"
+            slot_profile = MProfile(connection_id=slot_id, origin_node_id=depart_node_id, destination_node_id=arrival_node_id)
+            slot_profile.set(mp.mode.TRANSIT) 
+            slot_profile.set(transit_type) # give specified type
+            # set transit profile with timing criteria 
+            if slot_time is not None and arrival_time is None:
+                slot_profile.set(mp.timing.SET_DEPARTURE, slot_time)
+            elif slot_time is None and arrival_time is not None:
+                slot_profile.set(mp.timing.SET_ARRIVAL, arrival_time)
+            slot_profiles.append(slot_profile)
+        transit_profile = slot_profiles[0] if depart_times is None else mp.DepartureSweep(conn_id, slot_profiles, timings, depart_weights)
 
         # attach connections to initial and final profiles for the start and end of the trip mobilities
         origin_mobility.attach(connect_id=f"{conn_id}_orig_mob", origin_node_id=origin_node.node_id, destination_node_id=depart_node_id)
@@ -219,13 +478,14 @@ class MobilityNetworkBase(MobilityTripSampler):
 
         # add mobility connections to nodes 
         origin_node.add_mobility(connection_id=conn_id, dest_node=depart_stop_node, profile=origin_mobility)
-        depart_stop_node.add_mobility(connection_id=conn_id, dest_node=arrival_stop_node, profile=transit_profile)
+        for slot_profile in slot_profiles:
+            depart_stop_node.add_mobility(connection_id=slot_profile.connection_id, dest_node=arrival_stop_node, profile=slot_profile)
         arrival_stop_node.add_mobility(connection_id=conn_id, dest_node=dest_node, profile=dest_mobility)
         # append created nodes and connections to network
         self.nodes.append(depart_stop_node)
         self.nodes.append(arrival_stop_node)
-        # append the transit connection 
-        self.connections.append(transit_profile) 
+        # append the transit connection of every departure time slot
+        self.connections.extend(slot_profiles) 
         # append initial and final mobilities if they have not yet been
         self.connections.append(origin_mobility)
         self.connections.append(dest_mobility)
@@ -233,7 +493,8 @@ class MobilityNetworkBase(MobilityTripSampler):
         # return the profiles of the trip in order
         return (origin_mobility, transit_profile, dest_mobility)
 
-    def connection_bus(self, conn_id: str, origin_node: MNode, origin_mobility: MProfile, dest_node: MNode, dest_mobility: MProfile, bus_line, depart_time:str=None, arrival_time:str=None):
+    def connection_bus(self, conn_id: str, origin_node: MNode, origin_mobility: MProfile, dest_node: MNode, dest_mobility: MProfile, bus_line, depart_time:str=None, arrival_time:str=None,
+                       depart_times: list=None, depart_weights: list=None):
         """
         Creates a mobility connection for by public transit bus. Specified times are optional but one or the other must be given. 
         Times should be passed in strings that are formatted by use of `mp.TIMING()` function.
@@ -242,12 +503,16 @@ class MobilityNetworkBase(MobilityTripSampler):
         param: des_node [MNode] The end or destination node
         param: depart_time [str] The optional departure time 
         param: arrive_time [str] The optional arrival time 
+        param: depart_times [list] The optional grid of departure times to sweep; see `connection_transit()`
+        param: depart_weights [list] The optional chance of departing at each of `depart_times`
         return: The mobility profile `MProfile`
         """
-        trip_profiles = self.connection_transit(conn_id, origin_node, origin_mobility, dest_node, dest_mobility, mp.transit_mode.BUS, bus_line, depart_time, arrival_time)
+        trip_profiles = self.connection_transit(conn_id, origin_node, origin_mobility, dest_node, dest_mobility, mp.transit_mode.BUS, bus_line, depart_time, arrival_time, 
+                                                  depart_times, depart_weights)
         return trip_profiles # return the trip mobility
     
-    def connection_metro(self, conn_id: str, origin_node: MNode, origin_mobility: MProfile, dest_node: MNode, dest_mobility: MProfile, metro_line: metros, depart_time:str=None, arrival_time:str=None):
+    def connection_metro(self, conn_id: str, origin_node: MNode, origin_mobility: MProfile, dest_node: MNode, dest_mobility: MProfile, metro_line: metros, depart_time:str=None, arrival_time:str=None,
+                         depart_times: list=None, depart_weights: list=None):
         """
         Creates a mobility connection for by public transit metro. Specified times are optional but one or the other must be given. 
         Times should be passed in strings that are formatted by use of `mp.TIMING()` function.
@@ -256,12 +521,16 @@ class MobilityNetworkBase(MobilityTripSampler):
         param: des_node [MNode] The end or destination node
         param: depart_time [str] The optional departure time 
         param: arrive_time [str] The optional arrival time 
+        param: depart_times [list] The optional grid of departure times to sweep; see `connection_transit()`
+        param: depart_weights [list] The optional chance of departing at each of `depart_times`
         return: The mobility profile `MProfile`
         """
-        trip_profiles = self.connection_transit(conn_id, origin_node, origin_mobility, dest_node, dest_mobility, mp.transit_mode.SUBWAY, metro_line, depart_time, arrival_time)
+        trip_profiles = self.connection_transit(conn_id, origin_node, origin_mobility, dest_node, dest_mobility, mp.transit_mode.SUBWAY, metro_line, depart_time, arrival_time, 
+                                                  depart_times, depart_weights)
         return trip_profiles # return the trip mobility
     
-    def connection_train(self, conn_id: str, origin_node: MNode, origin_mobility: MProfile, dest_node: MNode, dest_mobility: MProfile, train_line: trains, depart_time:str=None, arrival_time:str=None):
+    def connection_train(self, conn_id: str, origin_node: MNode, origin_mobility: MProfile, dest_node: MNode, dest_mobility: MProfile, train_line: trains, depart_time:str=None, arrival_time:str=None,
+                         depart_times: list=None, depart_weights: list=None):
         """
         Creates a mobility connection for by public transit train. Specified times are optional but one or the other must be given. 
         Times should be passed in strings that are formatted by use of `mp.TIMING()` function.
@@ -270,9 +539,12 @@ class MobilityNetworkBase(MobilityTripSampler):
         param: des_node [MNode] The end or destination node
         param: depart_time [str] The optional departure time 
         param: arrive_time [str] The optional arrival time 
+        param: depart_times [list] The optional grid of departure times to sweep; see `connection_transit()`
+        param: depart_weights [list] The optional chance of departing at each of `depart_times`
         return: The mobility profile `MProfile`
         """
-        trip_profiles = self.connection_transit(conn_id, origin_node, origin_mobility, dest_node, dest_mobility, mp.transit_mode.TRAIN, train_line, depart_time, arrival_time)
+        trip_profiles = self.connection_transit(conn_id, origin_node, origin_mobility, dest_node, dest_mobility, mp.transit_mode.TRAIN, train_line, depart_time, arrival_time, 
+                                                  depart_times, depart_weights)
         return trip_profiles # return the trip mobility
     
     def node_10(self, node_id: str, gps: tuple, radius: float, filter_gps_zones: list):
@@ -1,6 +1,9 @@
 from decimal import Decimal as decimal
 from internal.gps_sample import *
 import internal.mobility_profile as mp
+import internal.kernels as kernels
+from internal.connection_store import *
+from internal.spatial_index import *
 import itertools
 
 class buses(enum):
@@ -69,7 +72,7 @@ class MobilityNode(GPSSample):
         # location list should be empty for location sampling; if predetermined set-locations are given, then wrap in `self.Location` objects and assign that as the list
         self.locations = [] if set_locations is None else [self.Location(lat=location[0], lon=location[1], type="n/a", municipality="n/a", region="n/a") for location in set_locations]
         self.mobilities = {} # mapping of ways to estimate travel efficiency from "this" node / area 
-        self.mobility_data = {} # mapping of estimated travel data for each mobility; maps to vectors of distance (km) and time (min)
+        self.mobility_data = {} # mapping of estimated travel data for each mobility; maps to 3D tuples of (`ODMatrix`, row of each location, column of each destination node location)
         self.mobility_ids = [] # list of mobility identifiers
         self.node_id = id # node id
         self.catchment_node = catchment_node
@@ -78,30 +81,39 @@ class MobilityNode(GPSSample):
 
     def get_closest_transit_stops(self, gps_list: list, transit_stops: dict, type: any) -> list:
         """
-        Determines the closet transit stop near each given GPS position, provided a dataset specifying a transit type. 
+        Determines the closet transit stop near each given GPS position by great-circle distance, provided a dataset specifying a transit type. 
         Transit stops given being a dictionary of lists mapped by transit line types such as "M1", "M2", "all", etc. 
-        Type given is expected from the `buses`, `metros`, and `trains` enums specified above. 
+        Type given is expected from the `buses`, `metros`, and `trains` enums specified above. Stops are looked up through a spatial index; 
+        the index of this node's own transit stops is built once per transit type and line and shared by all nodes. 
         param: gps_list [list] The specified positions 
         param: transit_stops [dict] The dataset of lists filtered by transit line type
         param: type [enum] The type of transit line
         return: The list of nearby transit stops
         """
-        # closest nearby stop to each gps location and its distance
-        nearby_gps_stops = list(itertools.repeat((0,0), len(gps_list)))
-        min_distances = list(itertools.repeat(None, len(gps_list)))
-        # step through list of gps stops 
-        for gps_stop in transit_stops[type]:
-            for i in range(0, len(gps_list)):
-                # calculate distance to this gps location from transit stop
-                distance = pow(pow(gps_stop[0] - gps_list[i][0], 2.0) + pow(gps_stop[1] - gps_list[i][1], 2.0), 0.5)
-                # should a closer stop be found, account for it
-                if min_distances[i] is None or distance < min_distances[i]:
-                    nearby_gps_stops[i] = (gps_stop[0], gps_stop[1])
-                    min_distances[i] = distance
+        gps_stops = transit_stops[type]
+        # no stops to choose from
+        if len(gps_stops) == 0:
+            return list(itertools.repeat((0,0), len(gps_list)))
+        # stops of the network are indexed once; other stop lists (e.g. of a scenario) are indexed for this lookup only
+        if transit_stops is self.transit_stop_mapping.get(self.transit_type):
+            index = transit_stop_index(self.transit_type, type, gps_stops)
+        else:
+            index = SpatialIndex([gps_stop[0] for gps_stop in gps_stops], [gps_stop[1] for gps_stop in gps_stops])
+        nearest, _ = index.query([gps[0] for gps in gps_list], [gps[1] for gps in gps_list], k=1)
+        nearby_gps_stops = [(gps_stops[j][0], gps_stops[j][1]) for j in nearest[:, 0].tolist()]
         # return closest transit stop
         return nearby_gps_stops
 
-    def query_node(self, file: str):
+    def query_node(self, file: str, journal: mp.QueryJournal=None, telemetry: mp.Telemetry=None):
+        """
+        Samples locations for this node by query and writes them to local storage. 
+        param: file [str] The specified file to write data to
+        param: journal [QueryJournal] Optional journal of the network query; nodes it holds as written are read back instead of re-sampled
+        param: telemetry [Telemetry] Optional telemetry to record geocoding calls in
+        """
+        if not self.queried and journal is not None and journal.node_done(self.node_id):
+            self.data_file = file
+            self.read_node(file) # sampled by an earlier run of the query
         if not self.queried:
             self.data_file = file
             with open(file, "a") as node_file:
@@ -110,12 +122,12 @@ class MobilityNode(GPSSample):
                 if self.locations is None or len(self.locations) == 0:
                     # randomly sample locations 
                     if self.catchment_node is None: 
-                        _,_,_, locations = self.fetch_radial_location_sample(self.root_lat, self.root_lon, self.area_radius, self.n, self.filter_gps_zoes)   
+                        _,_,_, locations = self.fetch_radial_location_sample(self.root_lat, self.root_lon, self.area_radius, self.n, self.filter_gps_zoes, telemetry)   
                     # catchment is present; this node must be a transit node. Find locations accordingly
                     else:   
                         # query the catchment node if needed as a dependency for this node querying 
                         if not self.catchment_node.queried:
-                            self.catchment_node.query_node(file)
+                            self.catchment_node.query_node(file, journal, telemetry)
 
                         # get lists of location gps positions - QUERY STEP
                         gps_catchment_locations = [location.gps_coordinate for location in self.catchment_node.locations]
@@ -144,22 +156,23 @@ class MobilityNode(GPSSample):
                     # store data in file 
                     node_file.write(f"{self.node_id},{location.gps_coordinate[0]},{location.gps_coordinate[1]},{location.municipality},{location.region},{location.type}\n") 
                 self.queried = locations is not None # flag queried state 
+            if journal is not None and self.queried:
+                journal.record_node(self.node_id, file)
         print(f"Done querying node: {id}")
 
-    def read_node(self, file: str):
+    def read_node(self, file: str, store: NodeStore=None):
         """
         Samples locations for this node from local storage. 
         param: file [str] The specified file to import data from  
+        param: store [NodeStore] Optional node data already read from the file; the file is read if not given
         """
-        with open(file, newline='') as node_file:
-            # reset locations list for reading 
-            self.locations.clear()
-            for record in csv.reader(node_file):
-                # add record if for this node
-                if str(record[0]) == self.node_id:
-                    location = self.Location(lat=float(record[1]), lon=float(record[2]), type=str(record[5]), municipality=str(record[3]), region=str(record[4]))
-                    self.locations.append(location)
-            self.queried = self.locations is not None
+        store = store if store is not None else NodeStore(file)
+        # reset locations list for reading 
+        self.locations.clear()
+        for record in store.get(self.node_id):
+            location = self.Location(lat=float(record[1]), lon=float(record[2]), type=str(record[5]), municipality=str(record[3]), region=str(record[4]))
+            self.locations.append(location)
+        self.queried = self.locations is not None
 
     def add_mobility(self, connection_id, dest_node, profile):
         """
@@ -173,76 +186,95 @@ class MobilityNode(GPSSample):
             print(f"Added mobility {connection_id} to node {self.node_id} connecting to {dest_node.node_id}")
             self.mobility_ids.append(str(connection_id))
 
-    def query_profiles(self, file: str):
+    def is_catchment_mobility(self, dest_node: 'MobilityNode') -> bool:
+        """
+        Determines if a mobility to a destination node is a catchment connection; one between a catchment node and its transit node, where 
+        the i-th location of one node is only connected to the i-th location of the other. 
+        param: dest_node [MobilityNode] The destination node of the mobility
+        return: Whether exactly one of the two nodes is a transit node
+        """
+        return (self.catchment_node is not None) != (dest_node.catchment_node is not None)
+
+    def mobility_cells(self, dest_node: 'MobilityNode', origins: list=None, destinations: list=None) -> list:
+        """
+        Lists the origin-destination cells that a mobility to a destination node needs estimation data for. 
+        param: dest_node [MobilityNode] The destination node of the mobility
+        param: origins [list] Optional locations (as `GPS()` strings) to use for this node; its sampled locations are used if not given
+        param: destinations [list] Optional locations (as `GPS()` strings) to use for the destination node; its sampled locations are used if not given
+        return: The list of 4D tuples of (origin, destination, origin index, destination index), as given to `MProfile.query_cells()`
+        """
+        if origins is None:
+            origins = [mp.GPS(latitude=location.gps_coordinate[0], longitude=location.gps_coordinate[1]) for location in self.locations]
+        if destinations is None:
+            destinations = [mp.GPS(latitude=location.gps_coordinate[0], longitude=location.gps_coordinate[1]) for location in dest_node.locations]
+        if self.is_catchment_mobility(dest_node):
+            # only the i-th origin location to the i-th dest location; the i-th location in both nodes represents the closest dest node 
+            # location to the given catchment origin node location
+            n = max(0, min(len(origins), len(destinations))) # number of sub trips between nodes; should be the same in the catchment case
+            return [(origins[i], destinations[i], i, i) for i in range(0, n)]
+        # all possible permutations of sub trips between nodal locations 
+        return [(origins[i], destinations[j], i, j) for i in range(0, len(origins)) for j in range(0, len(destinations))]
+
+    def query_profiles(self, file: str, executor: mp.QueryExecutor=None, planner: mp.RequestPlanner=None):
         """
-        Queries all mobility profiles belonging to this node to retrieve estimation data to store locally. 
+        Queries all mobility profiles belonging to this node to retrieve estimation data to store locally. Repeated pairs (e.g. catchment 
+        locations sharing a stop) are fetched once and cells are packed into shared requests by the planner, paced by the executor's rate limit.
         param: file [str] The file to import estimation data to 
+        param: executor [QueryExecutor] Optional executor to queue the queries on; queries are done once it is joined or closed
+        param: planner [RequestPlanner] Optional planner to add the queries' cells to; they are fetched once it is submitted to `executor`
         """
         print(f"Querying all {len(self.mobilities)} mobility profiles for node {self.node_id}")
         # step through mobilities between "this" node and adjacent nodes by respective mobility profile
         for mobility in self.mobilities.values():
             # adjacent node and means of travel profile for estimating data
             dest_node, profile = mobility[0], mobility[1]
-    
             # retrieve origin and destination gps sample data; data was sampled upon creation of each `MobilityNode` instance
-            # If the dest has catchment, the orig is a catchment node
-            # Only query the i-th orig location to the i-th dest location
-            if (self.catchment_node is not None or dest_node.catchment_node is not None) and not (self.catchment_node is not None and dest_node.catchment_node is not None):
-                print(f"Catchment Connection! origin node count = {len(self.locations)}, dest node count = {len(dest_node.locations)}")
-                n = max(0, min(len(self.locations), len(dest_node.locations))) # number of sub trips between nodes; should be the same in the catchment case
-                print(f"Query for n={n} sub trips")
-                import time 
-                time.sleep(2.0)
-                # query only the i-th origin location to the i-th dest location
-                for i in range(0, n): # the i-th location in both nodes represents the closest dest node location to the given catchment origin node location
-                    origin, destination = self.locations[i], dest_node.locations[i]
-                    profile.query_profile(origins=[mp.GPS(latitude=origin.gps_coordinate[0], longitude=origin.gps_coordinate[1])],
-                                          destinations=[mp.GPS(latitude=destination.gps_coordinate[0],longitude=destination.gps_coordinate[1])],
-                                          file=file)
-            else: # query all origins against all destination locations at once; find all possible permutations of sub trips between nodal locations 
-                print(f"Normal querying!")
-                origins, destinations = [], []
-                for origin in self.locations:
-                    origins.append(mp.GPS(latitude=origin.gps_coordinate[0], longitude=origin.gps_coordinate[1]))
-                for destination in dest_node.locations:
-                    destinations.append(mp.GPS(latitude=destination.gps_coordinate[0], longitude=destination.gps_coordinate[1]))
-                # fetch chunks of route data in sub lists:
-                profile.query_profile(origins=origins, destinations=destinations, file=file) 
-            
+            cells = self.mobility_cells(dest_node)
+            print(f"Query for n={len(cells)} sub trips {'(catchment connection)' if self.is_catchment_mobility(dest_node) else ''}")
+            profile.query_cells(cells, file=file, executor=executor, planner=planner)
             print(f"Fetched data for node\nDone computing for node {self.node_id}")
 
-    def read_profiles(self, file: str):
+    def read_profiles(self, file: str, store: ConnectionStore=None, lazy: bool=False):
         """
         Reads in estimation data for all mobility profiles for traveling between this node and another given a file to import from locally. 
         param: file [str] The file to import from
+        param: store [ConnectionStore] Optional connection data already read from the file; the file is read if not given
+        param: lazy [bool] Whether to defer loading each profile's data until it is first used
         """
         print(f"Querying all {len(self.mobilities)} mobility profiles for node {self.node_id}")
+        store = store if store is not None else ConnectionStore(file)
         # step through mobilities between "this" node and adjacent nodes by respective mobility profile
         for mobility in self.mobilities.values():
             profile = mobility[1] # get profile
-            profile.read_profile(file=file) # read local data into profile 
+            profile.read_profile(file=file, store=store, lazy=lazy) # read local data into profile 
 
     def get(self, id: str, origin_index: int, dest_index: int):
         """
         Looks up and returns the memoized distance [km] and time [min] data associated between indexed 
         origin and destinations points belonging to "this" node and adjacent local node specified by a given id
-        respectively. Returns `None` if local get fails. 
+        respectively. Returns `None` if local get fails. Lookups are constant-time once the mobility's origin-destination matrix is built. 
         param: id [str] The specified identifier of the mobility relationship
         param: origin_index [int] The specified origin index in the relationship mobility data
         param: dest_index [int] The specified destination index in the relationship mobility data
         return: 2D tuple of origin-destination route data of time and distance in [min] and [km] respectively
         """
-        if id in self.mobilities.keys:
-            print(f"Retrieving route data for edge {(origin_index, dest_index)} of relationship {id}")
+        if id in self.mobilities.keys():
             mobility = self.mobilities[id] # get corresponding mobility relationship
             # get corresponding node and associated mobility profile 
             dest_node, profile = mobility[0], mobility[1]
+            if len(self.locations) == 0 or len(dest_node.locations) == 0:
+                return None # no locations to index
             # clamp point indices for origin/dest between expected values 
-            origin_index = max(0, min(len(self.locations), origin_index))
-            dest_index = max(0, min(len(dest_node.locations), dest_index))
+            origin_index = max(0, min(len(self.locations) - 1, origin_index))
+            dest_index = max(0, min(len(dest_node.locations) - 1, dest_index))
+            # map node locations to rows and columns of the profile's origin-destination matrix; re-mapped only when the matrix is re-built
+            od_matrix = profile.od_matrix()
+            if id not in self.mobility_data or self.mobility_data[id][0] is not od_matrix:
+                rows, columns = od_matrix.locate([location.gps_coordinate for location in self.locations], [location.gps_coordinate for location in dest_node.locations])
+                self.mobility_data[id] = (od_matrix, rows, columns)
+            _, rows, columns = self.mobility_data[id]
             # return estimated data 
-            print(f"Done retrieving data")
-            return profile.get(origin_index, dest_index)
+            return od_matrix.get(int(rows[origin_index]), int(columns[dest_index]))
         return None # failed to find id; do nothing 
 # short-hand alias
 MNode = MobilityNode
\ No newline at end of file
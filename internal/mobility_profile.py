@@ -1,10 +1,16 @@
+from internal.connection_store import *
+from internal.od_matrix import *
+from internal.query_executor import *
+from internal.request_planner import *
 import requests
 from enum import Enum as enum
 from decimal import Decimal as decimal
 from collections import defaultdict
-from datetime import datetime
+from datetime import datetime, timedelta
+import numpy as np
 import time
 import csv
+import hashlib
 
 def GPS(latitude: float, longitude: float) -> str: 
     """
@@ -35,6 +41,20 @@ def TIMING(year: int, month: int, day: int, hour: int, minute: int) -> str:
     minute_str = f"0{minute}" if minute <= 9 else f"{minute}"
     # return formatted date-time
     return f"{year}-{month_str}-{day_str} {hour_str}:{minute_str}:00"
+def TIMING_GRID(year: int, month: int, day: int, hour: int, minute: int, step_min: int, count: int) -> list:
+    """
+    Formats a grid of evenly spaced dates and times for a departure time sweep (e.g. every 15 minutes through the morning peak).
+    :param year [int] Year of the first time formatted as 20XX or 19XX
+    :param month [int] Month of the first time
+    :param day [int] Day of the first time
+    :param hour [int] Hour of the first time in 24-hr format
+    :param minute [int] Minutes of the first time
+    :param step_min [int] Minutes between consecutive times
+    :param count [int] The number of times
+    """
+    start = datetime(year, month, day, hour, minute)
+    times = [start + timedelta(minutes=step_min * k) for k in range(0, count)]
+    return [TIMING(t.year, t.month, t.day, t.hour, t.minute) for t in times]
 
 class time_units(enum): 
     """Allowable `DistanceMatrix` units for time."""
@@ -107,6 +127,74 @@ def convert_distance(input: float, in_type: distance_units, out_type: distance_u
     elif out_type.value == distance_units.KILOMETER.value:
         return get_kilometers(input, in_type)
 
+def parse_element_text(element: dict) -> tuple:
+    """
+    Parses the time [mins] and distance [km] of a DistanceMatrix response element from its human-readable texts. 
+    ASSUMPTION: time is within 24 [hr] travel for distances within 1000 [km]
+    param: element [dict] The specified response element
+    return: 2D tuple of travel route time and distance in [min] and [km] respectively
+    """
+    distance_data = str(element["distance"]["text"]).split()
+    time_data = str(element["duration"]["text"]).split()
+    # time and distance data
+    est_distance, distance_u = float(distance_data[0]), distance_units(str(distance_data[1]))
+    time_mins = 0.0 # sum estimated time parts in [mins]
+
+    # time is split into many parts of varying units (e.g. 2 hrs 34 mins <=> split = ['2', 'hrs', '34', 'mins'])
+    # step through parts of quantities and unit type; convert to [mins] and sum
+    time_data_part, time_u_part, add_time_part = 0.0, "", False
+    for i in range(0, len(time_data)):
+        if i % 2 == 0: # even index or zero; numerical data
+            time_data_part = float(time_data[i])
+        else: # odd index; data units
+            time_u_part = time_units(str(time_data[i]))
+            add_time_part = True # ready to add part
+        if add_time_part: # completed part
+            time_mins += convert_time(time_data_part, time_u_part, time_units("mins"))
+            add_time_part = False 
+
+    # convert data to desired units and return
+    distance_km = convert_distance(est_distance, distance_u, distance_units("km"))
+    return (time_mins, distance_km)
+
+def decode_data_batch(data_batch, n_origins: int, n_destinations: int) -> tuple:
+    """
+    Decodes a whole fetched data batch (the `rows` of a response) into arrays in one pass. Times and distances come from the numeric `value` 
+    fields of each element (in [s] and [m]); elements without them fall back to their texts. Elements with a status other than OK, missing 
+    elements, and malformed elements are masked out. 
+    param: data_batch [any] The specified data batch; `None` if fetching failed
+    param: n_origins [int] The number of origins the batch was fetched for
+    param: n_destinations [int] The number of destinations the batch was fetched for
+    return: 3D tuple of (n_origins, n_destinations) arrays of time [min], distance [km], and whether each cell was decoded
+    """
+    positions, times, distances = [], [], []
+    rows = data_batch if isinstance(data_batch, list) else []
+    for i in range(0, min(n_origins, len(rows))):
+        elements = rows[i].get("elements") if isinstance(rows[i], dict) else None
+        elements = elements if isinstance(elements, list) else []
+        for j in range(0, min(n_destinations, len(elements))):
+            element = elements[j]
+            if not isinstance(element, dict) or element.get("status", "OK") != "OK":
+                continue
+            try:
+                duration, distance = element["duration"], element["distance"]
+                if "value" in duration and "value" in distance:
+                    time_min, distance_km = float(duration["value"]) / 60.0, float(distance["value"]) / 1000.0
+                else:
+                    time_min, distance_km = parse_element_text(element)
+            except (KeyError, IndexError, TypeError, ValueError):
+                continue # malformed element
+            positions.append(i * n_destinations + j)
+            times.append(time_min)
+            distances.append(distance_km)
+    time_min = np.full((n_origins, n_destinations), np.nan)
+    distance_km = np.full((n_origins, n_destinations), np.nan)
+    decoded = np.zeros((n_origins, n_destinations), dtype=bool)
+    time_min.flat[positions] = times
+    distance_km.flat[positions] = distances
+    decoded.flat[positions] = True
+    return time_min, distance_km, decoded
+
 # note: duration_in_traffic field is only returned conditionally; may be useful
 # note: class enums (excluding `required` and `timing`) type names are query field names with enumerations as the allowable inputs
 class mode(enum):
@@ -148,7 +236,7 @@ class timing(enum):
     Enforces specified timing. Specifier enums are exclusive to each other. 
     FORMAT: YYYY-MM-DDTHH:MM:SSZ
     """
-    SET_DEPARTURE = "departure_time", # names of required fields
+    SET_DEPARTURE = "departure_time" # names of required fields
     SET_ARRIVAL = "arrival_time"
 
 class required(enum):
@@ -186,6 +274,10 @@ class MobilityProfile:
         self.api_key = ""
         # memoized data from batch fetches
         self.memoized_data = []
+        # connection data read lazily; rows are fetched from the store when first needed
+        self.store = None
+        # origin-destination matrices of the data; mapped by matrix type, each a 2D tuple of (`signature()` of the data built from, `ODMatrix`)
+        self.od_matrices = {}
         # routing counts: 
         self.origin_count = 0
         self.destination_count = 0
@@ -266,139 +358,280 @@ class MobilityProfile:
 
         return self
 
-    def fetch_data_batch(self, sub_origins: list, sub_destinations: list): 
+    def uses(self, param) -> bool:
+        """
+        Determines if the chained query of this profile was set with a given means of travel. 
+        param: param [mode | transit_mode] The specified means of travel
+        return: Whether the profile travels by the given means
+        """
+        if isinstance(param, mode):
+            return self.mode == f"&mode={str(param.value)}"
+        elif isinstance(param, transit_mode):
+            return self.transit_mode == f"&transit_mode={str(param.value)}"
+        return False
+
+    def query_url(self, sub_origins: list, sub_destinations: list) -> str:
+        """
+        Creates the url of the chained query between the given origins and destinations. The profile is not changed, so urls of 
+        many kernels can be made at once (e.g. by concurrent workers). 
+        param: sub_origins [list] The specified origins
+        param: sub_destinations [list] The specified destinations
+        return: The url
+        """
+        origins = f"?{required.ORIGINS.value}=" + "|".join(str(origin) for origin in sub_origins)
+        destinations = f"&{required.DESTINATIONS.value}=" + "|".join(str(destination) for destination in sub_destinations)
+        return f"{self.BASE_URL}{origins}{destinations}{self.timing}{self.transit_mode}{self.traffic_model}{self.avoid}{self.mode}&key={self.API_KEY}"
+
+    def fetch_data_batch(self, sub_origins: list, sub_destinations: list, executor: QueryExecutor=None): 
         """
         Fetches data of chained query.
-        return: The fetched data
+        param: sub_origins [list] The specified origins
+        param: sub_destinations [list] The specified destinations
+        param: executor [QueryExecutor] Optional executor whose shared session and rate limit to send the request through
+        return: The fetched data; `None` if the provider answered with an error status
         """
-        # set fields for url
-        self.api_key = f"&key={self.API_KEY}"
-        self.set(required.ORIGINS, sub_origins)
-        self.set(required.DESTINATIONS, sub_destinations)
         # create the url and return fetched data batch
-        url = f"{self.BASE_URL}{self.origins}{self.destinations}{self.timing}{self.transit_mode}{self.traffic_model}{self.avoid}{self.mode}{self.api_key}"
-        data = requests.get(url).json()
+        url = self.query_url(sub_origins, sub_destinations)
+        response = executor.get(url) if executor is not None else requests.get(url)
+        response.raise_for_status() # provider outages (e.g. 503) fail the batch like connection errors
+        data = response.json()
 
-        if data["status"] == "OK":
+        if isinstance(data, dict) and data.get("status") == "OK" and isinstance(data.get("rows"), list):
             return data["rows"]
         return None
 
     def get_data_batch_cell(self, sub_origin: int, sub_destination: int, data_batch):
         """
         Parses the time [mins] and distance [km] of a route between specified origin and destination from given fetched batch of data. 
-        ASSUMPTION: time is within 24 [hr] travel for distances within 1000 [km]
+        Whole batches are decoded at once by `decode_data_batch()`.
         param: sub_origin [int] Specified origin index 
         param: sub_destination [int] Specified destination index 
         param: data_batch [any] Specified data batch that was fetched 
         return: 2D tuple of travel route time and distance in [min] and [km] respectively
         """
-        sub_origin = max(0, min(self.origin_count - 1, sub_origin))
-        sub_destination = max(0, min(self.destination_count - 1, sub_destination))
+        sub_origin = max(0, min(len(data_batch) - 1, sub_origin))
+        sub_destination = max(0, min(len(data_batch[sub_origin]["elements"]) - 1, sub_destination))
         # pull estimates from given data batch 
-        data = data_batch[sub_origin]["elements"][sub_destination]
-        distance_data = str(data["distance"]["text"]).split()
-        time_data = str(data["duration"]["text"]).split()
-       
-        # time and distance data
-        est_distance, distance_u = float(distance_data[0]), distance_units(str(distance_data[1]))
-        time_mins = 0.0 # sum estimated time parts in [mins]
-
-        # time is split into many parts of varying units (e.g. 2 hrs 34 mins <=> split = ['2', 'hrs', '34', 'mins'])
-        # step through parts of quantities and unit type; convert to [mins] and sum
-        time_data_part, time_u_part, add_time_part = 0.0, "", False
-        for i in range(0, len(time_data)):
-            print(f"time_data[i] == {time_data[i]}")
-            if i % 2 == 0: # even index or zero; numerical data
-                time_data_part = float(time_data[i])
-            else: # odd index; data units
-                time_u_part = time_units(str(time_data[i]))
-                add_time_part = True # ready to add part
-            if add_time_part: # completed part
-                time_mins += convert_time(time_data_part, time_u_part, time_units("mins"))
-                add_time_part = False 
-
-        # convert data to desired units and return
-        distance_km = convert_distance(est_distance, distance_u, distance_units("km"))
-        return (time_mins, distance_km)
+        return parse_element_text(data_batch[sub_origin]["elements"][sub_destination])
     
-    def query_profile(self, origins: list, destinations: list, file: str):
+    def query_signature(self) -> str:
         """
-        This computes the estimation data for traveling between two nodes and writes locally.
-        param: origins [list] The specified origins to set and get data for
-        param: destinations [list] The specified destinations to set and get data for  
+        return: The query parameters of this profile apart from origins and destinations; profiles with the same signature can share requests
+        """
+        return "|".join((self.mode, self.transit_mode, self.timing, self.traffic_model, self.avoid))
+
+    def cache_key(self, origin: str, destination: str) -> str:
+        """
+        Creates the key of a route in a `ResponseCache`; the same for every profile that queries the route with the same parameters.
+        param: origin [str] The specified origin
+        param: destination [str] The specified destination
+        return: The key of (origin, destination, mode, transit mode, timing, traffic model, avoid)
+        """
+        return "|".join((str(origin).replace(" ", ""), str(destination).replace(" ", ""), self.query_signature()))
+
+    def journal_key(self) -> str:
+        """
+        return: The key of this profile in a `QueryJournal`; its connection and node identifiers
+        """
+        return f"{self.connection_id}|{self.origin_node_id}|{self.destination_node_id}"
+
+    def cache_elements(self, kernel: tuple, data_batch) -> dict:
         """
-        def sub_inv_cartesian_product(row_ids: list, col_ids: list, p0: tuple, p1: tuple) -> list:
+        Finds the response elements of a fetched kernel worth caching; those of routes that were found.
+        param: kernel [tuple] The kernel, or any tuple that starts with its (sub origins, sub destinations)
+        param: data_batch [any] The data batch fetched for the kernel
+        return: The dictionary of response elements mapped by their `cache_key()`
+        """
+        sub_origins, sub_destinations = kernel[0], kernel[1]
+        elements = {}
+        for origin_index in range(0, min(len(sub_origins), len(data_batch))):
+            row = data_batch[origin_index].get("elements", []) if isinstance(data_batch[origin_index], dict) else []
+            for destination_index in range(0, min(len(sub_destinations), len(row))):
+                if isinstance(row[destination_index], dict) and row[destination_index].get("status") == "OK":
+                    elements[self.cache_key(sub_origins[origin_index], sub_destinations[destination_index])] = row[destination_index]
+        return elements
+
+    def cached_kernels(self, cells: list, cached: dict) -> list:
+        """
+        Gathers the cells of a query whose routes are already in `cached` into kernels with their data batches, so they are recorded like fetched ones.
+        param: cells [list] The list of 4D tuples of (origin, destination, origin index, destination index) of each cell
+        param: cached [dict] The response elements mapped by `cache_key()`
+        return: The list of 2D tuples of (kernel, data batch), one per origin with cached routes
+        """
+        rows = defaultdict(list) # mapping of (origin, origin index) to lists of (destination, destination index) of cached routes
+        for origin, destination, origin_index, destination_index in cells:
+            if self.cache_key(origin, destination) in cached:
+                rows[(origin, origin_index)].append((destination, destination_index))
+        kernels = []
+        for (origin, origin_index), destinations in rows.items():
+            kernel = ([origin], [destination for destination, _ in destinations], [origin_index], [index for _, index in destinations])
+            kernels.append((kernel, [{"elements": [cached[self.cache_key(origin, destination)] for destination, _ in destinations]}]))
+        return kernels
+
+    def record_kernel(self, kernel: tuple, data_batch) -> list:
+        """
+        Decodes the estimation data of every cell of a fetched kernel at once and memoizes it. 
+        param: kernel [tuple] The kernel as given by `PlannedRequest.kernels()` or `cached_kernels()`
+        param: data_batch [any] The data batch fetched for the kernel; `None` if fetching failed
+        return: 2D tuple of the list of rows to write to the connections file and the list of (origin index, destination index) cells they are of;
+                cells of a failed batch or with malformed data have no rows
+        """
+        sub_origins, sub_destinations, origin_indices, destination_indices = kernel
+        time_min, distance_km, decoded = decode_data_batch(data_batch, len(sub_origins), len(sub_destinations))
+        def parse_gps(location: str):
             """
-            Given row and column lists that can map to a parent cartesian product matrix, a sub matrix specified by start and end points within the parent,
-            `p0` and `p1`, can be indicated such that the sub row and sub column lists used to compute the sub matrix as its own cartesian product can be found. 
-            param: row_ids [list] The specified row names to find the parent matrix
-            param: col_ids [list] The specified col names to find the parent matrix
-            param: p0 [tuple[int,int]] The specified starting element of the sub-matrix
-            param: p1 [tuple[int,int]] The specified end element of the sub-matrix
-            return: The sub lists of row and column ids needed to compute the sub-matrix as a cartesian product 
+            param: location [str] The specified location as a `GPS()` string
+            return: 4D tuple of the latitude and longitude texts and values, or `None` if the location is malformed
             """
-            p0 = (max(0, min(len(col_ids) - 1, p0[0])), max(0, min(len(row_ids) - 1, p0[1])))
-            p1 = (max(0, min(len(col_ids) - 1, p1[0])), max(0, min(len(row_ids) - 1, p1[1])))
-            sub_row_ids, sub_col_ids = row_ids[p0[1]:p1[1] + 1], col_ids[p0[0]:p1[0] + 1]
-            return (sub_col_ids, sub_row_ids)
+            parts = [part.strip() for part in str(location).split(sep=',')]
+            try:
+                return parts[0], parts[1], float(parts[0]), float(parts[1])
+            except (IndexError, ValueError):
+                return None
         
-        with open(file, "a") as conn_file: # open profile/connection file 
-            # sub sample matrix size of the larger cartesian product
-            kernel_dims = (10,10) # largest allowable size for distancematrix api
-            # cartesian product matrix dimensions
-            total_dims = (len(origins), len(destinations))
-            # walk through all possible routes between the given origins and destinations
-            # consider format of this as a matrix; x-axis is the list of origins, y-axis the destinations, and the grid elements as the combinations of the two
-            for y in range(0, total_dims[0], kernel_dims[1]):
-                for x in range(0, total_dims[1], kernel_dims[0]):
-                    # find sub row and col ids from main id lists 
-                    sub_destinations, sub_origins = sub_inv_cartesian_product(row_ids=origins, col_ids=destinations, p0=(x, y), p1=(x + kernel_dims[0] - 1, y + kernel_dims[1] - 1))
-                    # fetch sub data routes with distancematrix api
-                    data_batch = self.fetch_data_batch(sub_origins=sub_origins, sub_destinations=sub_destinations)
-                    print(f"data batch: {data_batch}")
-                    # step through getting cell estimation data and memoize 
-                    for destination_index in range(0, len(sub_destinations)):
-                        for origin_index in range(0, len(sub_origins)):
-                            try:
-                                # find current cell estimation data for distance [km] and time [min]
-                                cell_data = self.get_data_batch_cell(sub_origin=origin_index, sub_destination=destination_index, data_batch=data_batch)
-                                # find index pair of (origin-destination) route; consider base point (x,y) and offset for each cell 
-                                memoized_origin_index = x + origin_index
-                                memoized_destination_index = y + destination_index
-                                # get parsed gps data
-                                origin_gps = sub_origins[origin_index].split(sep=',')
-                                dest_gps = sub_destinations[destination_index].split(sep=',')
-                                origin_lat, origin_lon = origin_gps[0].strip(), origin_gps[1].strip()
-                                dest_lat, dest_lon = dest_gps[0].strip(), dest_gps[1].strip()
-                                # store cell data in file
-                                self.memoized_data.append((cell_data[0], cell_data[1], origin_lat, origin_lon, dest_lat, dest_lon))
-                                conn_file.write(f"{self.connection_id},{self.origin_node_id},{self.destination_node_id},{origin_lat},{origin_lon},{dest_lat},{dest_lon},{memoized_origin_index},{memoized_destination_index},{cell_data[0]},{cell_data[1]}\n")
-                            except:
-                                print("QUERYING: DATA BATCH FAILED\n")
-                                continue
-
-    def read_profile(self, file: str):
+        # parsed gps data of each origin and destination
+        origin_gps, dest_gps = [parse_gps(origin) for origin in sub_origins], [parse_gps(destination) for destination in sub_destinations]
+        lines, cells = [], []
+        for i, j, time_value, distance_value in zip(*np.nonzero(decoded), time_min[decoded].tolist(), distance_km[decoded].tolist()):
+            if origin_gps[i] is None or dest_gps[j] is None:
+                continue # malformed location
+            (origin_lat, origin_lon, origin_lat_value, origin_lon_value), (dest_lat, dest_lon, dest_lat_value, dest_lon_value) = origin_gps[i], dest_gps[j]
+            # find index pair of (origin-destination) route within the nodes' locations
+            memoized_origin_index, memoized_destination_index = origin_indices[i], destination_indices[j]
+            self.memoized_data.append((time_value, distance_value, origin_lat_value, origin_lon_value, dest_lat_value, dest_lon_value))
+            lines.append(f"{self.connection_id},{self.origin_node_id},{self.destination_node_id},{origin_lat},{origin_lon},{dest_lat},{dest_lon},{memoized_origin_index},{memoized_destination_index},{time_value},{distance_value}\n")
+            cells.append((memoized_origin_index, memoized_destination_index))
+        # one block per kernel for the writer
+        return (["".join(lines)] if len(lines) > 0 else []), cells
+
+    def query_cells(self, cells: list, file: str, executor: QueryExecutor=None, planner: RequestPlanner=None):
+        """
+        This computes the estimation data of given origin-destination cells and writes locally. Cells the executor's journal holds as written 
+        are skipped, routes found in the executor's response cache are written straight away, and only the rest are fetched. A route is fetched
+        once however many cells need it (e.g. catchment locations sharing their nearest stop).
+        param: cells [list] The list of 4D tuples of (origin, destination, origin index, destination index) of each cell, where the indices are
+               those of the origin and destination within their nodes' locations
+        param: file [str] The file to write data to
+        param: executor [QueryExecutor] Optional executor to fetch requests concurrently with; requests are only queued on it and are done once it 
+               is joined or closed. If not given, requests are fetched one at a time before returning
+        param: planner [RequestPlanner] Optional planner to add the cells to fetch to, so they can share requests with other profiles; requests are 
+               only planned once it is submitted. Used along with `executor`; otherwise requests are planned for these cells alone and submitted straight away
+        """
+        own_executor = executor is None
+        executor = executor if executor is not None else QueryExecutor(workers=1, rate=None)
+        try:
+            if executor.journal is not None:
+                done = executor.journal.done_cells(self.journal_key())
+                cells = [cell for cell in cells if (cell[2], cell[3]) not in done]
+            cached = {}
+            if executor.cache is not None:
+                cached = executor.cache.get_many([self.cache_key(origin, destination) for origin, destination, _, _ in cells])
+            for kernel, data_batch in self.cached_kernels(cells, cached):
+                lines, written = self.record_kernel(kernel, data_batch)
+                executor.write(file, lines, self.journal_key(), written)
+            misses = [cell for cell in cells if self.cache_key(cell[0], cell[1]) not in cached]
+            if planner is not None and not own_executor:
+                planner.add(self, file, misses)
+            else:
+                own_planner = RequestPlanner()
+                own_planner.add(self, file, misses)
+                own_planner.submit(executor)
+        finally:
+            if own_executor:
+                executor.close()
+
+    def query_profile(self, origins: list, destinations: list, file: str, index_offset: tuple=(0, 0), executor: QueryExecutor=None, planner: RequestPlanner=None):
+        """
+        This computes the estimation data for traveling from every origin to every destination between two nodes and writes locally; see `query_cells()`.
+        param: origins [list] The specified origins to set and get data for
+        param: destinations [list] The specified destinations to set and get data for  
+        param: file [str] The file to write data to
+        param: index_offset [tuple] The (origin, destination) index of the first origin and destination within their nodes' locations
+        param: executor [QueryExecutor] Optional executor to fetch requests concurrently with
+        param: planner [RequestPlanner] Optional planner to add the cells to fetch to
+        """
+        cells = [(origins[i], destinations[j], index_offset[0] + i, index_offset[1] + j) for i in range(0, len(origins)) for j in range(0, len(destinations))]
+        self.query_cells(cells, file=file, executor=executor, planner=planner)
+
+    def read_profile(self, file: str, store: ConnectionStore=None, lazy: bool=False):
         """
         Reads in estimation data for traveling between two nodes given a file to import from locally. 
         param: file [str] The file to import from
+        param: store [ConnectionStore] Optional connection data already read from the file; the file is read if not given
+        param: lazy [bool] Whether to defer loading data until `get()` is first called; rows are then held by the store's bounded cache
         """
-        with open(file, newline='') as conn_file:
-            for record in csv.reader(conn_file):
-                # add record if it is the correct connection
-                if str(record[0].strip()) == self.connection_id:
-                    # connection data
-                    time_min, distance_km = float(decimal(record[9].strip())), float(decimal(record[10].strip()))
-                    orig_lat, orig_lon = float(decimal(record[3].strip())), float(decimal(record[4].strip()))
-                    dest_lat, dest_lon = float(decimal(record[5].strip())), float(decimal(record[6].strip()))
-                    # map connection id to data
-                    self.memoized_data.append((time_min, distance_km, orig_lat, orig_lon, dest_lat, dest_lon))
+        store = store if store is not None else ConnectionStore(file)
+        if lazy:
+            self.store = store
+            return
+        columns = store.get(self.connection_id)
+        # map connection id to data
+        self.memoized_data.extend(zip(columns["time_min"].tolist(), columns["distance_km"].tolist(), columns["orig_lat"].tolist(), 
+                                      columns["orig_lon"].tolist(), columns["dest_lat"].tolist(), columns["dest_lon"].tolist()))
 
-    def get(self):
+    def get(self, origin_index: int=None, dest_index: int=None):
         """
         Gets the time [mins] and distance [km] of all sampled trips between the origin and destination node. 
-        return: A list of the estimated trips' data as a 6D tuples (time [min], distance [km], origin_lat, origin_lon, dest_lat, dest_lon)
+        Data read lazily is loaded from the connection store here. If an origin and destination index are given, only the trip between 
+        them is looked up in the origin-destination matrix; see `od_matrix()`. 
+        param: origin_index [int] Optional row of the origin location in the origin-destination matrix
+        param: dest_index [int] Optional column of the destination location in the origin-destination matrix
+        return: A list of the estimated trips' data as a 6D tuples (time [min], distance [km], origin_lat, origin_lon, dest_lat, dest_lon),
+                or the 2D tuple of (time [min], distance [km]) between the indexed locations (`None` if there is no such trip)
+        """
+        if origin_index is not None and dest_index is not None:
+            return self.od_matrix().get(origin_index, dest_index)
+        if self.store is None:
+            return self.memoized_data
+        rows = self.store.rows(self.connection_id)
+        return rows if len(self.memoized_data) == 0 else rows + self.memoized_data
+
+    def count(self) -> int:
+        """
+        Counts the sampled trips between the origin and destination node without loading lazily read data. 
+        return: The number of trips `get()` gives
+        """
+        return len(self.memoized_data) + (self.store.count(self.connection_id) if self.store is not None else 0)
+
+    def columns(self) -> dict:
+        """
+        Gets the data of all sampled trips as column arrays, without building row tuples for lazily read data. 
+        return: The dictionary of arrays of `time_min`, `distance_km`, `orig_lat`, `orig_lon`, `dest_lat`, and `dest_lon`
         """
-        return self.memoized_data
+        names = ["time_min", "distance_km", "orig_lat", "orig_lon", "dest_lat", "dest_lon"]
+        memoized = np.array(self.memoized_data, dtype=np.float64).reshape(-1, len(names))
+        if self.store is None:
+            return {name: memoized[:, i] for i, name in enumerate(names)}
+        columns = self.store.get(self.connection_id)
+        if len(memoized) == 0:
+            return {name: columns[name] for name in names}
+        return {name: np.concatenate((columns[name], memoized[:, i])) for i, name in enumerate(names)}
+
+    def signature(self, columns: dict=None) -> str:
+        """
+        Digests the data of all sampled trips. Equal data gives an equal signature, so caches keyed by it notice any change of the data, 
+        also edits that keep the number of trips. 
+        param: columns [dict] Optional columns already read by `columns()`, so the data is not read twice
+        return: The hexadecimal digest of the sampled trips' columns
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for column in (self.columns() if columns is None else columns).values():
+            digest.update(np.ascontiguousarray(column, dtype=np.float64).tobytes())
+        return digest.hexdigest()
+
+    def od_matrix(self, dtype=np.float64) -> ODMatrix:
+        """
+        Gets the origin-destination matrices of time [min] and distance [km] of the sampled trips. Matrices are built once and 
+        re-built only when the `signature()` of the trip data changes, so also rows replaced one for one are noticed. 
+        param: dtype [np.dtype] The type of the matrices; `np.float32` halves their memory
+        return: The `ODMatrix`
+        """
+        columns = self.columns()
+        signature = self.signature(columns)
+        key = np.dtype(dtype).str
+        if key not in self.od_matrices or self.od_matrices[key][0] != signature:
+            self.od_matrices[key] = (signature, ODMatrix(columns, dtype=dtype))
+        return self.od_matrices[key][1]
 
     def reset(self):
         """
@@ -413,10 +646,67 @@ class MobilityProfile:
         self.mode = ""
         # reset memoized data
         self.memoized_data.clear()
+        self.store = None
+        self.od_matrices.clear()
         # reset flags
         self.timing_param = False 
         # reset route counters 
         self.origin_count = 0
         self.destination_count = 0
 # short-hand alias
-MProfile = MobilityProfile
\ No newline at end of file
+MProfile = MobilityProfile
+class DepartureSweep:
+    """
+    Represents a transit connection queried over a grid of departure times. Each departure time slot is its own `MobilityProfile` between 
+    the same transit stop nodes, so slots are queried in the same job and their requests are planned together; the walk legs to and from 
+    the stops are shared by every slot and queried once. The sub trips of all slots form a time-indexed `ODTensor`, and sampling draws a 
+    departure slot for each trip from the sweep's weights without any further queries.
+    """
+    def __init__(self, connection_id: str, profiles: list, timings: list, weights: list=None):
+        """
+        Creates a `DepartureSweep` instance.
+        param: connection_id [str] The unique identifier of the transit connection
+        param: profiles [list] The `MobilityProfile` of each departure time slot
+        param: timings [list] The departure time of each slot, formatted by `TIMING()`
+        param: weights [list] Optional chance of departing in each slot; slots are equally likely if not given
+        """
+        self.connection_id = connection_id
+        self.profiles = list(profiles)
+        self.timings = list(timings)
+        self.weights = None
+        self.set_weights(weights)
+        # time-indexed origin-destination tensors; mapped by tensor type, each a 2D tuple of (signatures of the slot data built from, `ODTensor`)
+        self.od_tensors = {}
+
+    def set_weights(self, weights: list=None):
+        """
+        Sets the distribution of departure times that trips are sampled from. 
+        param: weights [list] The chance (or any non-negative weight) of departing in each slot; slots are equally likely if not given
+        """
+        weights = np.ones(len(self.profiles)) if weights is None else np.asarray(weights, dtype=np.float64)
+        if len(weights) != len(self.profiles) or np.any(weights < 0) or weights.sum() <= 0:
+            raise ValueError(f"departure weights of connection {self.connection_id} need one non-negative weight per slot with a positive sum")
+        self.weights = weights / weights.sum()
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def count(self) -> int:
+        """
+        return: The number of sub trips of all slots
+        """
+        return sum(profile.count() for profile in self.profiles)
+
+    def od_tensor(self, dtype=np.float64) -> ODTensor:
+        """
+        Gets the time-indexed origin-destination tensors of time [min] and distance [km] of all slots. Tensors are built once and re-built
+        only when the `signature()` of any slot's trip data changes. 
+        param: dtype [np.dtype] The type of the tensors; `np.float32` halves their memory
+        return: The `ODTensor`
+        """
+        columns = [profile.columns() for profile in self.profiles]
+        signature = tuple(profile.signature(slot_columns) for profile, slot_columns in zip(self.profiles, columns))
+        key = np.dtype(dtype).str
+        if key not in self.od_tensors or self.od_tensors[key][0] != signature:
+            self.od_tensors[key] = (signature, ODTensor(columns, self.timings, dtype=dtype))
+        return self.od_tensors[key][1]
@@ -2,8 +2,12 @@ from internal.gps_sample import *
 from internal.mobility_node import *
 from decimal import Decimal as decimal
 from internal.handler import *
+from internal.trip_engine import *
+from internal.streaming_stats import *
+from internal.parallel_sampler import *
 import os.path
 import random
+import json
 import shapefile 
 from shapely.geometry import Point
 from shapely.geometry import shape
@@ -25,10 +29,22 @@ class MobilityTripSampler:
         """
         # dict of all trip samples collected
         self.sampled_trips = {}
+        # shared location identifiers and compiled connection arrays for sampling
+        self.location_registry = LocationRegistry()
+        # compiled connections are mapped by the signature of their data, least recently used first, and at most `max_compiled` are held
+        self.compiled_connections = OrderedDict()
+        self.max_compiled = MAX_LOADED_CONNECTIONS
+        # dict of exact trip distributions and summary statistics of samples; summaries are mapped by (sample_id, method) to rows of (method, metric, statistic, value)
+        self.exact_distributions = {}
+        self.sample_summaries = {}
         # name of the network
         self.network_name = network_name
         # the file to export samples to
         self.results_data_file = f"./stma_results/{network_name}_results.csv"
+        # the file to export the locations table of sampled trips to
+        self.results_locations_file = f"./stma_results/{network_name}_locations.csv"
+        # the file to export summary statistics of samples to
+        self.results_summary_file = f"./stma_results/{network_name}_summary.csv"
         # base directory for visualizing mobility heatmap data
         self.HEATMAP_DATA_FILE_BASE = f"./heatmap_results/"
         # create data files if needed
@@ -38,14 +54,23 @@ class MobilityTripSampler:
     def WRITE_STMA(self):
         """
         Writes `MobilityTripSampler` results and exports them to a file corresponding to the associated mobility 
-        network. Data is exported to the `stma_results` folder. 
+        network. Data is exported to the `stma_results` folder. Visited locations of each trip are written as location 
+        identifiers into the locations table, which is exported next to the results. Trips across a `DepartureSweep` record their departure 
+        time slot; the column is left empty for other trips. 
         """
         with open(self.results_data_file, "w+") as results_file:
             if len(results_file.read()) == 0:
-                results_file.write("sample_id,time_min,distance_km,location_gps_list\n")
+                results_file.write(f"{TRIPS_HEADER}\n")
             for sample in self.sampled_trips.values():
-                for trip in sample:
-                    results_file.write(f"{trip[0]},{trip[1]},{trip[2]},\"{trip[3]}\"\n")
+                write_trips(results_file, sample.sample_id, sample.time_min, sample.distance_km, sample.location_ids, sample.departure_slots)
+        self.location_registry.write(self.results_locations_file)
+        # summary statistics are only exported when there are any
+        if len(self.sample_summaries) > 0:
+            with open(self.results_summary_file, "w") as summary_file:
+                summary_file.write("sample_id,method,metric,statistic,value\n")
+                for (sample_id, _), summary in self.sample_summaries.items():
+                    for method, metric, statistic, value in summary:
+                        summary_file.write(f"{sample_id},{method},{metric},{statistic},{value}\n")
 
     def READ_STMA(self): 
         """
@@ -54,11 +79,23 @@ class MobilityTripSampler:
         return: The STMA results.
         """
         stma_results = {}
+        registry = None # locations table; only needed by results that record location identifiers 
         with open(self.results_data_file, "r+") as results_file:
             for record in csv.reader(results_file):
                 if str(record[0]) == "sample_id":
+                    # results with location identifiers resolve them through the locations table
+                    if str(record[3]) == "location_ids":
+                        registry = LocationRegistry()
+                        registry.read(self.results_locations_file)
                     continue
                 sample_id, time_min, distance_km = str(record[0]), float(record[1]), float(record[2])
+                if registry is not None:
+                    gps_locations = [registry.gps(int(location_id)) for location_id in str(record[3]).split()]
+                    for i in range(1, len(gps_locations)):
+                        if sample_id not in stma_results.keys():
+                            stma_results[sample_id] = []
+                        stma_results[sample_id].append((time_min, distance_km, *gps_locations[i - 1], *gps_locations[i]))
+                    continue
                 str_gps_locations = str(record[3]).replace('[','').replace(']','').replace('(','').replace(')','').replace(',','').split()
                 gps_locations = []
                 for i in range(0, len(str_gps_locations)):
@@ -93,7 +130,6 @@ class MobilityTripSampler:
         fig = plt.figure()
         ax = fig.add_subplot()
         data_x, data_y, data_z = [], [], []
-        data_tile = []
         
         # step through trips 
         for trip_i in range(0, len(trips)):
@@ -116,7 +152,6 @@ class MobilityTripSampler:
                 data_x.append(lats[i])
                 data_y.append(lons[i])
                 data_z.append(weight)
-                data_tile.append((None, 0, 0))
         
         h, w = 100, 100 # number of tiles for grid heatmap
         lat_res = abs(gps_1[0] - gps_0[0]) / w
@@ -133,24 +168,10 @@ class MobilityTripSampler:
         else:
             return
 
-        n = min(min(min(len(data_x), len(data_y)), len(data_z)), len(data_tile))
-        # step through map
-        for y in range(0, len(map)):
-            for x in range(0, len(map[y])):
-                # get tile gps coords
-                tile_lat, tile_lon = map[y][x][0], map[y][x][1]
-                # update list of data to be put on tiles, `data_tiles`, to update that datas' closest tile 
-                # we want to update the tile that is closest to each raw coordinate interpolated from the section above
-                # we upate as we go through the map and look at new tiles until the whole map has been looked at
-                for i in range(0, n):
-                    # get current raw data point gps coords 
-                    lat_i, lon_i = data_x[i], data_y[i]
-                    # determine distance to current tile 
-                    distance_i = pow(pow(lat_i - tile_lat, 2.0) + pow(lon_i - tile_lon, 2.0), 0.5)
-                    # update this data point's closest tile (indices) if this is the closest so far
-                    if data_tile[i][0] is None or distance_i < data_tile[i][0]:
-                        # update the closest tile and the distance found
-                        data_tile[i] = (distance_i, x, y)
+        n = min(min(len(data_x), len(data_y)), len(data_z))
+        # find the closest tile to each raw coordinate interpolated from the section above;
+        # tiles lie on a regular grid so the closest one is found by rounding to it (runs on the selected kernel backend)
+        tile_x, tile_y = kernels.assign_tiles(data_x[:n], data_y[:n], gps_0, lat_res, lon_res, w, h)
 
         # data to plot and export # 2D matrix of (lat, lon, avg weight, and weight count) per element
         plot_data_x = [] # list of lat
@@ -163,8 +184,8 @@ class MobilityTripSampler:
             cph_polygon_data = [shape(feature["geometry"]) for feature in land_shapes]
 
         for i in range(0, n):
-            x = data_tile[i][1]
-            y = data_tile[i][2]
+            x = int(tile_x[i])
+            y = int(tile_y[i])
             weight = data_z[i] 
             # aggregate onto map by averaging
             if aggregate_type == "mean":
@@ -211,14 +232,53 @@ class MobilityTripSampler:
                 results_file.write(f"{plot_data_x[i]},{plot_data_y[i]},{plot_data_z[i]}\n")
 
 
-    def sample_trip(self, sample_id: str, n: int, connections: list):
+    def compile_connection(self, connection: MobilityProfile) -> CompiledConnection:
+        """
+        Compiles a connection's sub trips into NumPy arrays with an origin location index. Compiled connections are cached by the 
+        signature of their data, so they are re-compiled whenever the data changes, and only the `max_compiled` most recently used are held. 
+        param: connection [MProfile] The specified connection
+        return: The `CompiledConnection` of the connection
+        """
+        if isinstance(connection, DepartureSweep):
+            raise ValueError(f"connection {connection.connection_id} is a departure time sweep; compile it with `compile_slots()` or pass one of its slot profiles")
+        signature = connection.signature()
+        cached = self.compiled_connections.get(signature)
+        if cached is not None:
+            self.compiled_connections.move_to_end(signature)
+            return cached
+        compiled = compile_connection(connection.get(), self.location_registry)
+        self.compiled_connections[signature] = compiled
+        # evict the least recently used compiled connections
+        while len(self.compiled_connections) > max(1, self.max_compiled):
+            self.compiled_connections.popitem(last=False)
+        return compiled
+
+    def compile_slots(self, connections: list):
+        """
+        Compiles a chain of connections once for each departure time slot of the departure time sweeps in it; each slot's chain uses the slot's 
+        transit profile in place of every sweep. A chain without sweeps is compiled once. 
+        param: connections [list] The list of `MProfile` connections, of which any may be a `DepartureSweep`
+        return: 2D tuple of the list of `CompiledConnection` chains of each slot and the chance of departing in each slot (`None` without sweeps)
+        """
+        sweeps = [conn for conn in connections if isinstance(conn, DepartureSweep)]
+        if len(sweeps) == 0:
+            return [[self.compile_connection(conn) for conn in connections]], None
+        # a trip departs once, so every sweep of the chain must cover the same departure time slots
+        if any(len(sweep) != len(sweeps[0]) for sweep in sweeps):
+            raise ValueError("departure time sweeps of a connection chain need the same number of departure slots")
+        slot_chains = [[self.compile_connection(conn.profiles[slot] if isinstance(conn, DepartureSweep) else conn) for conn in connections] 
+                       for slot in range(0, len(sweeps[0]))]
+        return slot_chains, sweeps[0].weights
+
+    def sample_trip(self, sample_id: str, n: int, connections: list, seed: int=None):
         """
         Samples a number of trips that sequentially travel across the list of connections given. Results are saved 
         and can be written to a file by calling `WRITE()`
         param: sample_id [str] The unique identifier for this sample
         param: n [int] The number of trips to sample 
-        param: connections [list] The list of `MProfile` connections to estimate trips from
-        return: The sample data as a list of 2D tuples of (time_min, distance_km) of each trip
+        param: connections [list] The list of `MProfile` connections to estimate trips from; a `DepartureSweep` draws each trip's departure time from its weights
+        param: seed [int] Optional seed for the random number generator to make the sample reproducible
+        return: The sample data as `SampledTrips`; indexing it gives 4D tuples of (sample_id, time_min, distance_km, list of visited gps locations)
         """
         
         # ~~~ CONCEPT EXPLANATION (How to think of possible paths to sample) ~~~ 
@@ -235,61 +295,215 @@ class MobilityTripSampler:
         # (3) for each trip: select a random  location for each level that have a direct connection to the last node/location selected in the previous level; this creates a connected path from 
         #     the root to a leaf location in a tree.
         # ~~~ HOW TO DO BELOW (How to implement the algorithm) ~~~
-        # (1) each connection's list of sub trips represent all allowed connections between a starting and next tree location => randomly choose a sub trip from the first connection
-        # (2) put each initial sub trip of the first connection (from the function arg `connections: list`) in a running list of overall trips in order. 
-        # (3) loop through remaining connections of arg `connections: list` for finding a random sub trip from each one to add to sum in each overall trip in that list. Sub trips to sample from are
-        #     rooted at the location of the previous layer so that an overall connected path from the root location to a leaf location in the tree can be found and summed across its set of sub trips.   
+        # (1) each connection's list of sub trips is compiled once into arrays sorted by origin location, with an index from each origin location to its block of sub trips
+        # (2) draw a sub trip for all (n) trips of the first connection at once; any sub trip of the first connection can start a trip
+        # (3) for each remaining connection, look up the block of sub trips rooted at every trip's previous location and draw one sub trip uniformly from each block at once.
+        #     time, distance, and visited locations are summed and recorded as arrays so that a connected path from the root location to a leaf location in the tree is found for every trip.
+        
+        # (4) with departure time sweeps, draw the departure slot of every trip once from the sweep's weights; each slot is its own chain of 
+        #     compiled connections that uses the slot's transit profile, and the trips of a slot are drawn together from that chain.
         
         # ~~~ Implementation below ~~~
+        rng = np.random.default_rng(seed)
+        slot_chains, slot_weights = self.compile_slots(connections)
+        time_min, distance_km, location_ids, departure_slots = sample_departures(slot_chains, slot_weights, n, rng)
         
-        # sampled list of overall trips; each data pair (min, km) represents the total time and distance for one trip
-        # a trip is recorded as: sample_id, time_min, distance_km, and a list of visited locations
-        trip_data = [("",0,0,list()) for i in range(0, n)]
-        prev_gps_points = [(None,None) for i in range(0, n)]
-    
-        # loop through all connections; going from the first to the next until done 
-        for conn_index in range(0, len(connections)):
-            conn = connections[conn_index]
-            # local trips for over just this connection
-            all_sub_trips = conn.get()
+        # sampled overall trips; a trip is recorded as: sample_id, time_min, distance_km, and its visited location identifiers
+        trip_data = SampledTrips(sample_id, time_min, distance_km, location_ids, self.location_registry, departure_slots)
+        # store and return results 
+        self.sampled_trips[sample_id] = trip_data
+        return trip_data
 
-            # loop through all trips being estimated; continue "building" each trip at each connection 
-            # along the list of given connections 
-            for i in range(0, n):
-                # local sub trips for this connection, for the i-th overall trip
-                # overall trips are formed by growing all (n) of them, one sub trips each at a time, while stepping through each connection (conn_index)
-                sub_trips = [] # tailor filter to find all sub trips directly connected to where the growing i-th overall trip left of in the previous connection (conn_index)
-                # filter sub trips that are not from the first connections  
-                if conn_index > 0: 
-                    for sub_trip in all_sub_trips:
-                        prev_sub_trip_location_lat, prev_sub_trip_location_lon = prev_gps_points[i][0], prev_gps_points[i][1]
-                        if sub_trip[2] == prev_sub_trip_location_lat and sub_trip[3] == prev_sub_trip_location_lon:
-                            sub_trips.append(sub_trip)
-                else:
-                    # do not filter the first connection
-                    sub_trips = all_sub_trips
+    def sample_trip_chunks(self, sample_id: str, n: int, connections: list, chunk_size: int=100000, seed: int=0, start_chunk: int=0, workers: int=1):
+        """
+        Samples trips as a stream of fixed-size chunks so that only one chunk is held in memory at a time. Each chunk is drawn from its 
+        own random stream derived from the seed, so the chunks of a sample are the same whether it is drawn in one go or resumed part way. 
+        param: sample_id [str] The unique identifier for this sample
+        param: n [int] The number of trips to sample 
+        param: connections [list] The list of `MProfile` connections to estimate trips from; a `DepartureSweep` draws each trip's departure time from its weights
+        param: chunk_size [int] The number of trips per chunk
+        param: seed [int] The seed of the sample's random streams
+        param: start_chunk [int] The index of the first chunk to draw; earlier chunks are skipped
+        param: workers [int] The number of worker processes to shard chunks across; chunks are identical for any number of workers
+        return: A generator of 5D tuples of (chunk index, time [min], distance [km], visited location identifiers, departure slots) arrays per chunk; 
+                departure slots are `None` without departure time sweeps
+        """
+        slot_chains, slot_weights = self.compile_slots(connections)
+        if workers is None or workers > 1:
+            yield from parallel_chunks(slot_chains, slot_weights, n, chunk_size, seed, start_chunk, workers)
+            return
+        for chunk_index in range(start_chunk, (n + chunk_size - 1) // chunk_size):
+            chunk_n = min(chunk_size, n - chunk_index * chunk_size)
+            time_min, distance_km, location_ids, departure_slots = sample_departures(slot_chains, slot_weights, chunk_n, chunk_rng(seed, chunk_index))
+            yield chunk_index, time_min, distance_km, location_ids, departure_slots
 
-                # randomly choose from filtered set of sub trips 
-                sub_trip_index = max(0, int(len(sub_trips) * random.random() - 1))
-                sub_trip = sub_trips[sub_trip_index] # time (min), distance (km)
-                # add time and distance for sub trip
-                time_min_sum = trip_data[i][1] + sub_trip[0]
-                distance_km_sum = trip_data[i][2] + sub_trip[1]
-                # next "destination" node gps for this current connection sub trip
-                dest_lat, dest_lon = sub_trip[4], sub_trip[5]
-                orig_lat, orig_lon = sub_trip[2], sub_trip[3]
-                # update time, distance, and locations list data
-                trip_locations = trip_data[i][3]
-                # append origin for first node on first connection; assume this if list is empty
-                if len(trip_locations) == 0: 
-                    trip_locations.append((orig_lat, orig_lon))
-                # append all destinations proceeding after the first node origin location was added once
-                trip_locations.append((dest_lat, dest_lon))
-                trip_data[i] = (sample_id, time_min_sum, distance_km_sum, trip_locations)
-                # update previous gps points for each trip
-                prev_gps_points[i] = (dest_lat, dest_lon)
+    def sample_trip_parallel(self, sample_id: str, n: int, connections: list, seed: int=0, workers: int=None, chunk_size: int=10000):
+        """
+        Samples a number of trips like `sample_trip()`, sharded in chunks across a pool of worker processes. The compiled connections are placed 
+        once in shared memory and every chunk draws from its own seed-derived random stream, so the trips are identical for a given seed 
+        and chunk size no matter how many workers are used. 
+        param: sample_id [str] The unique identifier for this sample
+        param: n [int] The number of trips to sample 
+        param: connections [list] The list of `MProfile` connections to estimate trips from; a `DepartureSweep` draws each trip's departure time from its weights
+        param: seed [int] The seed of the sample's random streams
+        param: workers [int] The number of worker processes; defaults to the number of CPUs
+        param: chunk_size [int] The number of trips per chunk
+        return: The sample data as `SampledTrips`
+        """
+        parts = [chunk[1:] for chunk in self.sample_trip_chunks(sample_id, n, connections, chunk_size, seed, workers=workers)]
+        trip_data = SampledTrips.concatenate(sample_id, parts, self.location_registry, len(connections))
         # store and return results 
         self.sampled_trips[sample_id] = trip_data
         return trip_data
+
+    def sample_trip_to_file(self, sample_id: str, n: int, connections: list, chunk_size: int=100000, seed: int=None, workers: int=1):
+        """
+        Samples a large number of trips straight to disk in fixed-size chunks with bounded memory; trips are not kept in the sampler. 
+        Trips are written to `stma_results/<network>_<sample_id>_trips.csv` in the format of `WRITE_STMA()`, with their own locations table 
+        next to the file. A manifest next to the file records each flushed chunk, so calling this again with the same arguments resumes an 
+        interrupted run from the last flushed chunk. 
+        param: sample_id [str] The unique identifier for this sample
+        param: n [int] The number of trips to sample 
+        param: connections [list] The list of `MProfile` connections to estimate trips from; a `DepartureSweep` draws each trip's departure time from its weights
+        param: chunk_size [int] The number of trips per chunk
+        param: seed [int] Optional seed of the sample; a seed is chosen and recorded in the manifest if not given
+        param: workers [int] The number of worker processes to sample chunks with
+        return: The file the trips were written to
+        """
+        trips_file = f"./stma_results/{self.network_name}_{sample_id}_trips.csv"
+        manifest_file = f"{trips_file}.manifest.json"
+        locations_file = f"{trips_file}.locations.csv"
+        # the run being started; resuming requires the same sample definition and file format
+        run = {"sample_id": sample_id, "n": n, "chunk_size": chunk_size, "connections": [conn.connection_id for conn in connections], "seed": seed, 
+               "header": TRIPS_HEADER}
+        manifest = None
+        if os.path.exists(manifest_file) and os.path.exists(trips_file) and os.path.exists(locations_file):
+            with open(manifest_file, "r") as file:
+                manifest = json.load(file)
+            # an unseeded run resumes with the seed recorded for it
+            if run["seed"] is None:
+                run["seed"] = manifest["seed"]
+            if any(manifest.get(key) != value for key, value in run.items()):
+                manifest = None # different sample definition; start over
+        if manifest is None:
+            run["seed"] = run["seed"] if run["seed"] is not None else int(np.random.SeedSequence().entropy % (2 ** 63))
+            manifest = dict(run, chunks_flushed=0, bytes_flushed=0)
+
+        # the file keeps its own locations table; identifiers of a resumed run are translated into the identifiers already written
+        file_registry = LocationRegistry()
+        if manifest["chunks_flushed"] > 0:
+            file_registry.read(locations_file)
+        self.compile_slots(connections)
+        file_location_ids = file_registry.register_all([lat for lat, _ in self.location_registry.locations], [lon for _, lon in self.location_registry.locations])
+        file_registry.write(locations_file)
+
+        with open(trips_file, "a+") as file:
+            # drop anything written after the last flushed chunk
+            file.truncate(manifest["bytes_flushed"])
+            if manifest["bytes_flushed"] == 0:
+                file.write(f"{TRIPS_HEADER}\n")
+            for chunk_index, time_min, distance_km, location_ids, departure_slots in self.sample_trip_chunks(sample_id, n, connections, chunk_size, manifest["seed"], manifest["chunks_flushed"], workers):
+                write_trips(file, sample_id, time_min, distance_km, file_location_ids[location_ids], departure_slots)
+                file.flush()
+                os.fsync(file.fileno())
+                # record the flushed chunk; the manifest is replaced in one step so it is never left half written
+                manifest["chunks_flushed"], manifest["bytes_flushed"] = chunk_index + 1, file.tell()
+                with open(f"{manifest_file}.tmp", "w") as tmp_file:
+                    json.dump(manifest, tmp_file)
+                os.replace(f"{manifest_file}.tmp", manifest_file)
+        return trips_file
+
+    def sample_trip_adaptive(self, sample_id: str, connections: list, tolerance: float=0.01, statistics: tuple=("mean",), confidence: float=0.95, 
+                             batch_size: int=500, max_n: int=100000, resolution: float=0.01, seed: int=None):
+        """
+        Samples trips in batches until the confidence intervals of the chosen statistics of trip time and distance are narrow enough, instead 
+        of sampling a fixed number of trips. Statistics are kept as streaming estimates and the stopping point and achieved confidence intervals 
+        are recorded with the sample's summary, which is written by calling `WRITE_STMA()`. 
+        param: sample_id [str] The unique identifier for this sample
+        param: connections [list] The list of `MProfile` connections to estimate trips from; a `DepartureSweep` draws each trip's departure time from its weights
+        param: tolerance [float] The largest allowed confidence interval half-width relative to each statistic's estimate; a quantile's half-width
+                                 is at least half the spacing of the values (e.g. 0.5 [min] for times in whole minutes), so a tighter tolerance runs to `max_n`
+        param: statistics [tuple] The statistics to converge; `mean` and/or quantiles written as `q` and its value (e.g. `q0.5`)
+        param: confidence [float] The confidence level of the intervals
+        param: batch_size [int] The number of trips sampled between convergence checks
+        param: max_n [int] The most trips to sample if the statistics have not converged
+        param: resolution [float] The resolution of the quantile estimates in [min] and [km]
+        param: seed [int] Optional seed for the random number generator to make the sample reproducible
+        return: The sample data as `SampledTrips`
+        """
+        slot_chains, slot_weights = self.compile_slots(connections)
+        rng = np.random.default_rng(seed)
+        metrics = {"time_min": StreamingStatistics(resolution), "distance_km": StreamingStatistics(resolution)}
+        parts, sampled_n = [], 0
+        converged = False
+        while not converged and sampled_n < max_n:
+            # sample and record the next batch of trips
+            time_min, distance_km, location_ids, departure_slots = sample_departures(slot_chains, slot_weights, min(batch_size, max_n - sampled_n), rng)
+            parts.append((time_min, distance_km, location_ids, departure_slots))
+            sampled_n += len(time_min)
+            metrics["time_min"].update(time_min)
+            metrics["distance_km"].update(distance_km)
+            # converged once every confidence interval is within the tolerance of its estimate
+            converged = all(stats.confidence_interval(statistic, confidence) <= tolerance * abs(stats.estimate(statistic)) for stats in metrics.values() for statistic in statistics)
+
+        # record the stopping point and achieved confidence intervals
+        summary = [("adaptive", "all", "n_trips", sampled_n), ("adaptive", "all", "converged", converged), 
+                   ("adaptive", "all", "confidence", confidence), ("adaptive", "all", "tolerance", tolerance)]
+        for metric, stats in metrics.items():
+            summary += [("adaptive", metric, "std", stats.variance() ** 0.5)]
+            for statistic in statistics:
+                summary += [("adaptive", metric, statistic, stats.estimate(statistic)), ("adaptive", metric, f"{statistic}_ci", stats.confidence_interval(statistic, confidence))]
+        # store and return results 
+        trip_data = SampledTrips.concatenate(sample_id, parts, self.location_registry, len(connections))
+        self.sampled_trips[sample_id] = trip_data
+        self.sample_summaries[(sample_id, "adaptive")] = summary
+        return trip_data
+
+    def exact_distribution(self, sample_id: str, connections: list, bin_width=(1.0, 0.1), quantiles: tuple=(0.05, 0.25, 0.5, 0.75, 0.95)):
+        """
+        Computes the exact distribution of trip time and distance across the list of connections given, instead of sampling trips. 
+        Each sub trip is a uniform choice among the sub trips leaving the previous location, so the distribution of summed time and 
+        distance is found exactly by carrying probability across locations and convolving histograms. Results are saved and their 
+        summary statistics can be written to a file by calling `WRITE_STMA()`. Across a `DepartureSweep`, the distribution is the mixture of the 
+        distributions of its departure slots by the sweep's weights. 
+        param: sample_id [str] The unique identifier for this distribution
+        param: connections [list] The list of `MProfile` connections to estimate trips from
+        param: bin_width [float] The histogram bin width for both metrics, or a 2D tuple of bin widths for time [min] and distance [km]
+        param: quantiles [tuple] The quantiles to compute from each distribution
+        return: A dictionary of `time_min` and `distance_km` distributions; each has its `values`, `pmf`, `mean`, `variance`, `std`, and `quantiles`
+        """
+        slot_chains, slot_weights = self.compile_slots(connections)
+        distribution, summary = self.summarize_distribution(slot_chains, slot_weights, bin_width, quantiles, method="exact")
+        # store and return results
+        self.exact_distributions[sample_id] = distribution
+        self.sample_summaries[(sample_id, "exact")] = summary
+        return distribution
+
+    def summarize_distribution(self, slot_chains: list, slot_weights: np.ndarray, bin_width, quantiles: tuple, method: str):
+        """
+        Computes the exact distribution of trip time and distance across the chains of compiled connections of departure slots along with its summary statistics. 
+        param: slot_chains [list] The list of `CompiledConnection` chains of each departure slot, in travel order; one chain without departure slots
+        param: slot_weights [np.ndarray] The chance of departing in each slot, or `None` for a single chain without departure slots
+        param: bin_width [float] The histogram bin width for both metrics, or a 2D tuple of bin widths for time [min] and distance [km]
+        param: quantiles [tuple] The quantiles to compute from each distribution
+        param: method [str] The method name recorded with the summary statistics
+        return: 2D tuple of the distribution dictionary and its summary rows of (method, metric, statistic, value)
+        """
+        bin_widths = tuple(bin_width) if isinstance(bin_width, (tuple, list)) else (bin_width, bin_width)
+        completed_mass, results = slot_distribution(slot_chains, slot_weights, bin_widths, len(self.location_registry))
+
+        distribution = {"completed_mass": completed_mass}
+        summary = [(method, "all", "completed_mass", completed_mass)]
+        for metric, bin_size, (pmf, mean, variance) in zip(["time_min", "distance_km"], bin_widths, results):
+            values = np.arange(len(pmf)) * bin_size
+            # the smallest binned value at which the cumulative probability reaches each quantile
+            cdf = np.cumsum(pmf)
+            metric_quantiles = {q: float(values[min(len(values) - 1, np.searchsorted(cdf, q - 1e-12))]) for q in quantiles}
+            distribution[metric] = {"values": values, "pmf": pmf, "mean": mean, "variance": variance, "std": variance ** 0.5, "quantiles": metric_quantiles}
+            # record summary statistics for exporting
+            summary += [(method, metric, "bin_width", bin_size), (method, metric, "mean", mean), (method, metric, "variance", variance), (method, metric, "std", variance ** 0.5)]
+            summary += [(method, metric, f"q{q}", value) for q, value in metric_quantiles.items()]
+        return distribution, summary
+
 # short-hand alias 
 MTSample = MobilityTripSampler
\ No newline at end of file
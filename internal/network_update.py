@@ -0,0 +1,245 @@
+from internal.query_journal import *
+from collections import defaultdict
+import csv
+import os
+import re
+
+# node identifiers with a numeric suffix; transit stop nodes were stored as `<conn_id>_<transit>_<depart|arrival>_<NN>` with a random suffix
+LEGACY_NODE_ID = re.compile(r"^(?P<node_id>.+)_\d+$")
+
+class NetworkUpdate:
+    """
+    Represents the difference between the locations a network's nodes have now and the locations stored by an earlier query, along with
+    the update of the stored data files to match. Sub trip rows are matched to the cells still needed by their connection and route (origin
+    and destination location), not by their index or node identifiers, so rows of routes that are still needed are kept and re-indexed to
+    the current order of locations, rows of routes that are no longer needed are dropped as stale, and only cells of new routes are left to
+    query. Locations of nodes that are no longer part of the network are dropped. Kept nodes and cells are journaled as written, so a
+    resumed `QUERY()` fetches only the new cells.
+    """
+    def __init__(self, node_file: str, connection_file: str):
+        """
+        Creates a `NetworkUpdate` instance by reading the stored data files of a network.
+        param: node_file [str] The specified nodes file
+        param: connection_file [str] The specified connections file
+        """
+        self.node_file = node_file
+        self.connection_file = connection_file
+        self.node_header, self.node_records = self.read(node_file)
+        self.connection_header, self.connection_records = self.read(connection_file)
+        self.stored_nodes = defaultdict(list) # mapping of node identifiers to their stored (lat, lon) locations in file order
+        for record in self.node_records:
+            location = self.location(record[1], record[2])
+            if location is not None:
+                self.stored_nodes[record[0]].append(location)
+        # mapping of connection identifiers to mappings of routes (origin lat, origin lon, destination lat, destination lon) to the first
+        # stored record of the route
+        self.stored_rows = defaultdict(dict)
+        for position, record in enumerate(self.connection_records):
+            origin, destination = self.location(record[3], record[4]), self.location(record[5], record[6])
+            if origin is not None and destination is not None:
+                self.stored_rows[record[0]].setdefault(origin + destination, position)
+        self.current_nodes = set() # identifiers of the nodes of the network
+        self.replaced_nodes = {} # mapping of identifiers of nodes whose locations changed to their new records
+        self.written_nodes = [] # identifiers of nodes whose locations are in the nodes file once updated
+        self.updated_connections = set() # identifiers of connections whose rows are rewritten
+        self.used_rows = defaultdict(set) # mapping of connection identifiers to the routes of kept rows
+        self.kept = [] # 3D tuples of (record re-indexed, profile key, (origin index, destination index) cell) of kept rows
+        self.nodes = {} # mapping of node identifiers to dictionaries of location counts
+        self.connections = {} # mapping of connection identifiers to dictionaries of cell counts
+        self.transit_stops = {} # mapping of transit node identifiers to dictionaries of stop counts
+        self.orphaned_nodes = {} # mapping of identifiers of stored nodes that are not part of the network to their number of records
+
+    @staticmethod
+    def read(file: str) -> tuple:
+        """
+        Reads a data file as text records, leaving out records cut off by an interrupted write.
+        param: file [str] The specified data file
+        return: 2D tuple of the header record and the list of records
+        """
+        with open(file, newline='') as data_file:
+            records = [record for record in csv.reader(data_file) if len(record) > 0]
+        if len(records) == 0:
+            return [], []
+        return records[0], [record for record in records[1:] if len(record) == len(records[0])]
+
+    @staticmethod
+    def location(lat: str, lon: str):
+        """
+        param: lat [str] The specified latitude text
+        param: lon [str] The specified longitude text
+        return: 2D tuple of (lat, lon), or `None` if the text is malformed
+        """
+        try:
+            return (float(lat), float(lon))
+        except ValueError:
+            return None
+
+    def diff_node(self, node_id: str, records: list) -> bool:
+        """
+        Compares the current locations of a node with its stored locations.
+        param: node_id [str] The specified node identifier
+        param: records [list] The current (lat, lon, municipality, region, type) of each location; `None` if the node is still to be sampled
+        return: Whether the node's locations changed
+        """
+        self.current_nodes.add(node_id)
+        if records is None:
+            return False
+        current, stored = [(float(record[0]), float(record[1])) for record in records], self.stored_nodes.get(node_id, [])
+        self.nodes[node_id] = {"locations": len(current), "added": len(set(current) - set(stored)), "removed": len(set(stored) - set(current))}
+        self.written_nodes.append(node_id)
+        if current == stored:
+            return False
+        self.replaced_nodes[node_id] = [[node_id] + [str(value) for value in record] for record in records]
+        return True
+
+    def transit_node(self, node_id: str, catchment_id: str, catchment: list, stop_records) -> list:
+        """
+        Finds the current stops of a transit node, whose i-th stop is the nearest stop to the i-th location of its catchment node. The stored
+        stop of each catchment location that was stored before is kept, so the update does not re-query routes of stops that a different
+        nearest-stop lookup would pick; only new catchment locations get their nearest stop looked up.
+        param: node_id [str] The specified transit node identifier
+        param: catchment_id [str] The identifier of the transit node's catchment node
+        param: catchment [list] The current (lat, lon, municipality, region, type) of each location of the catchment node
+        param: stop_records [function] Looks up the nearest stops of a list of (lat, lon); returns a list of (lat, lon, municipality, region, type)
+        return: The list of (lat, lon, municipality, region, type) of the stop of each catchment location
+        """
+        stored_catchment = self.stored_nodes.get(catchment_id, [])
+        stored_stops = [tuple(record[1:6]) for record in self.node_records if record[0] == node_id]
+        # stored stops line up with the stored catchment locations only if both were written by the same query
+        kept = dict(zip(stored_catchment, stored_stops)) if len(stored_catchment) == len(stored_stops) else {}
+        gps_list = [(float(record[0]), float(record[1])) for record in catchment]
+        missing = [gps for gps in gps_list if gps not in kept]
+        found = iter(stop_records(missing) if len(missing) > 0 else [])
+        self.transit_stops[node_id] = {"kept": len(gps_list) - len(missing), "looked_up": len(missing), "stored": len(stored_stops)}
+        return [kept[gps] if gps in kept else tuple(next(found)) for gps in gps_list]
+
+    def keep_cells(self, profile, cells: list):
+        """
+        Keeps the stored rows of a profile's cells whose routes were queried before, re-indexed to the cells' indices; other cells are new.
+        param: profile [MProfile] The profile the cells belong to
+        param: cells [list] The list of 4D tuples of (origin, destination, origin index, destination index) of each cell, with origins and destinations as (lat, lon)
+        """
+        stored = self.stored_rows.get(profile.connection_id, {})
+        counts = self.connections.setdefault(profile.connection_id, {"cells": 0, "kept": 0, "new": 0, "stale": 0})
+        self.updated_connections.add(profile.connection_id)
+        for origin, destination, origin_index, destination_index in cells:
+            route = tuple(origin) + tuple(destination)
+            counts["cells"] += 1
+            if route not in stored:
+                counts["new"] += 1
+                continue
+            record = list(self.connection_records[stored[route]])
+            record[1], record[2] = str(profile.origin_node_id), str(profile.destination_node_id)
+            record[7], record[8] = str(origin_index), str(destination_index)
+            self.kept.append((record, profile.journal_key(), (origin_index, destination_index)))
+            self.used_rows[profile.connection_id].add(route)
+            counts["kept"] += 1
+
+    @staticmethod
+    def write(file: str, header: list, records: list):
+        """
+        Writes a data file through a temporary file that is then moved into place, so an interrupted write leaves the file as it was.
+        param: file [str] The specified data file
+        param: header [list] The header record
+        param: records [list] The records
+        """
+        temp_file = f"{file}.{os.getpid()}.tmp"
+        with open(temp_file, "w", newline='') as data_file:
+            writer = csv.writer(data_file, lineterminator="\n")
+            writer.writerow(header)
+            writer.writerows(records)
+        os.replace(temp_file, file)
+
+    def apply(self, journal_file: str):
+        """
+        Rewrites the data files to the current locations and starts a new query journal that holds the kept nodes and cells as written.
+        Records of connections that are not part of the update are kept as they are; records of nodes that are not part of the network
+        are dropped.
+        param: journal_file [str] The query journal file of the network
+        """
+        for conn_id in self.updated_connections:
+            self.connections[conn_id]["stale"] = len(set(self.stored_rows.get(conn_id, {}).keys()) - self.used_rows[conn_id])
+        for record in self.node_records:
+            if record[0] not in self.current_nodes:
+                self.orphaned_nodes[record[0]] = self.orphaned_nodes.get(record[0], 0) + 1
+        node_records = [record for record in self.node_records if record[0] in self.current_nodes and record[0] not in self.replaced_nodes]
+        node_records.extend(record for records in self.replaced_nodes.values() for record in records)
+        connection_records = [record for record in self.connection_records if record[0] not in self.updated_connections]
+        connection_records.extend(record for record, _, _ in self.kept)
+        self.write(self.node_file, self.node_header, node_records)
+        self.write(self.connection_file, self.connection_header, connection_records)
+        journal = QueryJournal(journal_file, resume=False)
+        try:
+            for node_id in self.written_nodes:
+                journal.record_node(node_id, self.node_file)
+            cells = defaultdict(list) # mapping of profile keys to their kept cells
+            for _, profile_key, cell in self.kept:
+                cells[profile_key].append(cell)
+            size = os.path.getsize(self.connection_file)
+            for profile_key, kept_cells in cells.items():
+                journal.record_cells(profile_key, kept_cells, self.connection_file, size)
+        finally:
+            journal.close()
+
+    def report(self) -> dict:
+        """
+        return: The dictionary of the location counts (locations, added, removed) of each node, the cell counts (cells, kept, new, stale)
+                of each connection, the stop counts (kept, looked up, stored) of each transit node, and the number of records of each dropped
+                node, with the total number of new cells to query and of stops looked up
+        """
+        return {"nodes": self.nodes, "connections": self.connections, "transit_stops": self.transit_stops, 
+                "orphaned_nodes": self.orphaned_nodes, "new_cells": sum(counts["new"] for counts in self.connections.values()),
+                "looked_up_stops": sum(counts["looked_up"] for counts in self.transit_stops.values())}
+
+def legacy_node_ids(node_file: str, connection_file: str, node_ids: list) -> dict:
+    """
+    Finds the nodes stored under a legacy identifier, being the current identifier with a numeric suffix, without changing the data files. 
+    If a node was stored under several suffixes, the one with the most connection rows (then locations, then the last written) is chosen. 
+    Nodes already stored under their current identifier have no legacy identifier.
+    param: node_file [str] The specified nodes file
+    param: connection_file [str] The specified connections file
+    param: node_ids [list] The current identifiers of the nodes of the network
+    return: The mapping of legacy identifiers to current identifiers
+    """
+    current = set(node_ids)
+    if not os.path.exists(node_file):
+        return {}
+    _, node_records = NetworkUpdate.read(node_file)
+    stored = set(record[0] for record in node_records)
+    candidates = defaultdict(dict) # mapping of current identifiers to mappings of their legacy identifiers to [rows, locations, last position]
+    for position, record in enumerate(node_records):
+        match = LEGACY_NODE_ID.match(record[0])
+        if record[0] not in current and match is not None and match.group("node_id") in current and match.group("node_id") not in stored:
+            counts = candidates[match.group("node_id")].setdefault(record[0], [0, 0, 0])
+            counts[1], counts[2] = counts[1] + 1, position
+    if len(candidates) == 0:
+        return {}
+    legacy_counts = {legacy: counts for legacies in candidates.values() for legacy, counts in legacies.items()}
+    if os.path.exists(connection_file):
+        for record in NetworkUpdate.read(connection_file)[1]:
+            for node_id in set(record[1:3]):
+                if node_id in legacy_counts:
+                    legacy_counts[node_id][0] += 1
+    return {max(legacies, key=legacies.get): node_id for node_id, legacies in candidates.items()}
+
+def migrate_node_ids(node_file: str, connection_file: str, node_ids: list) -> dict:
+    """
+    Renames nodes stored under a legacy identifier (see `legacy_node_ids()`) to their current identifier in the data files, so their stored 
+    locations and rows are resumed and updated. Other legacy identifiers of a node are left as they are. 
+    param: node_file [str] The specified nodes file
+    param: connection_file [str] The specified connections file
+    param: node_ids [list] The current identifiers of the nodes of the network
+    return: The mapping of renamed legacy identifiers to current identifiers
+    """
+    renames = legacy_node_ids(node_file, connection_file, node_ids)
+    if len(renames) == 0:
+        return {}
+    node_header, node_records = NetworkUpdate.read(node_file)
+    connection_header, connection_records = NetworkUpdate.read(connection_file)
+    for record in node_records:
+        record[0] = renames.get(record[0], record[0])
+    for record in connection_records:
+        record[1], record[2] = renames.get(record[1], record[1]), renames.get(record[2], record[2])
+    NetworkUpdate.write(node_file, node_header, node_records)
+    NetworkUpdate.write(connection_file, connection_header, connection_records)
+    return renames
@@ -0,0 +1,165 @@
+import numpy as np
+
+def index_locations(lats: np.ndarray, lons: np.ndarray):
+    """
+    Gives each distinct GPS location an index in order of first appearance.
+    param: lats [np.ndarray] The specified latitudes
+    param: lons [np.ndarray] The specified longitudes
+    return: 2D tuple of the list of distinct (lat, lon) locations and the array of the location index of each given coordinate
+    """
+    if len(lats) == 0:
+        return [], np.zeros(0, dtype=np.int64)
+    unique, first, inverse = np.unique(np.stack((lats, lons), axis=1), axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first) # distinct locations in order of first appearance
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(0, len(order))
+    return [tuple(location) for location in unique[order].tolist()], rank[np.ravel(inverse)]
+
+class ODMatrix:
+    """
+    Represents the sub trips of a connection as dense origin-destination (OD) matrices of time [min] and distance [km]. Rows are the
+    connection's distinct origin locations and columns its distinct destination locations, both in order of first appearance.
+    Origin-destination pairs without a sub trip are NaN. Lookups are constant-time and rows, columns, and blocks of the matrices are
+    NumPy views.
+    The stored `orig_index` and `dest_index` of the rows are deliberately not used: in legacy data they are unreliable (catchment rows
+    are all (0, 0) and many walk rows are transposed), so rows and columns are indexed by location instead; see `locate()`.
+    """
+    def __init__(self, columns: dict, dtype=np.float64):
+        """
+        Creates an `ODMatrix` instance from the column arrays of a connection's sub trips.
+        param: columns [dict] The arrays of `time_min`, `distance_km`, `orig_lat`, `orig_lon`, `dest_lat`, and `dest_lon` of each sub trip
+        param: dtype [np.dtype] The type of the time and distance matrices; `np.float32` halves their memory
+        """
+        self.origins, origin_index = index_locations(columns["orig_lat"], columns["orig_lon"])
+        self.destinations, dest_index = index_locations(columns["dest_lat"], columns["dest_lon"])
+        # mappings of (lat, lon) locations to their row and column
+        self.origin_ids = {location: i for i, location in enumerate(self.origins)}
+        self.destination_ids = {location: j for j, location in enumerate(self.destinations)}
+        self.time_min = np.full((len(self.origins), len(self.destinations)), np.nan, dtype=dtype)
+        self.distance_km = np.full((len(self.origins), len(self.destinations)), np.nan, dtype=dtype)
+        # repeated origin-destination pairs keep the last sub trip
+        self.time_min[origin_index, dest_index] = columns["time_min"]
+        self.distance_km[origin_index, dest_index] = columns["distance_km"]
+
+    @property
+    def shape(self) -> tuple:
+        return self.time_min.shape
+
+    def get(self, origin_index: int, dest_index: int):
+        """
+        Looks up the sub trip between an origin and destination.
+        param: origin_index [int] The specified row of the origin location
+        param: dest_index [int] The specified column of the destination location
+        return: 2D tuple of time [min] and distance [km], or `None` if there is no sub trip between the locations
+        """
+        if origin_index < 0 or dest_index < 0 or origin_index >= self.shape[0] or dest_index >= self.shape[1]:
+            return None
+        time_min = self.time_min[origin_index, dest_index]
+        if np.isnan(time_min):
+            return None
+        return (float(time_min), float(self.distance_km[origin_index, dest_index]))
+
+    def locate(self, origins: list, destinations: list):
+        """
+        Maps lists of locations (e.g. the locations of the origin and destination nodes) to the rows and columns of the matrices.
+        param: origins [list] The specified (lat, lon) origin locations
+        param: destinations [list] The specified (lat, lon) destination locations
+        return: 2D tuple of arrays of the row of each origin and the column of each destination; `-1` where a location has no sub trips
+        """
+        return (np.fromiter((self.origin_ids.get(tuple(location), -1) for location in origins), dtype=np.int64, count=len(origins)),
+                np.fromiter((self.destination_ids.get(tuple(location), -1) for location in destinations), dtype=np.int64, count=len(destinations)))
+
+    def origin_slice(self, origin_index) -> tuple:
+        """
+        param: origin_index [int | slice] The specified row or rows
+        return: 2D tuple of views of the time [min] and distance [km] from the origin(s) to every destination
+        """
+        return self.time_min[origin_index], self.distance_km[origin_index]
+
+    def destination_slice(self, dest_index) -> tuple:
+        """
+        param: dest_index [int | slice] The specified column or columns
+        return: 2D tuple of views of the time [min] and distance [km] from every origin to the destination(s)
+        """
+        return self.time_min[:, dest_index], self.distance_km[:, dest_index]
+
+class ODTensor:
+    """
+    Represents the sub trips of a connection queried at several departure times as a time-indexed origin-destination (OD) tensor of
+    time [min] and distance [km]. The first axis is the departure time slot, rows are the distinct origin locations, and columns the
+    distinct destination locations of all slots, both in order of first appearance, so every slot shares the same rows and columns.
+    Origin-destination pairs without a sub trip in a slot are NaN.
+    """
+    def __init__(self, slot_columns: list, timings: list=None, dtype=np.float64):
+        """
+        Creates an `ODTensor` instance from the column arrays of each departure time slot's sub trips.
+        param: slot_columns [list] The dictionaries of arrays of `time_min`, `distance_km`, `orig_lat`, `orig_lon`, `dest_lat`, and `dest_lon` of each slot
+        param: timings [list] Optional departure time of each slot, formatted by `mp.TIMING()`
+        param: dtype [np.dtype] The type of the time and distance tensors; `np.float32` halves their memory
+        """
+        self.timings = list(timings) if timings is not None else [None] * len(slot_columns)
+        columns = {name: np.concatenate([np.asarray(slot[name], dtype=np.float64) for slot in slot_columns]) if len(slot_columns) > 0 else np.zeros(0)
+                   for name in ("time_min", "distance_km", "orig_lat", "orig_lon", "dest_lat", "dest_lon")}
+        slot_index = np.repeat(np.arange(0, len(slot_columns)), [len(slot["time_min"]) for slot in slot_columns]).astype(np.int64)
+        self.origins, origin_index = index_locations(columns["orig_lat"], columns["orig_lon"])
+        self.destinations, dest_index = index_locations(columns["dest_lat"], columns["dest_lon"])
+        # mappings of (lat, lon) locations to their row and column
+        self.origin_ids = {location: i for i, location in enumerate(self.origins)}
+        self.destination_ids = {location: j for j, location in enumerate(self.destinations)}
+        self.time_min = np.full((len(slot_columns), len(self.origins), len(self.destinations)), np.nan, dtype=dtype)
+        self.distance_km = np.full((len(slot_columns), len(self.origins), len(self.destinations)), np.nan, dtype=dtype)
+        # repeated origin-destination pairs of a slot keep the last sub trip
+        self.time_min[slot_index, origin_index, dest_index] = columns["time_min"]
+        self.distance_km[slot_index, origin_index, dest_index] = columns["distance_km"]
+
+    @property
+    def shape(self) -> tuple:
+        return self.time_min.shape
+
+    def get(self, slot: int, origin_index: int, dest_index: int):
+        """
+        Looks up the sub trip between an origin and destination at a departure time slot.
+        param: slot [int] The specified departure time slot
+        param: origin_index [int] The specified row of the origin location
+        param: dest_index [int] The specified column of the destination location
+        return: 2D tuple of time [min] and distance [km], or `None` if there is no sub trip between the locations at the slot
+        """
+        if min(slot, origin_index, dest_index) < 0 or slot >= self.shape[0] or origin_index >= self.shape[1] or dest_index >= self.shape[2]:
+            return None
+        time_min = self.time_min[slot, origin_index, dest_index]
+        if np.isnan(time_min):
+            return None
+        return (float(time_min), float(self.distance_km[slot, origin_index, dest_index]))
+
+    def locate(self, origins: list, destinations: list):
+        """
+        Maps lists of locations to the rows and columns of the tensors; see `ODMatrix.locate()`.
+        param: origins [list] The specified (lat, lon) origin locations
+        param: destinations [list] The specified (lat, lon) destination locations
+        return: 2D tuple of arrays of the row of each origin and the column of each destination; `-1` where a location has no sub trips
+        """
+        return (np.fromiter((self.origin_ids.get(tuple(location), -1) for location in origins), dtype=np.int64, count=len(origins)),
+                np.fromiter((self.destination_ids.get(tuple(location), -1) for location in destinations), dtype=np.int64, count=len(destinations)))
+
+    def slot(self, slot: int) -> tuple:
+        """
+        param: slot [int] The specified departure time slot
+        return: 2D tuple of views of the time [min] and distance [km] matrices of every origin and destination at the slot
+        """
+        return self.time_min[slot], self.distance_km[slot]
+
+    def expected(self, weights: np.ndarray=None) -> tuple:
+        """
+        Averages the tensors over departure time slots, weighing each slot by the chance of departing then. Slots without a sub trip
+        between an origin and destination are left out of that pair's average.
+        param: weights [np.ndarray] Optional weight of each slot; slots are weighed equally if not given
+        return: 2D tuple of the expected time [min] and distance [km] matrices; NaN where no slot has a sub trip
+        """
+        weights = np.ones(self.shape[0]) if weights is None else np.asarray(weights, dtype=np.float64)
+        present = ~np.isnan(self.time_min)
+        slot_weights = np.where(present, weights[:, None, None], 0.0)
+        total = slot_weights.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            time_min = (np.where(present, self.time_min, 0.0) * slot_weights).sum(axis=0) / total
+            distance_km = (np.where(present, self.distance_km, 0.0) * slot_weights).sum(axis=0) / total
+        return np.where(total > 0, time_min, np.nan), np.where(total > 0, distance_km, np.nan)
@@ -1,3 +1,4 @@
+from telemetry import * # run as a script from this folder
 import requests 
 import json
 
@@ -73,11 +74,28 @@ out body;
 out skel qt;
 """
 
+# telemetry of the queries; written next to the stop files
+DEST_TELEMETRY_FILE = "./../cph_mobility_data/overpass_telemetry.json"
+telemetry = Telemetry(progress_interval=None)
+
+def post_query(query: str):
+    """
+    Posts an Overpass query and records the call in the telemetry.
+    param: query [str] The specified query
+    return: The `requests.Response`
+    """
+    start = time.monotonic()
+    response = requests.post(URL, data={"data": query})
+    telemetry.record_call(OVERPASS_PROVIDER, time.monotonic() - start, len(response.content), response.ok)
+    telemetry.record_request(OVERPASS_PROVIDER, 1, response.ok)
+    return response
+
 # fetch queries
 URL = "https://overpass-api.de/api/interpreter"
-metro_response = requests.post(URL, data={"data": METRO_QUERY})
-train_response = requests.post(URL, data={"data": TRAIN_QUERY})
-bus_response = requests.post(URL, data={"data": BUS_QUERY})
+metro_response = post_query(METRO_QUERY)
+train_response = post_query(TRAIN_QUERY)
+bus_response = post_query(BUS_QUERY)
+telemetry.export(DEST_TELEMETRY_FILE)
 
 # record metro data
 metro_data = metro_response.json()
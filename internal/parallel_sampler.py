@@ -0,0 +1,92 @@
+from internal.trip_engine import *
+from multiprocessing import shared_memory
+from collections import deque
+import multiprocessing
+import numpy as np
+
+# compiled connection chains of each departure slot being sampled and the slot weights; set in each worker process when it attaches to shared memory
+worker_chains = None
+worker_slot_weights = None
+worker_shared_memory = None
+
+def share_connections(compiled_connections: list):
+    """
+    Copies the arrays of compiled connections into one block of shared memory, so worker processes can read them without copies.
+    param: compiled_connections [list] The `CompiledConnection` of each leg in travel order, with the chains of departure slots one after another
+    return: 2D tuple of the `SharedMemory` block and its layout; a list per connection mapping array names to (offset, dtype, length)
+    """
+    layout, size = [], 0
+    for compiled in compiled_connections:
+        arrays = {}
+        for name in COMPILED_ARRAYS:
+            array = getattr(compiled, name)
+            arrays[name] = (size, array.dtype.str, len(array))
+            size += array.nbytes
+        layout.append(arrays)
+    block = shared_memory.SharedMemory(create=True, size=max(1, size))
+    for compiled, arrays in zip(compiled_connections, layout):
+        for name, (offset, dtype, length) in arrays.items():
+            np.ndarray((length,), dtype=dtype, buffer=block.buf, offset=offset)[:] = getattr(compiled, name)
+    return block, layout
+
+def attach_connections(block_name: str, layout: list, legs: int, slot_weights: np.ndarray):
+    """
+    Attaches a worker process to the shared memory of the chains of compiled connections; used as the process pool initializer.
+    param: block_name [str] The name of the `SharedMemory` block
+    param: layout [list] The layout given by `share_connections()`
+    param: legs [int] The number of connections of each chain
+    param: slot_weights [np.ndarray] The chance of departing in each slot, or `None` for a single chain without departure slots
+    """
+    global worker_chains, worker_slot_weights, worker_shared_memory
+    # the parent process owns the block and unlinks it once sampling is done
+    worker_shared_memory = shared_memory.SharedMemory(name=block_name)
+    worker_connections = []
+    for arrays in layout:
+        views = {name: np.ndarray((length,), dtype=dtype, buffer=worker_shared_memory.buf, offset=offset) for name, (offset, dtype, length) in arrays.items()}
+        worker_connections.append(CompiledConnection.from_arrays(views))
+    worker_chains = [worker_connections[i:i + legs] for i in range(0, max(1, len(worker_connections)), max(1, legs))]
+    worker_slot_weights = slot_weights
+
+def sample_worker_chunk(task: tuple):
+    """
+    Samples one chunk of trips in a worker process from the attached compiled connections.
+    param: task [tuple] The 3D tuple of (chunk index, chunk size, sample seed)
+    return: 5D tuple of (chunk index, time [min], distance [km], visited location identifiers, departure slots) arrays
+    """
+    chunk_index, chunk_n, seed = task
+    time_min, distance_km, location_ids, departure_slots = sample_departures(worker_chains, worker_slot_weights, chunk_n, chunk_rng(seed, chunk_index))
+    return chunk_index, time_min, distance_km, location_ids, departure_slots
+
+def parallel_chunks(slot_chains: list, slot_weights: np.ndarray, n: int, chunk_size: int, seed: int, start_chunk: int=0, workers: int=None):
+    """
+    Samples chunks of trips across a pool of worker processes and yields them in chunk order. Every chunk is drawn from the random stream
+    of its chunk index, so the trips are identical for a given seed and chunk size regardless of the number of workers. At most two chunks
+    per worker are in flight at a time to keep memory bounded.
+    param: slot_chains [list] The list of `CompiledConnection` chains of each departure slot, in travel order; one chain without departure slots
+    param: slot_weights [np.ndarray] The chance of departing in each slot, or `None` for a single chain without departure slots
+    param: n [int] The number of trips to sample
+    param: chunk_size [int] The number of trips per chunk
+    param: seed [int] The seed of the sample's random streams
+    param: start_chunk [int] The index of the first chunk to draw
+    param: workers [int] The number of worker processes; defaults to the number of CPUs
+    return: A generator of 5D tuples of (chunk index, time [min], distance [km], visited location identifiers, departure slots) arrays per chunk; 
+            departure slots are `None` without them
+    """
+    for chain in slot_chains:
+        check_chain(chain)
+    workers = workers if workers is not None else multiprocessing.cpu_count()
+    tasks = ((chunk_index, min(chunk_size, n - chunk_index * chunk_size), seed) for chunk_index in range(start_chunk, (n + chunk_size - 1) // chunk_size))
+    block, layout = share_connections([compiled for chain in slot_chains for compiled in chain])
+    try:
+        with multiprocessing.get_context().Pool(workers, initializer=attach_connections, initargs=(block.name, layout, len(slot_chains[0]), slot_weights)) as pool:
+            # keep a window of submitted chunks and hand them back in order
+            pending = deque()
+            for task in tasks:
+                pending.append(pool.apply_async(sample_worker_chunk, (task,)))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().get()
+            while len(pending) > 0:
+                yield pending.popleft().get()
+    finally:
+        block.close()
+        block.unlink()
@@ -0,0 +1,76 @@
+from internal.request_planner import *
+from internal.telemetry import *
+
+class QueryBudget:
+    """
+    Represents the expected cost of a network query, gathered by a dry run that walks the network without calling any provider. Geocode
+    calls are counted per sampled location; origin-destination cells are counted per connection and planned into requests the same way
+    the query would plan them, leaving out cells already journaled as written or held by the response cache. Cells between locations that
+    are not sampled yet are planned between distinct placeholder locations, so their requests and elements are an upper bound.
+    """
+    def __init__(self, planner: RequestPlanner=None, rate: float=5.0, burst: int=5, geocode_rate: float=1.0):
+        """
+        Creates an empty `QueryBudget` instance.
+        param: planner [RequestPlanner] Optional planner whose per-request limits to plan with; the distancematrix.ai limits are used if not given
+        param: rate [float] The largest average number of DistanceMatrix requests per second; `None` for no limit
+        param: burst [int] The number of DistanceMatrix requests that may be sent at once before the rate limit applies
+        param: geocode_rate [float] The number of geocode calls per second; the usage policy of nominatim allows one
+        """
+        planner = planner if planner is not None else RequestPlanner()
+        # a planner of its own, so planning the budget leaves the given planner's counters alone
+        self.planner = RequestPlanner(planner.max_origins, planner.max_destinations, planner.max_elements, planner.max_waste)
+        self.rate = rate
+        self.burst = burst
+        self.geocode_rate = geocode_rate
+        self.geocode_calls = 0
+        self.estimated = False # whether any cells were planned between placeholder locations
+        self.connections = {} # mapping of connection identifiers to dictionaries of cell counts
+
+    def add_geocodes(self, calls: int):
+        """
+        Counts geocode calls of sampling a node's locations.
+        param: calls [int] The specified number of calls
+        """
+        self.geocode_calls += calls
+
+    def add_cells(self, profile, cells: list, done: set=None, cached: set=None, estimated: bool=False):
+        """
+        Counts the cells of a profile and adds those to fetch to the plan.
+        param: profile [MProfile] The profile the cells belong to
+        param: cells [list] The list of 4D tuples of (origin, destination, origin index, destination index) of each cell
+        param: done [set] Optional (origin index, destination index) cells that were already written
+        param: cached [set] Optional `cache_key()` of routes held by the response cache
+        param: estimated [bool] Whether the cells are between placeholder locations
+        """
+        done = done if done is not None else set()
+        cached = cached if cached is not None else set()
+        remaining = [cell for cell in cells if (cell[2], cell[3]) not in done]
+        misses = [cell for cell in remaining if profile.cache_key(cell[0], cell[1]) not in cached]
+        counts = self.connections.setdefault(profile.connection_id, {"cells": 0, "done": 0, "cached": 0, "to_fetch": 0})
+        counts["cells"] += len(cells)
+        counts["done"] += len(cells) - len(remaining)
+        counts["cached"] += len(remaining) - len(misses)
+        counts["to_fetch"] += len(misses)
+        self.estimated = self.estimated or (estimated and len(misses) > 0)
+        self.planner.add(profile, None, misses)
+
+    def report(self) -> dict:
+        """
+        Plans the requests of all added cells and reports the budget.
+        return: The dictionary of the expected calls and wall time [s] of each provider, the cell counts of each connection, the total wall time,
+                and whether the figures are upper bounds of cells between locations not sampled yet
+        """
+        self.planner.plan()
+        planned = self.planner.report()
+        requests, elements = planned["requests"], planned["billed_elements"]
+        geocode_seconds = self.geocode_calls / self.geocode_rate if self.geocode_rate else 0.0
+        request_seconds = max(0, requests - self.burst) / self.rate if self.rate else 0.0
+        return {
+            "providers": {
+                GEOCODE_PROVIDER: {"calls": self.geocode_calls, "seconds": geocode_seconds},
+                DISTANCE_MATRIX_PROVIDER: {"requests": requests, "elements": elements, "needed_elements": planned["needed_elements"], "seconds": request_seconds},
+            },
+            "connections": self.connections,
+            "seconds": geocode_seconds + request_seconds,
+            "upper_bound": self.estimated,
+        }
@@ -0,0 +1,329 @@
+from internal.response_cache import *
+from internal.query_journal import *
+from internal.request_planner import *
+from internal.telemetry import *
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from collections import defaultdict
+import threading
+import requests
+import queue
+import time
+
+class TokenBucket:
+    """
+    Represents a thread-safe token bucket rate limit. Tokens refill at a steady rate up to a burst size and every request takes one,
+    waiting for it if the bucket is empty. Waiting requests reserve their token up front, so requests are served in arrival order.
+    """
+    def __init__(self, rate: float, burst: int=1):
+        """
+        Creates a full `TokenBucket` instance.
+        param: rate [float] The number of tokens refilled per second; `None` does not limit the rate
+        param: burst [int] The largest number of tokens the bucket holds
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.last = time.monotonic() # time of the last refill
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token from the bucket, blocking until one is available.
+        """
+        if self.rate is None:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(float(self.burst), self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            # reserve the token; a negative balance is the wait until it refills
+            self.tokens -= 1.0
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+class CircuitBreaker:
+    """
+    Represents a thread-safe circuit breaker over a provider's requests. After `threshold` failed requests in a row the circuit opens and
+    every request waits out a cooldown before being sent, so a provider outage pauses querying instead of burning through failed requests.
+    The first requests after the cooldown test the provider; another failure re-opens the circuit with twice the cooldown, up to `max_cooldown`.
+    """
+    def __init__(self, threshold: int=5, cooldown: float=30.0, max_cooldown: float=600.0):
+        """
+        Creates a closed `CircuitBreaker` instance.
+        param: threshold [int] The number of failed requests in a row that opens the circuit
+        param: cooldown [float] The first pause [s] once the circuit opens
+        param: max_cooldown [float] The longest pause [s]
+        """
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.next_cooldown = cooldown # pause of the next opening; doubles while the provider keeps failing
+        self.failures = 0 # failed requests in a row
+        self.open_until = 0.0 # time the circuit closes again
+        self.trips = 0 # number of times the circuit opened
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        Blocks while the circuit is open.
+        """
+        with self.lock:
+            wait = self.open_until - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def record(self, success: bool):
+        """
+        Records the outcome of a request, opening the circuit after too many failures in a row.
+        param: success [bool] Whether the request succeeded
+        """
+        with self.lock:
+            if success:
+                self.failures = 0
+                self.next_cooldown = self.cooldown
+                return
+            self.failures += 1
+            now = time.monotonic()
+            if self.failures >= self.threshold and now >= self.open_until:
+                self.trips += 1
+                self.open_until = now + self.next_cooldown
+                print(f"QUERYING: PROVIDER FAILING, PAUSING FOR {self.next_cooldown:.1f}s")
+                self.next_cooldown = min(self.max_cooldown, 2.0 * self.next_cooldown)
+
+class QueryExecutor:
+    """
+    Represents a concurrent executor of planned DistanceMatrix requests. Requests are fetched by a pool of worker threads that share one
+    keep-alive HTTP session and one token bucket rate limit. Result rows are handed to a single writer thread, the only one that appends
+    to data files, so rows of concurrent requests are never interleaved. Fetched response elements are stored in an optional `ResponseCache`,
+    which profiles check before planning their requests, and written cells are journaled in an optional `QueryJournal` once their rows are
+    flushed. Cells of failed requests or malformed responses are gathered and re-planned in bulk for up to `retries` rounds with exponential 
+    backoff, while a `CircuitBreaker` pauses requests during provider outages; cells still failing are kept in `missing`. Calls and requests 
+    are recorded in an optional `Telemetry`. Use as a context manager, or call `close()` when done.
+    """
+    def __init__(self, workers: int=8, rate: float=5.0, burst: int=5, cache: ResponseCache=None, journal: QueryJournal=None, retries: int=3, 
+                 backoff: float=1.0, breaker: CircuitBreaker=None, telemetry: Telemetry=None):
+        """
+        Creates a `QueryExecutor` instance and starts its writer thread.
+        param: workers [int] The number of requests fetched at once
+        param: rate [float] The largest average number of requests per second; `None` does not limit the rate
+        param: burst [int] The number of requests that may be sent at once before the rate limit applies
+        param: cache [ResponseCache] Optional cache of response elements to serve and store cells through
+        param: journal [QueryJournal] Optional journal of the query to record written cells in
+        param: retries [int] The number of times failed cells are re-requested
+        param: backoff [float] The pause [s] before the first retry round; doubles every round
+        param: breaker [CircuitBreaker] Optional circuit breaker of the provider; a default one is made if not given
+        param: telemetry [Telemetry] Optional telemetry to record calls, requests, and progress in
+        """
+        self.workers = max(1, workers)
+        self.cache = cache
+        self.journal = journal
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.telemetry = telemetry
+        self.failed = [] # 4D tuples of (planner, profile, file, list of cells) of failed cells awaiting retry
+        self.missing = defaultdict(list) # mapping of connection identifiers to lists of (origin index, destination index) cells given up on
+        self.failed_lock = threading.Lock()
+        self.limiter = TokenBucket(rate, burst)
+        # keep-alive connections shared by all workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.futures = []
+        # rows to write; 4D tuples of (file, list of lines, profile key, list of cells), or `None` to stop the writer
+        self.writes = queue.Queue()
+        self.write_error = None # first error of the writer thread; re-raised by `join()`
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def get(self, url: str, **kwargs):
+        """
+        Sends a rate limited GET request through the shared session.
+        param: url [str] The specified url
+        return: The `requests.Response`
+        """
+        self.breaker.wait()
+        self.limiter.acquire()
+        if self.telemetry is None:
+            return self.session.get(url, **kwargs)
+        start = time.monotonic()
+        try:
+            response = self.session.get(url, **kwargs)
+            size = len(response.content) # reads the whole body, so latency covers the transfer
+        except requests.RequestException:
+            self.telemetry.record_call(DISTANCE_MATRIX_PROVIDER, time.monotonic() - start, 0, False)
+            raise
+        self.telemetry.record_call(DISTANCE_MATRIX_PROVIDER, time.monotonic() - start, size, response.ok)
+        return response
+
+    def submit(self, request):
+        """
+        Queues a planned request to be fetched, parsed, and written to the data files of the profiles it serves.
+        param: request [PlannedRequest] The request as given by `RequestPlanner.plan()`
+        return: The `Future` of the request
+        """
+        if self.telemetry is not None:
+            self.telemetry.expect(DISTANCE_MATRIX_PROVIDER, 1)
+        future = self.pool.submit(self.run_request, request)
+        self.futures.append(future)
+        return future
+
+    def run_request(self, request):
+        """
+        Fetches and parses one planned request in a worker thread and hands the rows of each profile it serves to the writer.
+        param: request [PlannedRequest] The specified request
+        """
+        try:
+            data_batch = request.profile.fetch_data_batch(sub_origins=request.origins, sub_destinations=request.destinations, executor=self)
+        except (requests.RequestException, ValueError):
+            data_batch = None # connection error, error status, or malformed response; the request's cells fail
+        self.breaker.record(data_batch is not None)
+        if self.telemetry is not None:
+            cells = defaultdict(int) # number of cells of each connection the request serves
+            for _, _, owners in request.cells:
+                for profile, _, _, _ in owners:
+                    cells[profile.connection_id] += 1
+            self.telemetry.record_request(DISTANCE_MATRIX_PROVIDER, request.elements, data_batch is not None, cells)
+        if self.cache is not None and data_batch is not None:
+            self.cache.put_many(request.profile.cache_elements((request.origins, request.destinations), data_batch))
+        # gather rows by profile and file so each is written and journaled at once
+        written, failed = {}, []
+        for profile, file, kernel, sub_batch in request.kernels(data_batch):
+            lines, cells = profile.record_kernel(kernel, sub_batch)
+            profile_lines, profile_cells = written.setdefault((profile, file), ([], []))
+            profile_lines.extend(lines)
+            profile_cells.extend(cells)
+            failed.extend(self.failed_cells(profile, file, kernel, sub_batch, set(cells)))
+        for (profile, file), (lines, cells) in written.items():
+            self.write(file, lines, profile.journal_key(), cells)
+        with self.failed_lock:
+            for profile, file, cell, retry in failed:
+                if retry:
+                    self.failed.append((request.planner, profile, file, [cell]))
+                else:
+                    self.missing[profile.connection_id].append((cell[2], cell[3]))
+
+    def failed_cells(self, profile, file: str, kernel: tuple, data_batch, written: set) -> list:
+        """
+        Finds the cells of a kernel that were not written and whether they are worth retrying. Cells the provider answered as having no 
+        route are not retried.
+        param: profile [MProfile] The profile of the kernel
+        param: file [str] The data file of the kernel
+        param: kernel [tuple] The specified kernel
+        param: data_batch [any] The data batch of the kernel; `None` if fetching failed
+        param: written [set] The (origin index, destination index) cells of the kernel that were written
+        return: The list of 4D tuples of (profile, file, cell, whether to retry), with cells as given to `RequestPlanner.add()`
+        """
+        sub_origins, sub_destinations, origin_indices, destination_indices = kernel
+        failed = []
+        for i in range(0, len(sub_origins)):
+            for j in range(0, len(sub_destinations)):
+                if (origin_indices[i], destination_indices[j]) in written:
+                    continue
+                element = PlannedRequest.element(data_batch, i, j) if data_batch is not None else None
+                retry = not (isinstance(element, dict) and element.get("status") in NO_ROUTE_STATUSES)
+                failed.append((profile, file, (sub_origins[i], sub_destinations[j], origin_indices[i], destination_indices[j]), retry))
+        return failed
+
+    def write(self, file: str, lines: list, profile_key: str=None, cells: list=None):
+        """
+        Hands rows to the writer thread to append to a data file.
+        param: file [str] The specified data file
+        param: lines [list] The rows to append
+        param: profile_key [str] Optional key of the profile the rows belong to, as given by `MProfile.journal_key()`
+        param: cells [list] Optional (origin index, destination index) cells of the rows to journal once they are written
+        """
+        if self.write_error is not None:
+            raise self.write_error # the writer stopped writing; fail the request rather than queue rows that are never written
+        self.writes.put((file, lines, profile_key, cells))
+
+    def write_loop(self):
+        """
+        Appends queued rows to their data files; runs on the writer thread until stopped. If writing or journaling fails (e.g. the disk is
+        full), the error is kept for `join()` to re-raise and later rows are dropped, so no row is written without being journaled. 
+        """
+        files = {} # open data files mapped by path
+        try:
+            while True:
+                item = self.writes.get()
+                try:
+                    if item is None:
+                        break
+                    if self.write_error is not None:
+                        continue
+                    file, lines, profile_key, cells = item
+                    if file not in files:
+                        files[file] = open(file, "a")
+                    files[file].writelines(lines)
+                    files[file].flush()
+                    if self.journal is not None and profile_key is not None and cells:
+                        self.journal.record_cells(profile_key, cells, file, files[file].tell())
+                except Exception as error:
+                    self.write_error = error
+                finally:
+                    self.writes.task_done()
+        finally:
+            for data_file in files.values():
+                data_file.close()
+
+    def join(self):
+        """
+        Waits until every submitted request is fetched and its rows are written, retrying failed cells in rounds until they succeed or
+        run out of retries. Raises the error of the writer thread if writing failed.
+        """
+        retry_round = 0
+        while True:
+            futures, self.futures = self.futures, []
+            for future in futures:
+                future.result()
+            with self.failed_lock:
+                failed, self.failed = self.failed, []
+                if retry_round >= self.retries:
+                    for _, profile, _, cells in failed: # out of retries; give up on the cells
+                        self.missing[profile.connection_id].extend((cell[2], cell[3]) for cell in cells)
+                    failed = []
+            if len(failed) == 0:
+                break
+            # re-plan failed cells in bulk after backing off
+            time.sleep(self.backoff * 2 ** retry_round)
+            retry_round += 1
+            print(f"QUERYING: RETRYING {sum(len(cells) for _, _, _, cells in failed)} FAILED CELLS (ROUND {retry_round})")
+            planners, fallback = {}, RequestPlanner() # cells of requests planned elsewhere are re-planned with the default limits
+            for planner, profile, file, cells in failed:
+                planner = planner if planner is not None else fallback
+                planners[id(planner)] = planner
+                planner.add(profile, file, cells)
+            for planner in planners.values():
+                planner.submit(self)
+        self.writes.join()
+        if self.write_error is not None:
+            raise self.write_error
+
+    def missing_report(self) -> dict:
+        """
+        return: The dictionary of the sorted (origin index, destination index) cells given up on, mapped by connection identifier
+        """
+        with self.failed_lock:
+            return {conn_id: sorted(set(cells)) for conn_id, cells in self.missing.items() if len(cells) > 0}
+
+    def close(self):
+        """
+        Waits for all submitted requests, then stops the workers and writer and closes the session.
+        """
+        try:
+            self.join()
+        finally:
+            self.pool.shutdown(wait=True)
+            self.writes.put(None)
+            self.writer.join()
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
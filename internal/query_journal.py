@@ -0,0 +1,210 @@
+from collections import defaultdict
+import threading
+import csv
+import json
+import os
+
+class QueryJournal:
+    """
+    Represents the progress journal of a network query, so an interrupted query can be resumed. The journal is an append-only file of
+    JSON lines, one per completed step: each node whose locations were written and each kernel whose rows were written, along with the
+    size of the data file after the step. On resume, data files are truncated back to the last journaled size, which drops rows of
+    steps that were cut off, and journaled steps are skipped, so no row is written twice. Rows written without a journal (e.g. by a query
+    run before journaling) are adopted as completed steps, and starting over truncates the data files back to their header.
+    """
+    def __init__(self, file: str, resume: bool=True, read_only: bool=False):
+        """
+        Creates a `QueryJournal` instance, reading the journal file if it exists.
+        param: file [str] The specified journal file
+        param: resume [bool] Whether to continue from the journal file; if not, it is cleared and the query starts over
+        param: read_only [bool] Whether to only read the journal file (e.g. for a dry run); it is left as it is and nothing can be journaled
+        """
+        self.file = file
+        self.resume = resume
+        self.read_only = read_only
+        self.lock = threading.Lock()
+        self.nodes = set() # identifiers of nodes whose locations were written
+        self.cells = defaultdict(set) # mapping of profile keys to the (origin index, destination index) cells whose rows were written
+        self.offsets = {} # mapping of data files to their size after the last journaled step
+        if resume:
+            self.read()
+        elif os.path.exists(file) and not read_only:
+            os.remove(file)
+        self.journal_file = open(file, "a") if not read_only else None
+
+    def read(self):
+        """
+        Reads the journal file. A last entry cut off mid-write is dropped from the file, unless the journal is read only.
+        """
+        if not os.path.exists(self.file):
+            return
+        valid = 0 # bytes of whole entries
+        with open(self.file, "rb") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break # partial entry of an interrupted write
+                if not line.endswith(b"\n"):
+                    break
+                valid += len(line)
+                if "node" in entry:
+                    self.nodes.add(entry["node"])
+                if "profile" in entry:
+                    self.cells[entry["profile"]].update(tuple(cell) for cell in entry["cells"])
+                self.offsets[entry["file"]] = entry["offset"]
+        if not self.read_only:
+            with open(self.file, "r+b") as journal_file:
+                journal_file.truncate(valid)
+
+    def begin(self, files: list) -> list:
+        """
+        Prepares data files for the query. When starting over, files are truncated back to their header. Otherwise, files with journaled
+        progress are truncated to their last journaled size, and the sizes of other files are journaled as they are; their rows were
+        written before this journal and are to be adopted by `adopt_nodes()` and `adopt_cells()`, so they are neither dropped nor written again.
+        param: files [list] The specified data files
+        return: The list of files with rows written before this journal
+        """
+        unjournaled = []
+        for file in files:
+            key = os.path.abspath(file)
+            if not self.resume:
+                with open(file, "r+b") as data_file:
+                    data_file.truncate(len(data_file.readline())) # keep the header
+                self.write({"file": key, "offset": os.path.getsize(file)})
+            elif key in self.offsets:
+                if os.path.getsize(file) > self.offsets[key]:
+                    with open(file, "r+b") as data_file:
+                        data_file.truncate(self.offsets[key])
+            else:
+                with open(file, "r+b") as data_file: # drop a last row cut off mid-write
+                    content = data_file.read()
+                    if len(content) > 0 and not content.endswith(b"\n"):
+                        data_file.truncate(content.rfind(b"\n") + 1)
+                unjournaled.append(file)
+                self.write({"file": key, "offset": os.path.getsize(file)})
+        return unjournaled
+
+    @staticmethod
+    def stored_progress(node_file: str, connection_file: str) -> tuple:
+        """
+        Reads the steps stored data files hold, whether journaled or not. Rows are read as routes rather than by their stored 
+        (orig_index, dest_index), which do not identify a cell in data written before journaling (e.g. catchment rows all stored as (0, 0)).
+        param: node_file [str] The specified nodes file
+        param: connection_file [str] The specified connections file
+        return: 2D tuple of the set of identifiers of nodes with locations and the mapping of connection identifiers to the set of stored 
+                routes of (origin lat, origin lon, destination lat, destination lon)
+        """
+        nodes, routes = set(), defaultdict(set)
+        if os.path.exists(node_file):
+            with open(node_file, newline='') as data_file:
+                records = csv.reader(data_file)
+                next(records, None) # header
+                nodes.update(record[0] for record in records if len(record) >= 6)
+        if os.path.exists(connection_file):
+            with open(connection_file, newline='') as data_file:
+                records = csv.reader(data_file)
+                next(records, None) # header
+                for record in records:
+                    try:
+                        routes[record[0].strip()].add(tuple(float(value) for value in record[3:7]))
+                    except (IndexError, ValueError):
+                        continue # row cut off mid-write
+        return nodes, routes
+
+    @staticmethod
+    def stored_cells(routes: set, cells: list) -> set:
+        """
+        Finds the cells of a profile whose routes are stored, matching them by location. 
+        param: routes [set] The stored routes of the profile's connection, as given by `stored_progress()`
+        param: cells [list] The list of 4D tuples of (origin, destination, origin index, destination index) of the profile's cells, with 
+                            locations as `GPS()` strings
+        return: The set of (origin index, destination index) cells whose routes are stored
+        """
+        done = set()
+        for origin, destination, origin_index, destination_index in cells:
+            try:
+                route = tuple(float(value) for value in f"{origin},{destination}".split(","))
+            except ValueError:
+                continue # placeholder location of a node still to be sampled
+            if route in routes:
+                done.add((origin_index, destination_index))
+        return done
+
+    def adopt_nodes(self, node_file: str, node_ids: list):
+        """
+        Journals the nodes whose locations the nodes file holds from before this journal as completed, so a query reads them back instead 
+        of sampling them again. Call after `begin()` returns the files.
+        param: node_file [str] The specified nodes file
+        param: node_ids [list] The identifiers of the stored nodes of the network, as given by `stored_progress()`
+        """
+        for node_id in node_ids:
+            if not self.node_done(node_id):
+                self.record_node(node_id, node_file)
+
+    def adopt_cells(self, profile_key: str, cells: set, connection_file: str):
+        """
+        Journals the cells of a profile whose rows the connections file holds from before this journal as completed, so a query does not 
+        query them again. Call once the locations of the profile's nodes are known, before any of its rows are written.
+        param: profile_key [str] The key of the profile, as given by `MProfile.journal_key()`
+        param: cells [set] The stored (origin index, destination index) cells of the profile, as given by `stored_cells()`
+        param: connection_file [str] The specified connections file
+        """
+        stored = set(cells) - self.done_cells(profile_key)
+        if len(stored) > 0:
+            self.record_cells(profile_key, sorted(stored), connection_file, os.path.getsize(connection_file))
+
+    def write(self, entry: dict):
+        """
+        Appends an entry to the journal file and applies it.
+        param: entry [dict] The specified entry
+        """
+        with self.lock:
+            self.journal_file.write(json.dumps(entry) + "\n")
+            self.journal_file.flush()
+            os.fsync(self.journal_file.fileno())
+            self.offsets[entry["file"]] = entry["offset"]
+
+    def node_done(self, node_id: str) -> bool:
+        """
+        param: node_id [str] The specified node identifier
+        return: Whether the node's locations were written by a journaled step
+        """
+        return node_id in self.nodes
+
+    def record_node(self, node_id: str, file: str):
+        """
+        Journals that a node's locations were written; call once the node file is closed.
+        param: node_id [str] The specified node identifier
+        param: file [str] The node file written to
+        """
+        self.nodes.add(node_id)
+        self.write({"node": node_id, "file": os.path.abspath(file), "offset": os.path.getsize(file)})
+
+    def done_cells(self, profile_key: str) -> set:
+        """
+        param: profile_key [str] The key of a profile, as given by `MProfile.journal_key()`
+        return: The set of (origin index, destination index) cells of the profile whose rows were written
+        """
+        with self.lock:
+            return set(self.cells.get(profile_key, set()))
+
+    def record_cells(self, profile_key: str, cells: list, file: str, offset: int):
+        """
+        Journals that the rows of a profile's cells were written; call once they are flushed to the file.
+        param: profile_key [str] The key of a profile, as given by `MProfile.journal_key()`
+        param: cells [list] The (origin index, destination index) cells written
+        param: file [str] The connections file written to
+        param: offset [int] The size of the file after the rows
+        """
+        with self.lock:
+            self.cells[profile_key].update(cells)
+        self.write({"profile": profile_key, "cells": [list(cell) for cell in cells], "file": os.path.abspath(file), "offset": offset})
+
+    def close(self):
+        """
+        Closes the journal file.
+        """
+        with self.lock:
+            if self.journal_file is not None:
+                self.journal_file.close()
@@ -0,0 +1,210 @@
+from collections import defaultdict
+import math
+
+# default per-request limits of the distancematrix.ai platform
+MAX_ORIGINS = 25
+MAX_DESTINATIONS = 25
+MAX_ELEMENTS = 100
+# element statuses of routes the provider has no answer for; asking again does not help
+NO_ROUTE_STATUSES = ("NOT_FOUND", "ZERO_RESULTS")
+
+class PlannedRequest:
+    """
+    Represents one DistanceMatrix request planned by a `RequestPlanner`: a list of origins, a list of destinations, and the cells of
+    profiles that the response serves. All profiles served share the query parameters of `profile`, which the request is sent with.
+    """
+    def __init__(self, profile, origins: list, destinations: list):
+        """
+        Creates an empty `PlannedRequest` instance.
+        param: profile [MProfile] The profile whose query parameters the request is sent with
+        param: origins [list] The specified origins
+        param: destinations [list] The specified destinations
+        """
+        self.profile = profile
+        self.origins = origins
+        self.destinations = destinations
+        self.planner = None # the planner that planned the request; re-plans its failed cells
+        self.cells = [] # 3D tuples of (origin position, destination position, list of owners) of each needed element; owners are 4D tuples of 
+                        # (profile, file, origin index, destination index)
+
+    @property
+    def elements(self) -> int:
+        return len(self.origins) * len(self.destinations)
+
+    def kernels(self, data_batch) -> list:
+        """
+        Splits a response into the kernels of the profiles the request serves, one kernel per profile, file, and origin row.
+        param: data_batch [any] The data batch fetched for the request; `None` if fetching failed
+        return: The list of 4D tuples of (profile, file, kernel, data batch of the kernel), with kernels as given to `MProfile.record_kernel()`
+        """
+        rows = defaultdict(list) # mapping of (profile, file, origin position, origin index) to lists of (destination position, destination index)
+        for origin_position, destination_position, owners in self.cells:
+            for profile, file, origin_index, destination_index in owners:
+                rows[(profile, file, origin_position, origin_index)].append((destination_position, destination_index))
+        kernels = []
+        for (profile, file, origin_position, origin_index), destinations in rows.items():
+            kernel = ([self.origins[origin_position]], [self.destinations[position] for position, _ in destinations], [origin_index], [index for _, index in destinations])
+            sub_batch = None
+            if data_batch is not None:
+                sub_batch = [{"elements": [self.element(data_batch, origin_position, position) for position, _ in destinations]}]
+            kernels.append((profile, file, kernel, sub_batch))
+        return kernels
+
+    @staticmethod
+    def element(data_batch, origin_position: int, destination_position: int):
+        """
+        param: data_batch [any] The data batch fetched for the request
+        param: origin_position [int] The position of the origin in the request
+        param: destination_position [int] The position of the destination in the request
+        return: The response element of the cell, or `None` if the response lacks it
+        """
+        try:
+            return data_batch[origin_position]["elements"][destination_position]
+        except (IndexError, KeyError, TypeError):
+            return None
+
+class RequestPlanner:
+    """
+    Represents the planner of DistanceMatrix requests for the cells of many profiles. Cells are gathered by query parameters (mode, transit
+    mode, timing, traffic model, and avoid), so profiles that query the same way share requests, and a route needed by several profiles
+    is requested once. Within each set of parameters, origins that need the same destinations are grouped into blocks, each block is tiled
+    with the request shape that needs the fewest requests under the per-request limits, and small tiles are packed together into shared
+    requests. A request may then cover cells no profile needs; `max_waste` bounds the share of such elements in a packed request.
+    """
+    def __init__(self, max_origins: int=MAX_ORIGINS, max_destinations: int=MAX_DESTINATIONS, max_elements: int=MAX_ELEMENTS, max_waste: float=0.5):
+        """
+        Creates an empty `RequestPlanner` instance.
+        param: max_origins [int] The largest number of origins of a request
+        param: max_destinations [int] The largest number of destinations of a request
+        param: max_elements [int] The largest number of elements (origins x destinations) of a request
+        param: max_waste [float] The largest share of unneeded elements in a request made by packing tiles together; `0` never packs unneeded cells
+        """
+        self.max_origins = max(1, max_origins)
+        self.max_destinations = max(1, max_destinations)
+        self.max_elements = max(1, max_elements)
+        self.max_waste = max_waste
+        self.pending = defaultdict(dict) # mapping of query signatures to mappings of (origin, destination) to lists of owners
+        self.profiles = {} # mapping of query signatures to the first profile added with them
+        # counters of planned requests
+        self.owner_cells = 0
+        self.needed_elements = 0
+        self.requests = 0
+        self.billed_elements = 0
+
+    def add(self, profile, file: str, cells: list):
+        """
+        Adds cells of a profile to plan requests for.
+        param: profile [MProfile] The profile the cells belong to
+        param: file [str] The data file to write the cells' rows to
+        param: cells [list] The list of 4D tuples of (origin, destination, origin index, destination index) of each cell
+        """
+        signature = profile.query_signature()
+        self.profiles.setdefault(signature, profile)
+        pending = self.pending[signature]
+        for origin, destination, origin_index, destination_index in cells:
+            pending.setdefault((origin, destination), []).append((profile, file, origin_index, destination_index))
+            self.owner_cells += 1
+
+    def tile_shape(self, m: int, n: int) -> tuple:
+        """
+        Finds the request shape that covers a block of origins and destinations in the fewest requests under the per-request limits.
+        param: m [int] The number of origins of the block
+        param: n [int] The number of destinations of the block
+        return: 2D tuple of the number of (origins, destinations) of each tile
+        """
+        best = None
+        for a in range(1, min(m, self.max_origins, self.max_elements) + 1):
+            b = min(n, self.max_destinations, self.max_elements // a)
+            requests = math.ceil(m / a) * math.ceil(n / b)
+            if best is None or requests < best[0]:
+                best = (requests, a, b)
+        return best[1], best[2]
+
+    def fits(self, origins: set, destinations: set, needed: int) -> bool:
+        """
+        param: origins [set] The specified origins of a request
+        param: destinations [set] The specified destinations of a request
+        param: needed [int] The number of the request's elements that cells need
+        return: Whether the request is within the per-request limits and the waste bound
+        """
+        elements = len(origins) * len(destinations)
+        return (len(origins) <= self.max_origins and len(destinations) <= self.max_destinations and elements <= self.max_elements
+                and elements - needed <= self.max_waste * elements)
+
+    def plan(self) -> list:
+        """
+        Plans requests for all added cells, which are then cleared.
+        return: The list of `PlannedRequest`
+        """
+        planned = []
+        for signature, pending in self.pending.items():
+            # destinations each origin needs, in order of first appearance
+            needs = defaultdict(list)
+            for origin, destination in pending.keys():
+                needs[origin].append(destination)
+            # blocks of origins that need the same destinations
+            blocks = defaultdict(list)
+            for origin, destinations in needs.items():
+                blocks[tuple(destinations)].append(origin)
+            tiles = []
+            for destinations, origins in blocks.items():
+                a, b = self.tile_shape(len(origins), len(destinations))
+                for y in range(0, len(origins), a):
+                    for x in range(0, len(destinations), b):
+                        tiles.append((origins[y:y + a], list(destinations[x:x + b])))
+            # best fit packing of tiles into requests, largest tiles first
+            tiles.sort(key=lambda tile: len(tile[0]) * len(tile[1]), reverse=True)
+            bins = [] # 4D lists of (origins set, destinations set, number of needed elements, tiles)
+            for tile_origins, tile_destinations in tiles:
+                best, best_growth = None, None
+                for packed in bins:
+                    origins, destinations = packed[0] | set(tile_origins), packed[1] | set(tile_destinations)
+                    if self.fits(origins, destinations, packed[2] + len(tile_origins) * len(tile_destinations)):
+                        growth = len(origins) * len(destinations) - len(packed[0]) * len(packed[1])
+                        if best is None or growth < best_growth:
+                            best, best_growth = packed, growth
+                if best is None:
+                    bins.append([set(tile_origins), set(tile_destinations), len(tile_origins) * len(tile_destinations), [(tile_origins, tile_destinations)]])
+                else:
+                    best[0].update(tile_origins)
+                    best[1].update(tile_destinations)
+                    best[2] += len(tile_origins) * len(tile_destinations)
+                    best[3].append((tile_origins, tile_destinations))
+            for _, _, _, packed_tiles in bins:
+                # keep origins and destinations in the order tiles list them
+                origins = list(dict.fromkeys(origin for tile in packed_tiles for origin in tile[0]))
+                destinations = list(dict.fromkeys(destination for tile in packed_tiles for destination in tile[1]))
+                request = PlannedRequest(self.profiles[signature], origins, destinations)
+                request.planner = self
+                origin_positions = {origin: i for i, origin in enumerate(origins)}
+                destination_positions = {destination: j for j, destination in enumerate(destinations)}
+                for tile_origins, tile_destinations in packed_tiles:
+                    for origin in tile_origins:
+                        for destination in tile_destinations:
+                            request.cells.append((origin_positions[origin], destination_positions[destination], pending[(origin, destination)]))
+                self.needed_elements += len(request.cells)
+                self.billed_elements += request.elements
+                planned.append(request)
+        self.requests += len(planned)
+        self.pending.clear()
+        return planned
+
+    def submit(self, executor) -> list:
+        """
+        Plans requests for all added cells and queues them on an executor.
+        param: executor [QueryExecutor] The specified executor
+        return: The list of `PlannedRequest` queued
+        """
+        planned = self.plan()
+        for request in planned:
+            executor.submit(request)
+        return planned
+
+    def report(self) -> dict:
+        """
+        return: The dictionary of the efficiency of planned requests; the number of profile cells, distinct elements needed, requests, and
+                billed elements, with the requests per cell and the share of billed elements that were needed
+        """
+        return {"cells": self.owner_cells, "needed_elements": self.needed_elements, "requests": self.requests, "billed_elements": self.billed_elements,
+                "requests_per_cell": self.requests / self.owner_cells if self.owner_cells > 0 else 0.0,
+                "element_efficiency": self.needed_elements / self.billed_elements if self.billed_elements > 0 else 1.0}
@@ -0,0 +1,110 @@
+import threading
+import sqlite3
+import json
+import time
+import os
+
+# default location of the response cache; shared by every network
+RESPONSE_CACHE_FILE = "./network_mobility_data/.cache/distancematrix_responses.sqlite"
+
+class ResponseCache:
+    """
+    Represents a persistent on-disk cache of DistanceMatrix response elements, shared across networks and runs. Each element is the response
+    for one origin-destination pair under one set of query parameters (mode, transit mode, timing, traffic model, and avoid), so a pair
+    requested by any profile of any network is only paid for once. The cache holds at most `max_entries` elements and evicts the least
+    recently used ones past that. It is safe to use from many threads.
+    """
+    def __init__(self, file: str=RESPONSE_CACHE_FILE, max_entries: int=1000000):
+        """
+        Creates a `ResponseCache` instance, opening or creating its database file.
+        param: file [str] The specified database file
+        param: max_entries [int] The largest number of elements kept
+        """
+        self.file = file
+        self.max_entries = max_entries
+        # counters of this session
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        if os.path.dirname(file) != "":
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+        self.connection = sqlite3.connect(file, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS elements (key TEXT PRIMARY KEY, element TEXT NOT NULL, last_used REAL NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS elements_last_used ON elements (last_used)")
+        self.connection.commit()
+
+    def get_many(self, keys: list) -> dict:
+        """
+        Looks up the cached elements of many keys at once and counts hits and misses.
+        param: keys [list] The specified keys, as given by `MProfile.cache_key()`
+        return: The dictionary of cached response elements mapped by key; keys that are not cached are left out
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self.lock:
+            # stay under sqlite's limit on query parameters
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                rows = self.connection.execute(f"SELECT key, element FROM elements WHERE key IN ({','.join('?' * len(part))})", part).fetchall()
+                found.update((key, json.loads(element)) for key, element in rows)
+            # mark hits as recently used
+            now = time.time()
+            self.connection.executemany("UPDATE elements SET last_used = ? WHERE key = ?", ((now, key) for key in found.keys()))
+            self.connection.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def contains_many(self, keys: list) -> set:
+        """
+        Finds which of many keys are cached, without counting hits and misses or marking them as used (e.g. to plan a query).
+        param: keys [list] The specified keys
+        return: The set of keys that are cached
+        """
+        keys = list(dict.fromkeys(keys))
+        found = set()
+        with self.lock:
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                rows = self.connection.execute(f"SELECT key FROM elements WHERE key IN ({','.join('?' * len(part))})", part).fetchall()
+                found.update(key for key, in rows)
+        return found
+
+    def put_many(self, elements: dict):
+        """
+        Stores many response elements at once, then evicts the least recently used elements past the size bound.
+        param: elements [dict] The specified response elements mapped by key
+        """
+        if len(elements) == 0:
+            return
+        with self.lock:
+            now = time.time()
+            self.connection.executemany("INSERT OR REPLACE INTO elements (key, element, last_used) VALUES (?, ?, ?)",
+                                        ((key, json.dumps(element), now) for key, element in elements.items()))
+            self.stored += len(elements)
+            excess = self.connection.execute("SELECT COUNT(*) FROM elements").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.connection.execute("DELETE FROM elements WHERE key IN (SELECT key FROM elements ORDER BY last_used LIMIT ?)", (excess,))
+                self.evictions += excess
+            self.connection.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM elements").fetchone()[0]
+
+    def stats(self) -> dict:
+        """
+        return: The dictionary of this session's `hits`, `misses`, `stored` elements, and `evictions`, with the `hit_rate` and current `size`
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+                "stored": self.stored, "evictions": self.evictions, "size": len(self)}
+
+    def close(self):
+        """
+        Closes the database file.
+        """
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,282 @@
+from internal.trip_engine import *
+from internal.spatial_index import *
+import internal.mobility_profile as mp
+from enum import Enum as enum
+import numpy as np
+
+# least great-circle distance [km] from a queried walk's location to its stop for the walk to be scaled to a re-mapped location
+MIN_SCALED_KM = 0.05
+
+class NetworkScenario:
+    """
+    Represents a "what if" variation of an already loaded mobility network, such as closed stops, a removed transit line, dropped sub trips,
+    or slower or faster travel by one mode. Edits are applied to the network's compiled connections without re-querying or re-reading data.
+    Catchment locations whose stop is closed walk to the nearest remaining stop of their transit node instead, using the queried walk of the
+    nearest catchment location to that stop.
+    Only connections touched by an edit are re-compiled, and compiled connections, catchment mappings, and trip distributions are cached on
+    the network so sweeps over many scenarios re-use everything an edit did not change. Edits are chained like `MProfile.set()`.
+    """
+    def __init__(self, network, name: str):
+        """
+        Creates a `NetworkScenario` instance; use `MobilityNetworkBase.scenario()`.
+        param: network [MobilityNetworkBase] The network the scenario varies
+        param: name [str] The unique identifier of the scenario
+        """
+        self.network = network
+        self.name = name
+        self.dropped_stops = set() # gps coordinates of closed transit stops
+        self.remaps = None # stop re-maps of the closed stops, as given by `stop_remaps()`; `None` until computed
+        self.dropped_rows = [] # 3D tuples of (conn_id, origin gps, destination gps); `None` gps matches any location
+        self.time_scales = [] # 2D tuples of (mode or transit_mode, factor) to scale sub trip times by
+        # trip distributions and summary statistics evaluated under this scenario; mapped by sample id
+        self.distributions = {}
+        self.summaries = {}
+
+    def drop_stops(self, gps_stops: list) -> 'NetworkScenario':
+        """
+        Closes transit stops. Sub trips to or from a closed stop are dropped.
+        param: gps_stops [list] The list of 2D tuples of (lat, lon) of the stops to close
+        return: This scenario
+        """
+        self.dropped_stops.update((float(lat), float(lon)) for lat, lon in gps_stops)
+        self.remaps = None
+        return self
+
+    def drop_line(self, transit_type: mp.transit_mode, line) -> 'NetworkScenario':
+        """
+        Removes a transit line by closing the stops that no other line of the same transit type serves.
+        param: transit_type [mp.transit_mode] The type of transit of the line
+        param: line [enum | str] The line to remove from the `buses`, `metros`, or `trains` enums (e.g. `metros.M4`); "all" removes every stop of the type
+        return: This scenario
+        """
+        line = line.value if isinstance(line, enum) else str(line)
+        stops = self.network.transit_stops_gps(transit_type)
+        served_elsewhere = set(stop for other, other_stops in stops.items() if other != line and other != "all" for stop in other_stops)
+        return self.drop_stops([stop for stop in stops.get(line, []) if line == "all" or stop not in served_elsewhere])
+
+    def drop_rows(self, conn_id: str, origin: tuple=None, destination: tuple=None) -> 'NetworkScenario':
+        """
+        Drops the sub trips of a connection between an origin and destination location.
+        param: conn_id [str] The identifier of the connection
+        param: origin [tuple] Optional 2D tuple of the origin (lat, lon); any origin if not given
+        param: destination [tuple] Optional 2D tuple of the destination (lat, lon); any destination if not given
+        return: This scenario
+        """
+        self.dropped_rows.append((conn_id, origin, destination))
+        return self
+
+    def scale_time(self, param, factor: float) -> 'NetworkScenario':
+        """
+        Scales the time of every sub trip of connections travelling by a given means (e.g. `mp.mode.WALKING` or `mp.transit_mode.BUS`).
+        param: param [mode | transit_mode] The specified means of travel
+        param: factor [float] The factor to multiply sub trip times by
+        return: This scenario
+        """
+        self.time_scales.append((param, factor))
+        return self
+
+    def signature(self, connection: mp.MProfile, base: CompiledConnection) -> tuple:
+        """
+        Finds the edits of this scenario that change a connection. Connections with equal signatures compile to the same arrays.
+        param: connection [MProfile] The specified connection
+        param: base [CompiledConnection] The connection compiled without edits
+        return: 3D tuple of the dropped location identifiers, dropped (origin, destination) identifier pairs, and time scale that apply
+        """
+        registry = self.network.location_registry
+        visited = np.union1d(base.origin_ids, base.dest_ids)
+        dropped_ids = [registry.location_ids[stop] for stop in self.dropped_stops if stop in registry.location_ids]
+        dropped_ids = frozenset(np.intersect1d(np.array(dropped_ids, dtype=np.int64), visited).tolist())
+        # row edits of this connection; `-1` stands for any location
+        row_ids = frozenset((registry.location_ids.get(origin, -2) if origin is not None else -1, registry.location_ids.get(destination, -2) if destination is not None else -1)
+                            for conn_id, origin, destination in self.dropped_rows if conn_id == connection.connection_id)
+        scale = float(np.prod([factor for param, factor in self.time_scales if connection.uses(param)]))
+        return (dropped_ids, row_ids, scale)
+
+    def stop_remaps(self) -> dict:
+        """
+        Re-maps the catchment locations of transit nodes whose stop was closed onto the nearest remaining stop of the same transit node. Only 
+        stops the node was queried at are candidates, since only they have queried transit sub trips. 
+        return: The dictionary of lists of 3D tuples of (catchment location gps, closed stop gps, remaining stop gps) mapped by transit node identifier
+        """
+        if self.remaps is not None:
+            return self.remaps
+        self.remaps = {}
+        for node in self.network.nodes:
+            if node.catchment_node is None or len(self.dropped_stops) == 0:
+                continue
+            stops = [location.gps_coordinate for location in node.locations]
+            catchment = [location.gps_coordinate for location in node.catchment_node.locations]
+            # the i-th catchment location uses the i-th stop
+            closed = [i for i in range(0, min(len(stops), len(catchment))) if stops[i] in self.dropped_stops]
+            remaining = list(dict.fromkeys(stop for stop in stops if stop not in self.dropped_stops))
+            if len(closed) == 0 or len(remaining) == 0:
+                continue # the node keeps its stops, or loses all of them and its trips end
+            nearest = node.get_closest_transit_stops(gps_list=[catchment[i] for i in closed], transit_stops={"remaining": remaining}, type="remaining")
+            self.remaps[node.node_id] = [(catchment[i], stops[i], stop) for i, stop in zip(closed, nearest)]
+        return self.remaps
+
+    def remapped_rows(self, connection: mp.MProfile, base: CompiledConnection) -> tuple:
+        """
+        Finds the sub trips a walk between a catchment node and its transit node gains from re-mapped stops. The walk between a re-mapped
+        catchment location and its new stop was not queried, so it is estimated from the queried walk between that stop and the nearest 
+        catchment location that uses it, scaled by the ratio of their great-circle distances to the stop. If that location is at the stop,
+        the median detour and pace of the connection's queried walks are used instead.
+        param: connection [MProfile] The specified connection
+        param: base [CompiledConnection] The connection compiled without edits
+        return: 4D tuple of arrays of the time [min], distance [km], origin identifiers, and destination identifiers of the gained sub trips
+        """
+        registry = self.network.location_registry
+        rows = []
+        detour, pace = None, None # median route distance per great-circle [km], and time per route distance [min/km], of queried walks
+        for node in self.network.nodes:
+            remaps = self.stop_remaps().get(node.node_id, [])
+            if len(remaps) == 0:
+                continue
+            # walks to a departure stop start at the catchment location; walks from an arrival stop end at it
+            to_stop = connection.origin_node_id == node.catchment_node.node_id and connection.destination_node_id == node.node_id
+            from_stop = connection.origin_node_id == node.node_id and connection.destination_node_id == node.catchment_node.node_id
+            if not (to_stop or from_stop):
+                continue
+            for location, _, stop in remaps:
+                location_id, stop_id = registry.location_ids.get(location), registry.location_ids.get(stop)
+                if location_id is None or stop_id is None:
+                    continue
+                candidates = np.nonzero((base.dest_ids if to_stop else base.origin_ids) == stop_id)[0]
+                if len(candidates) == 0:
+                    continue # no queried walk uses the stop
+                others = (base.origin_ids if to_stop else base.dest_ids)[candidates]
+                index = SpatialIndex([registry.locations[i][0] for i in others], [registry.locations[i][1] for i in others])
+                nearest, _ = index.query([location[0]], [location[1]], k=1)
+                row = candidates[nearest[0, 0]]
+                # great-circle distances [km] to the stop from the re-mapped location and from the location of the queried walk
+                stop_index = SpatialIndex([stop[0]], [stop[1]])
+                _, km = stop_index.query([location[0], registry.locations[others[nearest[0, 0]]][0]], [location[1], registry.locations[others[nearest[0, 0]]][1]], k=1)
+                if km[1, 0] > MIN_SCALED_KM:
+                    time_min, distance_km = base.time_min[row] * km[0, 0] / km[1, 0], base.distance_km[row] * km[0, 0] / km[1, 0]
+                else:
+                    if detour is None:
+                        origins, dests = np.array([registry.locations[i] for i in base.origin_ids]), np.array([registry.locations[i] for i in base.dest_ids])
+                        spans = chord_to_km(np.linalg.norm(unit_vectors(origins[:, 0], origins[:, 1]) - unit_vectors(dests[:, 0], dests[:, 1]), axis=1))
+                        valid = (spans > MIN_SCALED_KM) & (base.distance_km > 0)
+                        detour = float(np.median(base.distance_km[valid] / spans[valid])) if np.any(valid) else 1.0
+                        pace = float(np.median(base.time_min[valid] / base.distance_km[valid])) if np.any(valid) else 0.0
+                    distance_km = km[0, 0] * detour
+                    time_min = distance_km * pace
+                rows.append((time_min, distance_km, location_id if to_stop else stop_id, stop_id if to_stop else location_id))
+        if len(rows) == 0:
+            return (np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        time_min, distance_km, origin_ids, dest_ids = zip(*rows)
+        return (np.array(time_min), np.array(distance_km), np.array(origin_ids, dtype=np.int64), np.array(dest_ids, dtype=np.int64))
+
+    def compile_connection(self, connection: mp.MProfile) -> CompiledConnection:
+        """
+        Compiles a connection with the edits of this scenario applied; see `compile_keyed()`.
+        param: connection [MProfile] The specified connection
+        return: The edited `CompiledConnection`
+        """
+        return self.compile_keyed(connection)[1]
+
+    def compile_keyed(self, connection: mp.MProfile) -> tuple:
+        """
+        Compiles a connection with the edits of this scenario applied. Unchanged connections are the network's own compiled connections
+        and changed ones are cached on the network by the `signature()` of the connection's data and their edit signature, so they are 
+        re-compiled whenever the data changes. Like the network's compiled connections, only the `max_compiled` most recently used are held.
+        param: connection [MProfile] The specified connection
+        return: 2D tuple of the key of the edited connection and the edited `CompiledConnection`
+        """
+        base = self.network.compile_connection(connection)
+        dropped_ids, row_ids, scale = signature = self.signature(connection, base)
+        key = (connection.signature(), signature)
+        if len(dropped_ids) == 0 and len(row_ids) == 0 and scale == 1.0:
+            return key, base
+        cache = self.network.scenario_connections
+        if key in cache:
+            cache.move_to_end(key)
+        else:
+            # walks of re-mapped catchment locations to their new stops
+            time_min, distance_km, origin_ids, dest_ids = self.remapped_rows(connection, base)
+            time_min, distance_km = np.concatenate((base.time_min, time_min)), np.concatenate((base.distance_km, distance_km))
+            origin_ids, dest_ids = np.concatenate((base.origin_ids, origin_ids)), np.concatenate((base.dest_ids, dest_ids))
+            keep = ~(np.isin(origin_ids, list(dropped_ids)) | np.isin(dest_ids, list(dropped_ids)))
+            for origin_id, dest_id in row_ids:
+                keep &= ~(((origin_ids == origin_id) | (origin_id == -1)) & ((dest_ids == dest_id) | (dest_id == -1)))
+            cache[key] = CompiledConnection(time_min[keep] * scale, distance_km[keep], origin_ids[keep], dest_ids[keep])
+            # evict the least recently used edited connections
+            while len(cache) > max(1, self.network.max_compiled):
+                cache.popitem(last=False)
+        return key, cache[key]
+
+    def catchment_changes(self) -> list:
+        """
+        Re-maps the catchment locations of transit nodes whose nearest stop was closed onto the nearest remaining stop of the whole line, being
+        the stops a re-query of the scenario would use. Only transit nodes that lose a stop are recomputed, and only for the catchment locations
+        that used a closed stop. `evaluate()` does not wait for such a re-query: it re-maps onto the nearest remaining stop the node was
+        queried at (see `stop_remaps()`).
+        return: List of 4D tuples of (node_id, catchment location index, closed stop gps, nearest remaining stop gps)
+        """
+        changes = []
+        for node in self.network.nodes:
+            if node.catchment_node is None or node.transit_type is None:
+                continue
+            stops = self.network.transit_stops_gps(node.transit_type).get(node.transit_line, [])
+            if len(self.dropped_stops.intersection(stops)) == 0:
+                continue # this node keeps all of its stops
+            remaining = [stop for stop in stops if stop not in self.dropped_stops]
+            gps_catchment = [location.gps_coordinate for location in node.catchment_node.locations]
+            # nearest stops with every stop open are computed once per node and shared by all scenarios
+            if node.node_id not in self.network.scenario_catchments:
+                self.network.scenario_catchments[node.node_id] = node.get_closest_transit_stops(gps_list=gps_catchment, transit_stops={node.transit_line: stops}, type=node.transit_line)
+            nearest = self.network.scenario_catchments[node.node_id]
+            affected = [i for i in range(0, len(nearest)) if nearest[i] in self.dropped_stops]
+            if len(affected) == 0 or len(remaining) == 0:
+                continue
+            remapped = node.get_closest_transit_stops(gps_list=[gps_catchment[i] for i in affected], transit_stops={node.transit_line: remaining}, type=node.transit_line)
+            changes += [(node.node_id, i, nearest[i], stop) for i, stop in zip(affected, remapped)]
+        return changes
+
+    def evaluate(self, sample_id: str, connections: list, bin_width=(1.0, 0.1), quantiles: tuple=(0.05, 0.25, 0.5, 0.75, 0.95)):
+        """
+        Computes the exact trip time and distance distribution across the list of connections given under this scenario, as `exact_distribution()`
+        does for the unedited network. Distributions are cached on the network by the data and edit signature of every connection, so scenarios 
+        that do not change a chain re-use its distribution; only the `max_compiled` most recently used are held. Summary statistics are recorded on the network with the method `scenario_<name>`. Statistics
+        are of the trips that travel the whole chain; trips of a transit node that lost every queried stop end early, and the share of the
+        unedited network's trips that complete is reported as `completed_mass` with every statistic. If the edits leave no trip able to travel the whole chain, only
+        its `completed_mass` of zero is returned.
+        param: sample_id [str] The unique identifier for this distribution
+        param: connections [list] The list of `MProfile` connections to estimate trips from
+        param: bin_width [float] The histogram bin width for both metrics, or a 2D tuple of bin widths for time [min] and distance [km]
+        param: quantiles [tuple] The quantiles to compute from each distribution
+        return: The distribution dictionary, as returned by `exact_distribution()`
+        """
+        keys, compiled_connections = zip(*[self.compile_keyed(conn) for conn in connections])
+        compiled_connections = list(compiled_connections)
+        key = (keys, str(bin_width), tuple(quantiles))
+        cache = self.network.scenario_distributions
+        if key in cache:
+            cache.move_to_end(key)
+        else:
+            try:
+                distribution, summary = self.network.summarize_distribution([compiled_connections], None, bin_width, quantiles, method="exact")
+                # trips from start locations the edits leave without a first sub trip never start; they count as not completing, as
+                # a share of the trips of the unedited network
+                base = self.network.compile_connection(connections[0])
+                started = float(np.isin(base.origin_ids, compiled_connections[0].origin_ids).mean()) if len(base) > 0 else 1.0
+                distribution["completed_mass"] *= started
+                summary = [(method, metric, statistic, value * started if statistic == "completed_mass" else value) for method, metric, statistic, value in summary]
+                results = (distribution, summary)
+            except ValueError:
+                # the edits leave no way to travel the whole chain
+                results = ({"completed_mass": 0.0}, [("exact", "all", "completed_mass", 0.0)])
+            cache[key] = results
+            # evict the least recently used distributions
+            while len(cache) > max(1, self.network.max_compiled):
+                cache.popitem(last=False)
+        distribution, summary = cache[key]
+        # record results under this scenario's name
+        method = f"scenario_{self.name}"
+        self.distributions[sample_id] = distribution
+        self.summaries[sample_id] = [(method, metric, statistic, value) for _, metric, statistic, value in summary]
+        # statistics are conditioned on completing the chain; give the completed share with each metric's statistics
+        self.summaries[sample_id] += [(method, metric, "completed_mass", distribution["completed_mass"]) for metric in ("time_min", "distance_km") if metric in distribution]
+        self.network.sample_summaries[(sample_id, method)] = self.summaries[sample_id]
+        return distribution
@@ -0,0 +1,194 @@
+import numpy as np
+import heapq
+
+# mean earth radius [km] of great-circle distances
+EARTH_RADIUS_KM = 6371.0
+# largest number of points held by a leaf of the tree; leaves are searched by brute force
+LEAF_SIZE = 32
+
+def unit_vectors(lats, lons) -> np.ndarray:
+    """
+    Projects GPS coordinates onto the unit sphere. The straight-line (chord) distance between two projected points grows with their
+    great-circle distance, so nearest points by chord are nearest on the earth's surface at any latitude.
+    param: lats [np.ndarray] The specified latitudes
+    param: lons [np.ndarray] The specified longitudes
+    return: The (n x 3) array of unit vectors
+    """
+    lats, lons = np.radians(np.asarray(lats, dtype=np.float64)), np.radians(np.asarray(lons, dtype=np.float64))
+    return np.stack((np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)), axis=-1).reshape(-1, 3)
+
+def chord_to_km(chord: np.ndarray) -> np.ndarray:
+    """
+    param: chord [np.ndarray] The specified chord distances between unit vectors
+    return: The great-circle distances [km]
+    """
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.asarray(chord) / 2.0))
+
+def km_to_chord(km: float) -> float:
+    """
+    param: km [float] The specified great-circle distance [km]
+    return: The chord distance between unit vectors
+    """
+    return 2.0 * np.sin(min(np.pi / 2.0, km / (2.0 * EARTH_RADIUS_KM)))
+
+class SpatialIndex:
+    """
+    Represents a KD-tree over GPS points (e.g. transit stops) for nearest-point and radius lookups by great-circle distance. Points are
+    projected onto the unit sphere and split at the median of their widest axis until leaves hold at most `leaf_size` points; lookups
+    visit nodes closest first and skip every node whose bounding box is farther than the best points found so far. The tree is built once
+    and answers batches of lookups. Among equally close points, the one given first is taken.
+    """
+    def __init__(self, lats, lons, leaf_size: int=LEAF_SIZE):
+        """
+        Creates a `SpatialIndex` instance over the given points.
+        param: lats [np.ndarray] The latitudes of the points
+        param: lons [np.ndarray] The longitudes of the points
+        param: leaf_size [int] The largest number of points of a leaf
+        """
+        self.points = unit_vectors(lats, lons)
+        self.leaf_size = max(1, leaf_size)
+        self.order = np.arange(0, len(self.points), dtype=np.int64) # point indices grouped by node
+        # nodes of the tree; each node covers order[start:end], with its bounding box and children (-1 for leaves)
+        self.starts, self.ends, self.lows, self.highs, self.lefts, self.rights = [], [], [], [], [], []
+        if len(self.points) > 0:
+            self.build()
+        self.leaf_points = self.points[self.order] # points in node order, so a leaf's points are one slice
+        # bounding boxes as plain floats; boxes are compared one position at a time, where NumPy calls cost more than the arithmetic
+        self.boxes = [(tuple(low.tolist()), tuple(high.tolist())) for low, high in zip(self.lows, self.highs)]
+
+    def __len__(self):
+        return len(self.points)
+
+    def add_node(self, start: int, end: int) -> int:
+        """
+        Adds a node covering a run of the point order.
+        param: start [int] The first position of the node's points in the order
+        param: end [int] The position after the node's last point in the order
+        return: The identifier of the node
+        """
+        points = self.points[self.order[start:end]]
+        self.starts.append(start)
+        self.ends.append(end)
+        self.lows.append(points.min(axis=0))
+        self.highs.append(points.max(axis=0))
+        self.lefts.append(-1)
+        self.rights.append(-1)
+        return len(self.starts) - 1
+
+    def build(self):
+        """
+        Builds the tree, splitting nodes at the median of their widest axis.
+        """
+        stack = [self.add_node(0, len(self.points))]
+        while len(stack) > 0:
+            node = stack.pop()
+            start, end = self.starts[node], self.ends[node]
+            if end - start <= self.leaf_size:
+                continue
+            axis = int(np.argmax(self.highs[node] - self.lows[node]))
+            indices = self.order[start:end]
+            middle = (end - start) // 2
+            self.order[start:end] = indices[np.argpartition(self.points[indices, axis], middle)]
+            self.lefts[node] = self.add_node(start, start + middle)
+            self.rights[node] = self.add_node(start + middle, end)
+            stack.extend((self.lefts[node], self.rights[node]))
+
+    def box_distance(self, node: int, point: list) -> float:
+        """
+        param: node [int] The specified node
+        param: point [list] The specified unit vector
+        return: The squared chord distance from the point to the node's bounding box
+        """
+        squared = 0.0
+        for low, high, value in zip(self.boxes[node][0], self.boxes[node][1], point):
+            gap = low - value if value < low else (value - high if value > high else 0.0)
+            squared += gap * gap
+        return squared
+
+    def search(self, point: list, k: int, max_squared: float) -> tuple:
+        """
+        Finds the nearest points to one position.
+        param: point [list] The unit vector of the position
+        param: k [int] The largest number of points to find; `None` for every point within the cutoff
+        param: max_squared [float] The squared chord distance cutoff
+        return: 2D tuple of arrays of the point indices and squared chord distances, nearest first
+        """
+        best_indices, best_squared = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        heap = [(self.box_distance(0, point), 0)]
+        while len(heap) > 0:
+            box_squared, node = heapq.heappop(heap)
+            bound = best_squared[-1] if k is not None and len(best_squared) == k else max_squared
+            if box_squared > bound:
+                break # every node left is farther than the points found
+            if self.lefts[node] >= 0:
+                for child in (self.lefts[node], self.rights[node]):
+                    heapq.heappush(heap, (self.box_distance(child, point), child))
+                continue
+            indices = self.order[self.starts[node]:self.ends[node]]
+            offsets = self.leaf_points[self.starts[node]:self.ends[node]] - point
+            squared = np.einsum("ij,ij->i", offsets, offsets)
+            close = squared <= bound
+            best_indices, best_squared = np.concatenate((best_indices, indices[close])), np.concatenate((best_squared, squared[close]))
+            # nearest first; the point given first wins ties
+            ranked = np.lexsort((best_indices, best_squared))[:k]
+            best_indices, best_squared = best_indices[ranked], best_squared[ranked]
+        return best_indices, best_squared
+
+    def query(self, lats, lons, k: int=1, max_km: float=None) -> tuple:
+        """
+        Finds the `k` nearest points to each of a batch of positions.
+        param: lats [np.ndarray] The latitudes of the positions
+        param: lons [np.ndarray] The longitudes of the positions
+        param: k [int] The number of nearest points to find per position
+        param: max_km [float] Optional cutoff [km]; points farther away are not taken
+        return: 2D tuple of (n x k) arrays of point indices and great-circle distances [km], nearest first; `-1` and `inf` where fewer
+                than `k` points are within the cutoff
+        """
+        positions = unit_vectors(lats, lons)
+        indices = np.full((len(positions), k), -1, dtype=np.int64)
+        distances = np.full((len(positions), k), np.inf, dtype=np.float64)
+        if len(self.points) == 0:
+            return indices, distances
+        max_squared = km_to_chord(max_km) ** 2 if max_km is not None else np.inf
+        for i, point in enumerate(positions):
+            found, squared = self.search(point.tolist(), k, max_squared)
+            indices[i, :len(found)] = found
+            distances[i, :len(found)] = chord_to_km(np.sqrt(squared))
+        return indices, distances
+
+    def within(self, lats, lons, radius_km: float) -> list:
+        """
+        Finds every point within a radius of each of a batch of positions.
+        param: lats [np.ndarray] The latitudes of the positions
+        param: lons [np.ndarray] The longitudes of the positions
+        param: radius_km [float] The radius [km]
+        return: The list of 2D tuples of arrays of the point indices and great-circle distances [km] of each position, nearest first
+        """
+        positions = unit_vectors(lats, lons)
+        if len(self.points) == 0:
+            return [(np.zeros(0, dtype=np.int64), np.zeros(0)) for _ in range(0, len(positions))]
+        max_squared = km_to_chord(radius_km) ** 2
+        results = []
+        for point in positions:
+            found, squared = self.search(point.tolist(), None, max_squared)
+            results.append((found, chord_to_km(np.sqrt(squared))))
+        return results
+
+# spatial indices shared by all nodes; mapped by (transit type, line) to 2D tuples of (stop list indexed, `SpatialIndex`)
+TRANSIT_STOP_INDICES = {}
+
+def transit_stop_index(transit_type, line, stops: list) -> SpatialIndex:
+    """
+    Gets the spatial index of the stops of a transit line, built on first use and shared by every node that looks up the same line.
+    The index is rebuilt if a different list of stops is given for the line.
+    param: transit_type [mp.transit_mode] The type of transit of the line
+    param: line [str] The specified line (e.g. "all" or "M1")
+    param: stops [list] The (lat, lon) of each stop of the line
+    return: The `SpatialIndex` of the stops
+    """
+    key = (transit_type, line)
+    cached = TRANSIT_STOP_INDICES.get(key)
+    if cached is None or cached[0] is not stops:
+        cached = (stops, SpatialIndex([stop[0] for stop in stops], [stop[1] for stop in stops]))
+        TRANSIT_STOP_INDICES[key] = cached
+    return cached[1]
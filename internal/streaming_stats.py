@@ -0,0 +1,121 @@
+from statistics import NormalDist
+import numpy as np
+
+class QuantileSketch:
+    """
+    Represents a mergeable, constant-memory sketch of a stream of values for estimating quantiles. Values are counted in fixed-width
+    bins, so memory is bounded by the range of the values over the resolution and every quantile is within one resolution of the exact one.
+    Values that already lie on the bin grid (e.g. whole minutes) give exact quantiles.
+    """
+    def __init__(self, resolution: float):
+        """
+        Creates an empty `QuantileSketch` instance.
+        param: resolution [float] The width of the counting bins
+        """
+        self.resolution = resolution
+        self.bin_counts = {} # mapping of bin index to the number of values in the bin
+        self.n = 0
+
+    def update(self, values: np.ndarray):
+        """
+        Adds a batch of values to the sketch.
+        param: values [np.ndarray] The specified values
+        """
+        bins, counts = np.unique(np.floor(np.asarray(values) / self.resolution).astype(np.int64), return_counts=True)
+        for bin, count in zip(bins.tolist(), counts.tolist()):
+            self.bin_counts[bin] = self.bin_counts.get(bin, 0) + count
+        self.n += len(values)
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile of the values added so far.
+        param: q [float] The specified quantile in [0, 1]
+        return: The lower edge of the bin holding the quantile
+        """
+        if self.n == 0:
+            return float("nan")
+        bins = np.array(sorted(self.bin_counts.keys()))
+        cumulative = np.cumsum([self.bin_counts[bin] for bin in bins])
+        index = min(len(bins) - 1, int(np.searchsorted(cumulative, max(0.0, min(1.0, q)) * self.n)))
+        return float(bins[index] * self.resolution)
+
+    def spacing(self, value: float) -> float:
+        """
+        Finds how finely values are spread around a value; the smaller gap from its bin to the nearest bin below or above holding values.
+        Data on a coarser grid than the resolution (e.g. whole minutes) has the spacing of its grid.
+        param: value [float] The specified value (e.g. an estimated quantile)
+        return: The spacing; the resolution if no other bin holds values
+        """
+        bins = np.array(sorted(self.bin_counts.keys()))
+        bin = int(np.floor(value / self.resolution + 0.5))
+        gaps = np.abs(bins[bins != bin] - bin)
+        return float(max(1, gaps.min()) * self.resolution) if len(gaps) > 0 else self.resolution
+
+class StreamingStatistics:
+    """
+    Represents running estimates of the mean, variance, and quantiles of a stream of values fed in batches. The mean and variance are kept
+    with Welford's method (merged batch by batch) and the quantiles with a `QuantileSketch`, so memory does not grow with the stream.
+    """
+    def __init__(self, resolution: float):
+        """
+        Creates an empty `StreamingStatistics` instance.
+        param: resolution [float] The resolution of the quantile sketch
+        """
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0 # sum of squared differences from the mean
+        self.sketch = QuantileSketch(resolution)
+
+    def update(self, values: np.ndarray):
+        """
+        Adds a batch of values to the running estimates.
+        param: values [np.ndarray] The specified values
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        # merge the batch mean and squared differences into the running ones
+        batch_n, batch_mean = len(values), float(values.mean())
+        batch_m2 = float(((values - batch_mean) ** 2).sum())
+        total = self.n + batch_n
+        delta = batch_mean - self.mean
+        self.mean += delta * batch_n / total
+        self.m2 += batch_m2 + delta * delta * self.n * batch_n / total
+        self.n = total
+        self.sketch.update(values)
+
+    def variance(self) -> float:
+        """
+        return: The sample variance of the values added so far
+        """
+        return self.m2 / (self.n - 1) if self.n > 1 else float("nan")
+
+    def estimate(self, statistic: str) -> float:
+        """
+        Gets the current estimate of a statistic.
+        param: statistic [str] Either `mean` or a quantile written as `q` and its value (e.g. `q0.5`)
+        return: The estimate
+        """
+        if statistic == "mean":
+            return self.mean
+        return self.sketch.quantile(float(statistic[1:]))
+
+    def confidence_interval(self, statistic: str, confidence: float) -> float:
+        """
+        Estimates the half-width of the confidence interval of a statistic. The mean uses the normal approximation; quantiles use the
+        distribution-free binomial bounds on the rank of the quantile. Both bounds of a quantile fall on the same value when many values
+        tie (e.g. times in whole minutes), which only says that the quantile is closer to that value than to its neighbours, so the
+        half-width of a quantile is at least half the spacing of the values around it.
+        param: statistic [str] Either `mean` or a quantile written as `q` and its value (e.g. `q0.5`)
+        param: confidence [float] The confidence level (e.g. 0.95)
+        return: The half-width of the confidence interval
+        """
+        if self.n < 2:
+            return float("inf")
+        z = NormalDist().inv_cdf(0.5 + confidence / 2.0)
+        if statistic == "mean":
+            return z * (self.variance() / self.n) ** 0.5
+        q = float(statistic[1:])
+        rank_error = z * (q * (1.0 - q) / self.n) ** 0.5
+        half_width = (self.sketch.quantile(q + rank_error) - self.sketch.quantile(q - rank_error)) / 2.0
+        return max(half_width, self.sketch.spacing(self.sketch.quantile(q)) / 2.0)
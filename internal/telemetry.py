@@ -0,0 +1,182 @@
+import threading
+import json
+import time
+
+# providers that a network query calls
+GEOCODE_PROVIDER = "nominatim"
+DISTANCE_MATRIX_PROVIDER = "distancematrix"
+OVERPASS_PROVIDER = "overpass"
+# upper bounds [s] of the latency histogram buckets; the last bucket holds every slower call
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+
+class Telemetry:
+    """
+    Represents the thread-safe telemetry of the network I/O of a query. Every HTTP call to a provider is recorded with its latency, size,
+    and whether it failed, and every request's use of the provider is recorded per connection it serves, with the elements (billed
+    origin-destination pairs, geocoded locations, etc.) it used and whether its data could be used. Latencies are kept as histograms, so
+    recording is constant-time and memory is fixed however long a query runs. Planned requests are counted as they are queued, which gives
+    a live progress line with the throughput and the expected time left. The report can be exported as JSON to tune concurrency and rate
+    limits from real data.
+    """
+    def __init__(self, quotas: dict=None, progress_interval: float=1.0):
+        """
+        Creates an empty `Telemetry` instance.
+        param: quotas [dict] Optional mapping of providers to the number of elements the plan allows; the report gives the share used
+        param: progress_interval [float] The least time [s] between updates of the progress line; `None` shows no progress line
+        """
+        self.quotas = quotas if quotas is not None else {}
+        self.progress_interval = progress_interval
+        self.started = time.monotonic()
+        self.providers = {} # mapping of providers to dictionaries of counters
+        self.connections = {} # mapping of connection identifiers to dictionaries of counters
+        self.last_progress = 0.0 # time the progress line was last shown
+        self.showing_progress = False # whether a progress line is on screen
+        self.lock = threading.Lock()
+
+    def provider(self, provider: str) -> dict:
+        """
+        param: provider [str] The specified provider
+        return: The counters of the provider, created if needed; call while holding the lock
+        """
+        if provider not in self.providers:
+            self.providers[provider] = {"calls": 0, "http_errors": 0, "bytes": 0, "latency_sum": 0.0, "latency_min": None, "latency_max": None,
+                                        "latency_histogram": [0] * len(LATENCY_BUCKETS), "requests": 0, "failed_requests": 0, "elements": 0,
+                                        "planned": 0, "first": None, "last": None}
+        return self.providers[provider]
+
+    def record_call(self, provider: str, latency: float, size: int, success: bool):
+        """
+        Records an HTTP call to a provider.
+        param: provider [str] The specified provider
+        param: latency [float] The time [s] from sending the call to reading the whole response
+        param: size [int] The number of bytes of the response
+        param: success [bool] Whether the provider answered without an error status or connection error
+        """
+        now = time.monotonic()
+        with self.lock:
+            stats = self.provider(provider)
+            stats["calls"] += 1
+            stats["http_errors"] += 0 if success else 1
+            stats["bytes"] += size
+            stats["latency_sum"] += latency
+            stats["latency_min"] = latency if stats["latency_min"] is None else min(stats["latency_min"], latency)
+            stats["latency_max"] = latency if stats["latency_max"] is None else max(stats["latency_max"], latency)
+            stats["latency_histogram"][next(k for k, bound in enumerate(LATENCY_BUCKETS) if latency <= bound)] += 1
+            stats["first"] = now - latency if stats["first"] is None else stats["first"]
+            stats["last"] = now
+
+    def expect(self, provider: str, requests: int):
+        """
+        Counts requests queued for a provider, so progress can be measured against them.
+        param: provider [str] The specified provider
+        param: requests [int] The number of requests queued
+        """
+        with self.lock:
+            self.provider(provider)["planned"] += requests
+
+    def record_request(self, provider: str, elements: int, success: bool, connections: dict=None):
+        """
+        Records the use of a provider by one request and updates the progress line.
+        param: provider [str] The specified provider
+        param: elements [int] The number of elements the request used
+        param: success [bool] Whether the request's data could be used
+        param: connections [dict] Optional mapping of the identifiers of the connections the request serves to the number of their cells in it
+        """
+        with self.lock:
+            stats = self.provider(provider)
+            stats["requests"] += 1
+            stats["failed_requests"] += 0 if success else 1
+            stats["elements"] += elements
+            for conn_id, cells in (connections if connections is not None else {}).items():
+                counts = self.connections.setdefault(conn_id, {"provider": provider, "requests": 0, "failed_requests": 0, "cells": 0, "failed_cells": 0})
+                counts["requests"] += 1
+                counts["failed_requests"] += 0 if success else 1
+                counts["cells"] += cells
+                counts["failed_cells"] += 0 if success else cells
+        self.show_progress()
+
+    def progress(self) -> str:
+        """
+        return: The progress line of every provider with queued requests; done and queued requests, throughput, and expected time left
+        """
+        parts = []
+        with self.lock:
+            for provider, stats in self.providers.items():
+                if stats["planned"] == 0:
+                    continue
+                elapsed = max(1e-9, time.monotonic() - (stats["first"] if stats["first"] is not None else self.started))
+                rate = stats["requests"] / elapsed
+                left = max(0, stats["planned"] - stats["requests"])
+                eta = f"{left / rate:.0f}s" if rate > 0 else "?"
+                parts.append(f"{provider} {stats['requests']}/{stats['planned']} ({100.0 * stats['requests'] / stats['planned']:.0f}%) "
+                             f"{rate:.1f} req/s {stats['elements'] / elapsed:.0f} elements/s ETA {eta}")
+        return "QUERYING: PROGRESS " + " | ".join(parts)
+
+    def show_progress(self, force: bool=False):
+        """
+        Rewrites the progress line in place if `progress_interval` has passed since it was last shown.
+        param: force [bool] Whether to show the line however recently it was shown
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self.progress_interval is None or (not force and now - self.last_progress < self.progress_interval):
+                return
+            self.last_progress = now
+            self.showing_progress = True
+        print(f"\r{self.progress()}", end="", flush=True)
+
+    def end_progress(self):
+        """
+        Shows the final progress line and ends it, so following output starts on a new line.
+        """
+        if self.showing_progress:
+            self.show_progress(force=True)
+            print()
+            self.showing_progress = False
+
+    def report(self) -> dict:
+        """
+        return: The dictionary of the telemetry of each provider and connection. Providers report their calls, HTTP errors, bytes, latency
+                (mean, minimum, maximum, percentiles estimated from the histogram, and the histogram), requests, failed requests and their share,
+                elements, throughput, and quota use; connections report their requests and cells, with those that failed
+        """
+        providers = {}
+        with self.lock:
+            for provider, stats in self.providers.items():
+                elapsed = (stats["last"] - stats["first"]) if stats["first"] is not None else 0.0
+                histogram = stats["latency_histogram"]
+                def percentile(q: float):
+                    """
+                    param: q [float] The specified quantile
+                    return: The upper bound [s] of the histogram bucket the quantile falls in, at most the slowest call; `None` if there are no calls
+                    """
+                    target, seen = q * stats["calls"], 0
+                    for bound, count in zip(LATENCY_BUCKETS, histogram):
+                        seen += count
+                        if count > 0 and seen >= target:
+                            return min(bound, stats["latency_max"])
+                    return None
+                quota = self.quotas.get(provider)
+                providers[provider] = {
+                    "calls": stats["calls"], "http_errors": stats["http_errors"], "bytes": stats["bytes"],
+                    "latency": {"mean": stats["latency_sum"] / stats["calls"] if stats["calls"] > 0 else None, "min": stats["latency_min"], "max": stats["latency_max"],
+                                "p50": percentile(0.5), "p90": percentile(0.9), "p99": percentile(0.99),
+                                "histogram": {str(bound): count for bound, count in zip(LATENCY_BUCKETS, histogram)}},
+                    "requests": stats["requests"], "failed_requests": stats["failed_requests"],
+                    "error_rate": stats["failed_requests"] / stats["requests"] if stats["requests"] > 0 else 0.0,
+                    "elements": stats["elements"], "seconds": elapsed,
+                    "requests_per_second": stats["calls"] / elapsed if elapsed > 0 else None,
+                    "elements_per_second": stats["elements"] / elapsed if elapsed > 0 else None,
+                    "bytes_per_second": stats["bytes"] / elapsed if elapsed > 0 else None,
+                    "quota": None if quota is None else {"elements": quota, "used": stats["elements"] / quota if quota > 0 else None, "left": quota - stats["elements"]},
+                }
+            connections = {conn_id: dict(counts) for conn_id, counts in self.connections.items()}
+        return {"seconds": time.monotonic() - self.started, "providers": providers, "connections": connections}
+
+    def export(self, file: str):
+        """
+        Writes the report as JSON.
+        param: file [str] The specified file
+        """
+        with open(file, "w") as telemetry_file:
+            json.dump(self.report(), telemetry_file, indent=2)
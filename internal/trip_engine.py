@@ -0,0 +1,417 @@
+import internal.kernels as kernels
+import numpy as np
+import csv
+
+class LocationRegistry:
+    """
+    Represents the shared table of GPS locations that sub trips start and end at. Each distinct (lat, lon) coordinate is
+    given an integer location identifier, so sub trips can be chained across connections by comparing identifiers
+    instead of comparing float coordinates.
+    """
+    def __init__(self):
+        """
+        Creates an empty `LocationRegistry` instance.
+        """
+        self.location_ids = {} # mapping of (lat, lon) coordinates to location identifiers
+        self.locations = [] # list of (lat, lon) coordinates ordered by location identifier
+
+    def register(self, lat: float, lon: float) -> int:
+        """
+        Finds the location identifier of a GPS coordinate; unseen coordinates are given the next free identifier.
+        param: lat [float] The specified latitude
+        param: lon [float] The specified longitude
+        return: The location identifier
+        """
+        key = (lat, lon)
+        location_id = self.location_ids.get(key)
+        if location_id is None:
+            location_id = len(self.locations)
+            self.location_ids[key] = location_id
+            self.locations.append(key)
+        return location_id
+
+    def register_all(self, lats: list, lons: list) -> np.ndarray:
+        """
+        Finds the location identifiers of a list of GPS coordinates.
+        param: lats [list] The specified latitudes
+        param: lons [list] The specified longitudes
+        return: The array of location identifiers in the same order as the given coordinates
+        """
+        return np.fromiter((self.register(lat, lon) for lat, lon in zip(lats, lons)), dtype=np.int64, count=len(lats))
+
+    def gps(self, location_id: int) -> tuple:
+        """
+        Gets the GPS coordinate of a location identifier.
+        param: location_id [int] The specified location identifier
+        return: The 2D tuple of (lat, lon)
+        """
+        return self.locations[location_id]
+
+    def __len__(self):
+        return len(self.locations)
+
+    def write(self, file: str):
+        """
+        Writes the location table to a file as rows of (location_id, lat, lon).
+        param: file [str] The specified file
+        """
+        with open(file, "w") as location_file:
+            location_file.write("location_id,lat,lon\n")
+            location_file.writelines(f"{location_id},{lat},{lon}\n" for location_id, (lat, lon) in enumerate(self.locations))
+
+    def read(self, file: str):
+        """
+        Reads a location table written by `write()` into this empty registry; the identifiers in the file are kept. 
+        param: file [str] The specified file
+        """
+        with open(file, newline='') as location_file:
+            reader = csv.reader(location_file)
+            next(reader)
+            for record in reader:
+                self.locations.append((float(record[1]), float(record[2])))
+                self.location_ids[self.locations[-1]] = int(record[0])
+
+# names of the arrays that make up a compiled connection
+COMPILED_ARRAYS = ["time_min", "distance_km", "origin_ids", "dest_ids", "origin_index", "origin_starts", "origin_counts"]
+# header of sampled trip results files, see `write_trips()`
+TRIPS_HEADER = "sample_id,time_min,distance_km,location_ids,departure_slot"
+
+class CompiledConnection:
+    """
+    Represents the sub trips of one connection compiled into NumPy arrays. Rows are sorted by origin location identifier so
+    all sub trips leaving a location form one contiguous block of rows, found through the origin index rather than by
+    scanning every sub trip.
+    """
+    def __init__(self, time_min: np.ndarray, distance_km: np.ndarray, origin_ids: np.ndarray, dest_ids: np.ndarray):
+        """
+        Creates a `CompiledConnection` instance from column arrays of sub trip data.
+        param: time_min [np.ndarray] The time [min] of each sub trip
+        param: distance_km [np.ndarray] The distance [km] of each sub trip
+        param: origin_ids [np.ndarray] The origin location identifier of each sub trip
+        param: dest_ids [np.ndarray] The destination location identifier of each sub trip
+        """
+        # stable sort keeps the original row order within each origin block
+        order = np.argsort(origin_ids, kind="stable")
+        self.time_min = np.asarray(time_min, dtype=np.float64)[order]
+        self.distance_km = np.asarray(distance_km, dtype=np.float64)[order]
+        self.origin_ids = np.asarray(origin_ids, dtype=np.int64)[order]
+        self.dest_ids = np.asarray(dest_ids, dtype=np.int64)[order]
+        # origin index; sorted unique origins with the first row and number of rows of each origin block
+        self.origin_index, self.origin_starts, self.origin_counts = np.unique(self.origin_ids, return_index=True, return_counts=True)
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> 'CompiledConnection':
+        """
+        Creates a `CompiledConnection` instance from the arrays of an already compiled connection without copying or sorting them again 
+        (e.g. arrays placed in shared memory). 
+        param: arrays [dict] The compiled arrays mapped by their attribute names in `COMPILED_ARRAYS`
+        return: The compiled connection
+        """
+        compiled = cls.__new__(cls)
+        for name in COMPILED_ARRAYS:
+            setattr(compiled, name, arrays[name])
+        return compiled
+
+    def __len__(self):
+        return len(self.time_min)
+
+    def blocks(self, location_ids: np.ndarray):
+        """
+        Looks up the block of sub trips leaving each of the given locations. Locations without sub trips have a count of zero.
+        param: location_ids [np.ndarray] The specified origin location identifiers
+        return: 2D tuple of arrays of the first row and row count of each location's block
+        """
+        if len(self.origin_index) == 0:
+            no_rows = np.zeros(len(location_ids), dtype=np.int64)
+            return no_rows, no_rows
+        positions = np.minimum(np.searchsorted(self.origin_index, location_ids), len(self.origin_index) - 1)
+        found = self.origin_index[positions] == location_ids
+        return np.where(found, self.origin_starts[positions], 0), np.where(found, self.origin_counts[positions], 0)
+
+    def draw(self, prev_location_ids: np.ndarray, u: np.ndarray):
+        """
+        Draws one sub trip per trip, uniformly from the sub trips leaving each trip's previous location. 
+        Trips whose previous location has no sub trips leaving it are dead ends and are flagged as not alive.
+        param: prev_location_ids [np.ndarray] The location each trip left off at; `None` draws from all sub trips for the first connection
+        param: u [np.ndarray] Uniform random numbers in [0, 1), one per trip
+        return: 2D tuple of the array of drawn row indices and the boolean array of trips that are still alive
+        """
+        if prev_location_ids is None:
+            # first connection; choose from all sub trips
+            return np.minimum((u * len(self)).astype(np.int64), len(self) - 1), np.ones(len(u), dtype=bool)
+        # uniform choice within each block; runs on the selected kernel backend
+        return kernels.draw_rows(self.origin_index, self.origin_starts, self.origin_counts, prev_location_ids, u)
+
+class SampledTrips:
+    """
+    Represents a sample of trips stored as compact arrays: the time [min] and distance [km] of each trip and the visited locations 
+    of each trip as small integer location identifiers into a `LocationRegistry`. GPS coordinates are only resolved when asked for, 
+    and indexing or iterating gives the 4D tuples of (sample_id, time_min, distance_km, list of visited gps locations) used before. 
+    """
+    def __init__(self, sample_id: str, time_min: np.ndarray, distance_km: np.ndarray, location_ids: np.ndarray, registry: LocationRegistry, 
+                 departure_slots: np.ndarray=None):
+        """
+        Creates a `SampledTrips` instance.
+        param: sample_id [str] The unique identifier of the sample
+        param: time_min [np.ndarray] The time [min] of each trip
+        param: distance_km [np.ndarray] The distance [km] of each trip
+        param: location_ids [np.ndarray] The (n x legs+1) array of visited location identifiers of each trip
+        param: registry [LocationRegistry] The registry the location identifiers belong to
+        param: departure_slots [np.ndarray] Optional departure time slot of each trip, for trips across a `DepartureSweep`
+        """
+        self.sample_id = sample_id
+        self.time_min = np.asarray(time_min, dtype=np.float64)
+        self.distance_km = np.asarray(distance_km, dtype=np.float64)
+        self.location_ids = np.asarray(location_ids, dtype=np.int32)
+        self.registry = registry
+        self.departure_slots = np.asarray(departure_slots, dtype=np.int32) if departure_slots is not None else None
+
+    @classmethod
+    def concatenate(cls, sample_id: str, parts: list, registry: LocationRegistry, legs: int) -> 'SampledTrips':
+        """
+        Joins batches of sampled trip arrays into one `SampledTrips` instance.
+        param: sample_id [str] The unique identifier of the sample
+        param: parts [list] The tuples of (time [min], distance [km], visited location identifiers) arrays of each batch in order, optionally 
+                            followed by the departure slot of each trip (`None` without departure slots)
+        param: registry [LocationRegistry] The registry the location identifiers belong to
+        param: legs [int] The number of connections each trip travels across
+        return: The joined trips
+        """
+        if len(parts) == 0:
+            return cls(sample_id, np.zeros(0), np.zeros(0), np.zeros((0, legs + 1 if legs > 0 else 0)), registry)
+        departure_slots = np.concatenate([part[3] for part in parts]) if len(parts[0]) > 3 and parts[0][3] is not None else None
+        return cls(sample_id, np.concatenate([part[0] for part in parts]), np.concatenate([part[1] for part in parts]), np.concatenate([part[2] for part in parts]), registry, 
+                   departure_slots)
+
+    def gps(self, i: int) -> list:
+        """
+        Resolves the GPS coordinates of the locations visited by a trip.
+        param: i [int] The specified trip index
+        return: The list of visited (lat, lon) coordinates in travel order
+        """
+        return [self.registry.gps(location_id) for location_id in self.location_ids[i].tolist()]
+
+    def __len__(self):
+        return len(self.time_min)
+
+    def __getitem__(self, i: int) -> tuple:
+        return (self.sample_id, float(self.time_min[i]), float(self.distance_km[i]), self.gps(i))
+
+    def __iter__(self):
+        for i in range(0, len(self)):
+            yield self[i]
+
+def compile_connection(rows: list, registry: LocationRegistry) -> CompiledConnection:
+    """
+    Compiles a connection's sub trips into a `CompiledConnection`.
+    param: rows [list] The 6D tuples of (time [min], distance [km], origin_lat, origin_lon, dest_lat, dest_lon) given by `MProfile.get()`
+    param: registry [LocationRegistry] The registry that location identifiers are shared through
+    return: The compiled connection
+    """
+    n = len(rows)
+    time_min = np.fromiter((row[0] for row in rows), dtype=np.float64, count=n)
+    distance_km = np.fromiter((row[1] for row in rows), dtype=np.float64, count=n)
+    origin_ids = registry.register_all([row[2] for row in rows], [row[3] for row in rows])
+    dest_ids = registry.register_all([row[4] for row in rows], [row[5] for row in rows])
+    return CompiledConnection(time_min, distance_km, origin_ids, dest_ids)
+
+def check_chain(compiled_connections: list):
+    """
+    Checks that at least one trip can travel across the whole chain of compiled connections, walking back from the last connection 
+    to find the locations that can still reach the end of the chain. 
+    param: compiled_connections [list] The `CompiledConnection` of each leg in travel order
+    """
+    reachable_origins = None # origin locations of the next leg that can finish the chain
+    for leg in range(len(compiled_connections) - 1, -1, -1):
+        compiled = compiled_connections[leg]
+        rows_ok = np.ones(len(compiled), dtype=bool) if reachable_origins is None else np.isin(compiled.dest_ids, reachable_origins)
+        if not np.any(rows_ok):
+            raise ValueError(f"no trips can be sampled; no sub trip of leg {leg} continues to the end of the connection chain")
+        reachable_origins = np.unique(compiled.origin_ids[rows_ok])
+
+def sample_chain(compiled_connections: list, n: int, rng: np.random.Generator):
+    """
+    Samples `n` trips across a chain of compiled connections, drawing all trips of a connection in one batched step. 
+    Trips that reach a location with no sub trips leaving it on the next connection are dead ends; these are re-drawn from the 
+    start so that every returned trip travels the whole chain. 
+    param: compiled_connections [list] The `CompiledConnection` of each leg in travel order
+    param: n [int] The number of trips to sample
+    param: rng [np.random.Generator] The random number generator to draw with
+    return: 3D tuple of trip time [min], trip distance [km], and an (n x legs+1) array of visited location identifiers
+    """
+    legs = len(compiled_connections)
+    time_min = np.zeros(n, dtype=np.float64)
+    distance_km = np.zeros(n, dtype=np.float64)
+    location_ids = np.zeros((n, legs + 1 if legs > 0 else 0), dtype=np.int64)
+    if legs == 0 or n == 0:
+        return time_min, distance_km, location_ids
+    check_chain(compiled_connections)
+
+    filled = 0 # number of completed trips
+    while filled < n:
+        m = n - filled # trips still needed
+        batch_time, batch_distance = np.zeros(m, dtype=np.float64), np.zeros(m, dtype=np.float64)
+        batch_locations = np.zeros((m, legs + 1), dtype=np.int64)
+        alive = np.ones(m, dtype=bool)
+        prev_location_ids = None
+        for leg, compiled in enumerate(compiled_connections):
+            rows, leg_alive = compiled.draw(prev_location_ids, rng.random(m))
+            alive &= leg_alive
+            batch_time += compiled.time_min[rows]
+            batch_distance += compiled.distance_km[rows]
+            # record the origin once for the first connection; destinations for every connection
+            if leg == 0:
+                batch_locations[:, 0] = compiled.origin_ids[rows]
+            prev_location_ids = compiled.dest_ids[rows]
+            batch_locations[:, leg + 1] = prev_location_ids
+        # keep completed trips in the order they were drawn
+        completed = np.flatnonzero(alive)
+        time_min[filled:filled + len(completed)] = batch_time[completed]
+        distance_km[filled:filled + len(completed)] = batch_distance[completed]
+        location_ids[filled:filled + len(completed)] = batch_locations[completed]
+        filled += len(completed)
+    return time_min, distance_km, location_ids
+
+def sample_slots(slot_chains: list, slots: np.ndarray, rng: np.random.Generator):
+    """
+    Samples trips that each depart in a given time slot, where every slot has its own chain of compiled connections. The trips of a 
+    slot are drawn together in one `sample_chain()` call and placed back at their positions, so trips keep the order of their slots.
+    param: slot_chains [list] The list of `CompiledConnection` chains of each slot, in travel order
+    param: slots [np.ndarray] The departure slot of each trip
+    param: rng [np.random.Generator] The random number generator to draw with
+    return: 3D tuple of trip time [min], trip distance [km], and an (n x legs+1) array of visited location identifiers
+    """
+    n = len(slots)
+    legs = len(slot_chains[0]) if len(slot_chains) > 0 else 0
+    time_min = np.zeros(n, dtype=np.float64)
+    distance_km = np.zeros(n, dtype=np.float64)
+    location_ids = np.zeros((n, legs + 1 if legs > 0 else 0), dtype=np.int64)
+    for slot, chain in enumerate(slot_chains):
+        trips = np.flatnonzero(slots == slot)
+        if len(trips) == 0:
+            continue
+        time_min[trips], distance_km[trips], location_ids[trips] = sample_chain(chain, len(trips), rng)
+    return time_min, distance_km, location_ids
+
+def sample_departures(slot_chains: list, slot_weights: np.ndarray, n: int, rng: np.random.Generator):
+    """
+    Samples trips across the chains of compiled connections of departure time slots, drawing the departure slot of every trip from the 
+    slot weights first. Without slot weights there is one chain, which is sampled as `sample_chain()` does. 
+    param: slot_chains [list] The list of `CompiledConnection` chains of each slot, in travel order
+    param: slot_weights [np.ndarray] The chance of departing in each slot, or `None` for a single chain without departure slots
+    param: n [int] The number of trips to sample
+    param: rng [np.random.Generator] The random number generator to draw with
+    return: 4D tuple of trip time [min], trip distance [km], an (n x legs+1) array of visited location identifiers, and the departure 
+            slot of each trip (`None` without slot weights)
+    """
+    if slot_weights is None:
+        return (*sample_chain(slot_chains[0], n, rng), None)
+    slots = rng.choice(len(slot_weights), size=n, p=slot_weights)
+    return (*sample_slots(slot_chains, slots, rng), slots)
+
+def chain_distribution(compiled_connections: list, bin_widths: tuple, num_locations: int):
+    """
+    Computes the exact distribution of trip time and distance summed across a chain of compiled connections. Every leg is a uniform 
+    choice among the sub trips leaving the previous location, so the probability mass at each location is carried forward leg by leg 
+    (dynamic programming over locations) while histograms of the running sums are shifted and added (histogram convolution). 
+    Moments are carried exactly; histograms round each sub trip to the nearest bin. Mass that reaches a dead end is dropped and the 
+    results are conditioned on completing the chain, matching `sample_chain`. 
+    param: compiled_connections [list] The `CompiledConnection` of each leg in travel order
+    param: bin_widths [tuple] The 2D tuple of histogram bin widths for time [min] and distance [km]
+    param: num_locations [int] The number of location identifiers in the shared `LocationRegistry`
+    return: 2D tuple of the completed probability mass and a list of (pmf, mean, variance) for time and distance
+    """
+    check_chain(compiled_connections)
+    results = []
+    completed_mass = 0.0
+    for metric, bin_width in enumerate(bin_widths):
+        # per location: probability mass, first and second raw moments (unnormalized), and histogram of the running sum
+        mass = np.zeros(num_locations, dtype=np.float64)
+        moment_1 = np.zeros(num_locations, dtype=np.float64)
+        moment_2 = np.zeros(num_locations, dtype=np.float64)
+        histogram = np.zeros((num_locations, 1), dtype=np.float64)
+        for leg, compiled in enumerate(compiled_connections):
+            values = compiled.time_min if metric == 0 else compiled.distance_km
+            shifts = np.rint(values / bin_width).astype(np.int64)
+            # weight of each sub trip; the first connection is a uniform choice over all of its sub trips
+            if leg == 0:
+                row_mass = np.full(len(compiled), 1.0 / len(compiled))
+                row_moment_1, row_moment_2 = np.zeros(len(compiled)), np.zeros(len(compiled))
+                row_histogram = np.zeros((len(compiled), 1))
+                row_histogram[:, 0] = row_mass
+            else:
+                _, counts = compiled.blocks(compiled.origin_ids)
+                share = 1.0 / counts # every sub trip leaving a location takes an equal share of its mass
+                row_mass = mass[compiled.origin_ids] * share
+                row_moment_1 = moment_1[compiled.origin_ids] * share
+                row_moment_2 = moment_2[compiled.origin_ids] * share
+                row_histogram = histogram[compiled.origin_ids] * share[:, None]
+            # carry mass and moments to the destination of each sub trip, adding the sub trip's value
+            mass = np.bincount(compiled.dest_ids, weights=row_mass, minlength=num_locations)
+            next_moment_2 = row_moment_2 + 2.0 * values * row_moment_1 + values * values * row_mass
+            moment_1 = np.bincount(compiled.dest_ids, weights=row_moment_1 + values * row_mass, minlength=num_locations)
+            moment_2 = np.bincount(compiled.dest_ids, weights=next_moment_2, minlength=num_locations)
+            # shift each sub trip's histogram by its binned value and add into its destination
+            width = row_histogram.shape[1]
+            histogram = np.zeros((num_locations, width + int(shifts.max())), dtype=np.float64)
+            for shift in np.unique(shifts):
+                rows = np.flatnonzero(shifts == shift)
+                np.add.at(histogram[:, shift:shift + width], compiled.dest_ids[rows], row_histogram[rows])
+        # condition on completing the chain
+        completed_mass = mass.sum()
+        mean = moment_1.sum() / completed_mass
+        variance = max(0.0, moment_2.sum() / completed_mass - mean * mean)
+        results.append((histogram.sum(axis=0) / completed_mass, mean, variance))
+    return completed_mass, results
+
+def slot_distribution(slot_chains: list, slot_weights: np.ndarray, bin_widths: tuple, num_locations: int):
+    """
+    Computes the exact distribution of trip time and distance across the chains of compiled connections of departure time slots. Every 
+    trip departs in a slot drawn from the slot weights and then travels that slot's chain, as in `sample_departures()`, so the distribution 
+    is the mixture of the slots' distributions of `chain_distribution()` by the slot weights. 
+    param: slot_chains [list] The list of `CompiledConnection` chains of each slot, in travel order
+    param: slot_weights [np.ndarray] The chance of departing in each slot, or `None` for a single chain without departure slots
+    param: bin_widths [tuple] The 2D tuple of histogram bin widths for time [min] and distance [km]
+    param: num_locations [int] The number of location identifiers in the shared `LocationRegistry`
+    return: 2D tuple of the completed probability mass and a list of (pmf, mean, variance) for time and distance
+    """
+    if slot_weights is None:
+        return chain_distribution(slot_chains[0], bin_widths, num_locations)
+    slot_results = [chain_distribution(chain, bin_widths, num_locations) for chain in slot_chains]
+    completed_mass = float(sum(weight * slot_mass for weight, (slot_mass, _) in zip(slot_weights, slot_results)))
+    results = []
+    for metric in range(0, len(bin_widths)):
+        pmf = np.zeros(max(len(slot[metric][0]) for _, slot in slot_results), dtype=np.float64)
+        mean, moment_2 = 0.0, 0.0
+        for weight, (_, slot) in zip(slot_weights, slot_results):
+            slot_pmf, slot_mean, slot_variance = slot[metric]
+            pmf[:len(slot_pmf)] += weight * slot_pmf
+            mean += weight * slot_mean
+            moment_2 += weight * (slot_variance + slot_mean * slot_mean)
+        results.append((pmf, mean, max(0.0, moment_2 - mean * mean)))
+    return completed_mass, results
+
+def chunk_rng(seed: int, chunk_index: int) -> np.random.Generator:
+    """
+    Creates the random number generator of one chunk of a sample. Each chunk has its own stream derived from the sample seed, 
+    so any chunk can be re-drawn on its own and gives the same trips no matter which chunks were drawn before it. 
+    param: seed [int] The seed of the whole sample
+    param: chunk_index [int] The index of the chunk within the sample
+    return: The chunk's random number generator
+    """
+    return np.random.default_rng(np.random.SeedSequence(entropy=seed, spawn_key=(chunk_index,)))
+
+def write_trips(file, sample_id: str, time_min: np.ndarray, distance_km: np.ndarray, location_ids: np.ndarray, departure_slots: np.ndarray=None):
+    """
+    Writes sampled trips to an open results file as rows of (sample_id, time_min, distance_km, location_ids, departure_slot), where the 
+    visited location identifiers of a trip are separated by spaces. The departure slot is left empty for trips without one. 
+    param: file [file] The specified open file
+    param: sample_id [str] The unique identifier of the sample
+    param: time_min [np.ndarray] The time [min] of each trip
+    param: distance_km [np.ndarray] The distance [km] of each trip
+    param: location_ids [np.ndarray] The visited location identifiers of each trip
+    param: departure_slots [np.ndarray] Optional departure time slot of each trip, for trips across a `DepartureSweep`
+    """
+    time_min, distance_km = time_min.tolist(), distance_km.tolist()
+    slots = departure_slots.tolist() if departure_slots is not None else [""] * len(time_min)
+    file.writelines(f"{sample_id},{time_min[i]},{distance_km[i]},{' '.join(map(str, trip_locations))},{slots[i]}\n" for i, trip_locations in enumerate(location_ids.tolist()))
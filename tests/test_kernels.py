@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+pytest.importorskip("numba") # the parity of the compiled kernels can only be checked where Numba is installed
+from internal.kernels import *
+
+N = 2000
+
+@pytest.fixture(autouse=True)
+def restore_backend():
+    # every test switches backends; restore the selected one afterwards
+    selected = get_backend()
+    yield
+    set_backend(selected)
+
+def run_kernel(name: str, kernel):
+    """
+    Runs a kernel on the given backend.
+    param: name [str] The backend to run on
+    param: kernel [function] The kernel call, taking no arguments
+    return: The outputs of the kernel
+    """
+    set_backend(name)
+    return kernel()
+
+def draw_inputs(seed: int=0) -> tuple:
+    """
+    return: The arguments of draw_rows; a sorted origin index with some locations missing, so dead ends are exercised
+    """
+    rng = np.random.default_rng(seed)
+    origin_index = np.unique(rng.integers(0, N, N // 4))
+    origin_counts = rng.integers(1, 20, len(origin_index))
+    origin_starts = np.concatenate(([0], np.cumsum(origin_counts)[:-1]))
+    return origin_index, origin_starts, origin_counts, rng.integers(0, N, N), rng.random(N)
+
+def tile_inputs(seed: int=0) -> tuple:
+    """
+    return: The latitudes and longitudes of points on and between tiles, including exact ties and points off the grid
+    """
+    rng = np.random.default_rng(seed)
+    lats = np.concatenate((rng.uniform(55.5, 55.9, N), 55.6 + np.arange(0, 10) * 0.005 + 0.0025, [55.0, 56.0]))
+    lons = np.concatenate((rng.uniform(12.3, 12.7, N), 12.4 + np.arange(0, 10) * 0.005, [12.0, 13.0]))
+    return lats, lons
+
+@pytest.mark.parametrize("name", ["numba", "python"])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_draw_rows_parity(name, seed):
+    inputs = draw_inputs(seed)
+    expected_rows, expected_alive = run_kernel("numpy", lambda: draw_rows(*inputs))
+    rows, alive = run_kernel(name, lambda: draw_rows(*inputs))
+    assert np.array_equal(alive, expected_alive)
+    assert np.array_equal(rows, expected_rows)
+
+@pytest.mark.parametrize("name", ["numba", "python"])
+def test_draw_rows_parity_empty_index(name):
+    empty = np.zeros(0, dtype=np.int64)
+    inputs = (empty, empty, empty, np.arange(0, 10), np.linspace(0, 0.9, 10))
+    expected_rows, expected_alive = run_kernel("numpy", lambda: draw_rows(*inputs))
+    rows, alive = run_kernel(name, lambda: draw_rows(*inputs))
+    assert not alive.any() and np.array_equal(alive, expected_alive)
+    assert np.array_equal(rows, expected_rows)
+
+@pytest.mark.parametrize("name", ["numba", "python"])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_assign_tiles_parity(name, seed):
+    lats, lons = tile_inputs(seed)
+    expected_x, expected_y = run_kernel("numpy", lambda: assign_tiles(lats, lons, (55.5, 12.3), 0.004, 0.004, 100, 100))
+    tile_x, tile_y = run_kernel(name, lambda: assign_tiles(lats, lons, (55.5, 12.3), 0.004, 0.004, 100, 100))
+    assert np.array_equal(tile_x, expected_x)
+    assert np.array_equal(tile_y, expected_y)
+
+@pytest.mark.parametrize("name", ["numba", "python"])
+def test_assign_tiles_parity_flat_grid(name):
+    # a grid of one row or column has no spacing along it
+    lats, lons = tile_inputs()
+    expected_x, expected_y = run_kernel("numpy", lambda: assign_tiles(lats, lons, (55.5, 12.3), 0, 0.004, 1, 100))
+    tile_x, tile_y = run_kernel(name, lambda: assign_tiles(lats, lons, (55.5, 12.3), 0, 0.004, 1, 100))
+    assert not tile_x.any() and np.array_equal(tile_x, expected_x)
+    assert np.array_equal(tile_y, expected_y)